@@ -1,20 +1,28 @@
 """
 Admin API endpoints for document management and configuration
 """
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form, Query
 from pydantic import BaseModel
+from sqlalchemy import func
 from typing import List, Optional
+import aiofiles
+import asyncio
 import os
 import json
+import tempfile
+import logging
 from datetime import datetime
 
-from backend.models.database import get_db, Document, update_config_value, get_config_value
+from backend.core.config import get_settings
+from backend.models.database import get_db, Document, update_config_value, get_config_values
 from backend.utils.auth import admin_required
 from backend.core.pdf_processor import PDFProcessor
 from backend.core.vector_store import VectorStore
+from backend.api.dependencies import get_pdf_processor, get_vector_store
 from backend.models.database import SessionLocal
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 class ConfigRequest(BaseModel):
     chunk_size: int
@@ -37,45 +45,84 @@ class DocumentResponse(BaseModel):
 
 class DashboardDataResponse(BaseModel):
     documents: List[DocumentResponse]
+    total_documents: int
     config: dict
 
-# Initialize processors
-pdf_processor = PDFProcessor()
-vector_store = VectorStore()
+_KB = 1024
+_MB = 1024 * 1024
+
+# Uploads are streamed to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Columns needed to list documents, selected directly to skip ORM hydration
+_DOCUMENT_LIST_COLUMNS = (
+    Document.id,
+    Document.filename,
+    Document.file_size,
+    Document.upload_date,
+    Document.chunks_count,
+    Document.images_count
+)
+
+def _format_size(n: int) -> str:
+    """Format a byte count as a human readable KB/MB string"""
+    return f"{n / _MB:.1f} MB" if n > _MB else f"{n / _KB:.1f} KB"
+
+def _format_date(value: Optional[datetime]) -> str:
+    """Format a document upload date for display"""
+    return value.strftime("%Y-%m-%d") if value else ""
+
+def _count_active_documents(db) -> int:
+    """Count all active documents"""
+    return db.query(func.count(Document.id)).filter(Document.is_active == True).scalar()
+
+def _list_active_documents(db, limit: int, offset: int) -> List[dict]:
+    """Fetch a page of active documents, newest first, formatted for the admin UI"""
+    rows = (
+        db.query(*_DOCUMENT_LIST_COLUMNS)
+        .filter(Document.is_active == True)
+        .order_by(Document.upload_date.desc())
+        .offset(offset)
+        .limit(limit)
+        .all()
+    )
+    return [
+        {
+            "id": doc_id,
+            "name": filename,
+            "size": _format_size(file_size),
+            "date": _format_date(upload_date),
+            "chunks": chunks_count,
+            "images": images_count
+        }
+        for doc_id, filename, file_size, upload_date, chunks_count, images_count in rows
+    ]
 
 @router.get("/admin/dashboard-data")
 async def get_dashboard_data(
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
     db: SessionLocal = Depends(get_db),
     current_user: dict = Depends(admin_required)
 ):
     """Get all admin dashboard data in one request"""
     
-    # Get all documents
-    documents = db.query(Document).filter(Document.is_active == True).all()
-    
-    # Format document data
-    doc_list = []
-    for doc in documents:
-        doc_list.append(DocumentResponse(
-            id=doc.id,
-            name=doc.name,
-            size=f"{doc.size_bytes / (1024*1024):.1f} MB" if doc.size_bytes > 1024*1024 else f"{doc.size_bytes / 1024:.1f} KB",
-            date=doc.upload_date,
-            chunks=doc.chunks_count,
-            images=doc.images_count
-        ))
+    # Get a page of documents
+    doc_list = [DocumentResponse(**doc) for doc in _list_active_documents(db, limit, offset)]
     
     # Get current configuration
+    values = get_config_values(db, ["system_prompt", "chunk_size", "chunk_overlap", "temperature", "top_p"])
     config = {
-        "system_prompt": get_config_value(db, "system_prompt", ""),
-        "chunk_size": int(get_config_value(db, "chunk_size", "512")),
-        "chunk_overlap": int(get_config_value(db, "chunk_overlap", "50")),
-        "temperature": float(get_config_value(db, "temperature", "0.7")),
-        "top_p": float(get_config_value(db, "top_p", "1.0"))
+        "system_prompt": values.get("system_prompt", ""),
+        "chunk_size": int(values.get("chunk_size", "512")),
+        "chunk_overlap": int(values.get("chunk_overlap", "50")),
+        "temperature": float(values.get("temperature", "0.7")),
+        "top_p": float(values.get("top_p", "1.0"))
     }
     
     return DashboardDataResponse(
         documents=doc_list,
+        total_documents=_count_active_documents(db),
         config=config
     )
 
@@ -84,7 +131,9 @@ async def ingest_document(
     pdf_file: UploadFile = File(...),
     force_reprocess: bool = Form(False),
     current_user: dict = Depends(admin_required),
-    db: SessionLocal = Depends(get_db)
+    db: SessionLocal = Depends(get_db),
+    pdf_processor: PDFProcessor = Depends(get_pdf_processor),
+    vector_store: VectorStore = Depends(get_vector_store)
 ):
     """
     Ingest a PDF document into the knowledge base
@@ -94,100 +143,116 @@ async def ingest_document(
     if not pdf_file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
     
-    # Check file size
-    if pdf_file.size > 50 * 1024 * 1024:  # 50MB limit
-        raise HTTPException(status_code=413, detail="File too large. Maximum size is 50MB")
+    # Check if document already exists before writing anything to disk
+    existing_doc = db.query(Document).filter(Document.filename == pdf_file.filename).first()
+    if existing_doc and not force_reprocess:
+        raise HTTPException(
+            status_code=409, 
+            detail="Document already exists. Use force_reprocess=true to reprocess."
+        )
+    
+    upload_dir = "./data/pdfs"
+    file_path = os.path.join(upload_dir, pdf_file.filename)
+    max_upload_mb = get_settings().max_upload_size_mb
+    max_upload_bytes = max_upload_mb * _MB
+    tmp_path = None
     
     try:
-        # Save uploaded file temporarily
-        upload_dir = "./data/pdfs"
         os.makedirs(upload_dir, exist_ok=True)
         
-        file_path = os.path.join(upload_dir, pdf_file.filename)
+        # Stage the upload next to its final path: on a forced re-upload the
+        # current PDF is only replaced once the new one is fully indexed
+        fd, tmp_path = tempfile.mkstemp(dir=upload_dir, suffix=".part")
+        os.close(fd)
         
-        with open(file_path, "wb") as f:
-            content = await pdf_file.read()
-            f.write(content)
+        # Stream the upload to disk, enforcing the size limit as bytes arrive
+        # (the declared size is unreliable for chunked uploads)
+        file_size = 0
+        async with aiofiles.open(tmp_path, "wb") as f:
+            while chunk := await pdf_file.read(UPLOAD_CHUNK_SIZE):
+                file_size += len(chunk)
+                if file_size > max_upload_bytes:
+                    break
+                await f.write(chunk)
         
-        # Check if document already exists
-        existing_doc = db.query(Document).filter(Document.name == pdf_file.filename).first()
-        if existing_doc and not force_reprocess:
-            raise HTTPException(
-                status_code=409, 
-                detail="Document already exists. Use force_reprocess=true to reprocess."
-            )
+        if file_size > max_upload_bytes:
+            raise HTTPException(status_code=413, detail=f"File too large. Maximum size is {max_upload_mb}MB")
         
-        # Process PDF
-        chunks, images_count = pdf_processor.process_pdf(file_path, pdf_file.filename)
+        # Process PDF off the event loop
+        chunks, images_count = await asyncio.to_thread(pdf_processor.process_pdf, tmp_path, pdf_file.filename)
         
-        # Add chunks to vector store
-        chunks_added = vector_store.add_document_chunks(chunks)
+        # Add chunks to vector store; a re-upload swaps them in place, so the
+        # old chunks stay searchable if storing the new ones fails
+        if existing_doc:
+            chunks_added = await asyncio.to_thread(
+                vector_store.replace_document_chunks, pdf_file.filename, chunks
+            )
+        else:
+            chunks_added = await asyncio.to_thread(vector_store.add_document_chunks, chunks)
+        
+        os.replace(tmp_path, file_path)
         
         # Update or create document record
         if existing_doc:
-            # Delete old chunks from vector store
-            vector_store.delete_document(pdf_file.filename)
-            
-            # Update existing document
-            existing_doc.size_bytes = pdf_file.size
-            existing_doc.upload_date = datetime.now().strftime("%Y-%m-%d")
-            existing_doc.chunks_count = chunks_added
-            existing_doc.images_count = images_count
-            existing_doc.is_active = True
+            document = existing_doc
+            document.file_path = file_path
+            document.file_size = file_size
+            document.upload_date = datetime.now()
+            document.chunks_count = chunks_added
+            document.images_count = images_count
+            document.processed = True
+            document.is_active = True
         else:
-            # Create new document record
-            new_doc = Document(
-                name=pdf_file.filename,
-                size_bytes=pdf_file.size,
-                upload_date=datetime.now().strftime("%Y-%m-%d"),
+            document = Document(
+                filename=pdf_file.filename,
+                file_path=file_path,
+                file_size=file_size,
+                upload_date=datetime.now(),
                 chunks_count=chunks_added,
                 images_count=images_count,
+                processed=True,
                 is_active=True
             )
-            db.add(new_doc)
+            db.add(document)
         
         db.commit()
         
         return {
             "status": "success",
-            "document_id": existing_doc.id if existing_doc else None,
+            "document_id": document.id,
             "chunks_created": chunks_added,
             "images_extracted": images_count
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
-        # Clean up temporary file on error
-        if os.path.exists(file_path):
-            os.remove(file_path)
         raise HTTPException(status_code=500, detail=f"Document processing failed: {str(e)}")
+    finally:
+        # Only the staged upload is ever removed; an existing PDF stays in place
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 @router.get("/documents")
 async def list_documents(
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
     current_user: dict = Depends(admin_required),
     db: SessionLocal = Depends(get_db)
 ):
-    """List all indexed documents"""
-    
-    documents = db.query(Document).filter(Document.is_active == True).all()
+    """List indexed documents, newest first"""
     
-    doc_list = []
-    for doc in documents:
-        doc_list.append({
-            "id": doc.id,
-            "name": doc.name,
-            "size": f"{doc.size_bytes / (1024*1024):.1f} MB" if doc.size_bytes > 1024*1024 else f"{doc.size_bytes / 1024:.1f} KB",
-            "date": doc.upload_date,
-            "chunks": doc.chunks_count,
-            "images": doc.images_count
-        })
-    
-    return doc_list
+    return {
+        "items": _list_active_documents(db, limit, offset),
+        "total": _count_active_documents(db)
+    }
 
 @router.delete("/documents/{doc_id}")
 async def delete_document(
     doc_id: int,
     current_user: dict = Depends(admin_required),
-    db: SessionLocal = Depends(get_db)
+    db: SessionLocal = Depends(get_db),
+    vector_store: VectorStore = Depends(get_vector_store)
 ):
     """Delete a document from the knowledge base"""
     
@@ -198,7 +263,7 @@ async def delete_document(
     
     try:
         # Delete from vector store
-        chunks_deleted = vector_store.delete_document(document.name)
+        chunks_deleted = await asyncio.to_thread(vector_store.delete_document, document.filename)
         
         # Mark document as inactive
         document.is_active = False
@@ -216,37 +281,65 @@ async def delete_document(
 @router.post("/re-index")
 async def reindex_knowledge_base(
     current_user: dict = Depends(admin_required),
-    db: SessionLocal = Depends(get_db)
+    db: SessionLocal = Depends(get_db),
+    pdf_processor: PDFProcessor = Depends(get_pdf_processor),
+    vector_store: VectorStore = Depends(get_vector_store)
 ):
     """Trigger full re-indexing of all documents"""
     
     try:
-        # Clear vector store
-        vector_store.clear_all()
+        # Clear vector store and buffer all chunks for one bulk insert
+        await asyncio.to_thread(vector_store.clear_all)
+        vector_store.begin_bulk()
         
         # Get all active documents
         documents = db.query(Document).filter(Document.is_active == True).all()
         
+        # Re-process documents in parallel, bounded by the configured worker count.
+        # Page extraction runs in the PDF worker processes (PyMuPDF is not
+        # thread-safe); the threads here only wait on it, chunk and embed
+        semaphore = asyncio.Semaphore(max(1, get_settings().reindex_workers))
+        
+        async def reprocess(document):
+            if not os.path.exists(document.file_path):
+                return None
+            async with semaphore:
+                chunks, images_count = await asyncio.to_thread(
+                    pdf_processor.process_pdf, document.file_path, document.filename, use_pool=True
+                )
+                chunks_added = await asyncio.to_thread(vector_store.add_document_chunks_bulk, chunks)
+            return chunks_added, images_count
+        
+        # A failing document must not stop the others: every task settles
+        # before the buffered chunks are inserted
+        try:
+            results = await asyncio.gather(
+                *(reprocess(document) for document in documents), return_exceptions=True
+            )
+        finally:
+            # The index was already cleared, so keep whatever was processed
+            await asyncio.to_thread(vector_store.finish_bulk)
+        
         total_chunks = 0
         total_images = 0
+        failed = []
         
-        # Re-process each document
-        for document in documents:
-            pdf_path = os.path.join("./data/pdfs", document.name)
+        # Update document records in one transaction
+        for document, result in zip(documents, results):
+            if result is None:
+                continue
+            if isinstance(result, BaseException):
+                logger.error(f"❌ Re-indexing {document.filename} failed: {result}")
+                failed.append({"document": document.filename, "error": str(result)})
+                # Its chunks went with the cleared index
+                document.chunks_count = 0
+                continue
+            chunks_added, images_count = result
+            document.chunks_count = chunks_added
+            document.images_count = images_count
             
-            if os.path.exists(pdf_path):
-                # Re-process PDF
-                chunks, images_count = pdf_processor.process_pdf(pdf_path, document.name)
-                
-                # Add to vector store
-                chunks_added = vector_store.add_document_chunks(chunks)
-                
-                # Update document record
-                document.chunks_count = chunks_added
-                document.images_count = images_count
-                
-                total_chunks += chunks_added
-                total_images += images_count
+            total_chunks += chunks_added
+            total_images += images_count
         
         db.commit()
         
@@ -256,7 +349,8 @@ async def reindex_knowledge_base(
             "job_id": f"reindex-{int(datetime.now().timestamp())}",
             "total_chunks": total_chunks,
             "total_images": total_images,
-            "documents_processed": len(documents)
+            "documents_processed": len(documents) - len(failed),
+            "documents_failed": failed
         }
         
     except Exception as e:
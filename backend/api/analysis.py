@@ -1,18 +1,29 @@
 """
 Knowledge gap analysis API endpoints
 """
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query as QueryParam
+from sqlalchemy import func, case
 from typing import List
-import json
+from datetime import date, datetime, timedelta
+import re
 
-from backend.models.database import get_db, Query
+from backend.models.database import get_db, Query, load_json_list
 from backend.utils.auth import admin_required
 from backend.models.database import SessionLocal
 
 router = APIRouter()
 
+# Keywords tracked by the query pattern analysis
+COMMON_WORDS = ('password', 'email', 'vpn', 'printer', 'network', 'software', 'login', 'access', 'error', 'install')
+COMMON_WORDS_PATTERN = re.compile('|'.join(map(re.escape, COMMON_WORDS)), re.IGNORECASE)
+
+MS_PER_DAY = 86_400_000
+EPOCH_DATE = date(1970, 1, 1)
+
 @router.get("/analysis/gaps")
 async def get_knowledge_gaps(
+    limit: int = QueryParam(100, ge=1, le=1000),
+    offset: int = QueryParam(0, ge=0),
     current_user: dict = Depends(admin_required),
     db: SessionLocal = Depends(get_db)
 ):
@@ -20,30 +31,31 @@ async def get_knowledge_gaps(
     Get queries that received bad ratings - indicating knowledge gaps
     """
     
-    # Get all queries with bad ratings
-    bad_queries = db.query(Query).filter(Query.rating == "bad").order_by(Query.timestamp.desc()).all()
+    # Get a page of queries with bad ratings
+    bad_queries = db.query(
+        Query.id,
+        Query.timestamp,
+        Query.query,
+        Query.response_content,
+        Query.response_sources
+    ).filter(Query.rating == "bad").order_by(Query.timestamp.desc()).offset(offset).limit(limit).all()
     
-    gaps = []
-    for query in bad_queries:
-        # Parse JSON fields safely
-        try:
-            sources = json.loads(query.response_sources) if query.response_sources else []
-        except:
-            sources = []
-        
-        gaps.append({
-            "id": query.id,
-            "timestamp": query.timestamp,
-            "query": query.query,
+    gaps = [
+        {
+            "id": query_id,
+            "timestamp": timestamp,
+            "query": query_text,
             "response": {
-                "content": query.response_content,
-                "sources": sources
+                "content": response_content,
+                "sources": load_json_list(response_sources)
             }
-        })
+        }
+        for query_id, timestamp, query_text, response_content, response_sources in bad_queries
+    ]
     
     return {
         "gaps": gaps,
-        "total": len(gaps)
+        "total": db.query(func.count(Query.id)).filter(Query.rating == "bad").scalar()
     }
 
 @router.get("/analysis/patterns")
@@ -56,17 +68,14 @@ async def analyze_query_patterns(
     """
     
     # Get all queries from last 30 days
-    queries = db.query(Query).order_by(Query.timestamp.desc()).limit(1000).all()
+    queries = db.query(Query.query).order_by(Query.timestamp.desc()).limit(1000).all()
     
-    # Simple keyword analysis
+    # Simple keyword analysis, one regex scan per query
     keyword_counts = {}
-    common_words = ['password', 'email', 'vpn', 'printer', 'network', 'software', 'login', 'access', 'error', 'install']
     
-    for query in queries:
-        query_lower = query.query.lower()
-        for word in common_words:
-            if word in query_lower:
-                keyword_counts[word] = keyword_counts.get(word, 0) + 1
+    for (query_text,) in queries:
+        for word in {match.lower() for match in COMMON_WORDS_PATTERN.findall(query_text)}:
+            keyword_counts[word] = keyword_counts.get(word, 0) + 1
     
     # Sort by frequency
     patterns = [
@@ -89,37 +98,35 @@ async def analyze_satisfaction_trends(
     Analyze satisfaction trends over time
     """
     
-    # Get rated queries
-    rated_queries = db.query(Query).filter(Query.rating.isnot(None)).order_by(Query.timestamp.desc()).limit(500).all()
-    
-    # Calculate daily satisfaction
-    daily_stats = {}
-    
-    for query in rated_queries:
-        # Convert timestamp to date
-        from datetime import datetime
-        date = datetime.fromtimestamp(query.timestamp / 1000).strftime('%Y-%m-%d')
-        
-        if date not in daily_stats:
-            daily_stats[date] = {'good': 0, 'bad': 0, 'total': 0}
-        
-        daily_stats[date][query.rating] += 1
-        daily_stats[date]['total'] += 1
+    # Bucket the last 500 rated queries per local day in SQL. Integer division
+    # of the millisecond timestamp works on every backend; the local UTC offset
+    # is applied in Python instead of through a dialect-specific date function.
+    offset_ms = int(datetime.now().astimezone().utcoffset().total_seconds() * 1000)
+    rated = db.query(Query.timestamp, Query.rating).filter(
+        Query.rating.isnot(None)
+    ).order_by(Query.timestamp.desc()).limit(500).subquery()
+    day = ((rated.c.timestamp + offset_ms) // MS_PER_DAY).label('day')
+    daily_stats = db.query(
+        day,
+        func.sum(case((rated.c.rating == 'good', 1), else_=0)),
+        func.sum(case((rated.c.rating == 'bad', 1), else_=0))
+    ).group_by(day).order_by(day).all()
     
     # Calculate satisfaction percentages
     trends = []
-    for date, stats in sorted(daily_stats.items()):
-        satisfaction = (stats['good'] / stats['total'] * 100) if stats['total'] > 0 else 0
+    for day_number, good, bad in daily_stats:
+        total = good + bad
+        satisfaction = (good / total * 100) if total > 0 else 0
         trends.append({
-            "date": date,
+            "date": (EPOCH_DATE + timedelta(days=day_number)).strftime('%Y-%m-%d'),
             "satisfaction_percent": round(satisfaction, 1),
-            "total_ratings": stats['total'],
-            "good_ratings": stats['good'],
-            "bad_ratings": stats['bad']
+            "total_ratings": total,
+            "good_ratings": good,
+            "bad_ratings": bad
         })
     
     return {
         "trends": trends[-30:],  # Last 30 days
         "overall_satisfaction": round(sum([t['satisfaction_percent'] for t in trends]) / len(trends), 1) if trends else 0,
-        "total_rated_queries": len(rated_queries)
-    }
\ No newline at end of file
+        "total_rated_queries": sum(t['total_ratings'] for t in trends)
+    }
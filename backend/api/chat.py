@@ -1,21 +1,27 @@
 """
 Chat API endpoints with Server-Sent Events streaming
 """
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from datetime import datetime
-import json
+from cachetools import TTLCache
+import hashlib
+import orjson
 import asyncio
+import logging
+import time
 import uuid
 
 from backend.models.database import get_db, Query
 from backend.core.llm_client import LLMClient
-from backend.core.vector_store import VectorStore
+from backend.core.vector_store import VectorStore, get_index_generation
 from backend.core.suggestions import generate_suggestions
-from backend.utils.streaming import generate_stream_response
+from backend.utils.streaming import generate_stream_response, format_sse_data
+from backend.api.dependencies import get_llm_client, get_vector_store
 from backend.models.database import SessionLocal
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 class ChatRequest(BaseModel):
@@ -26,12 +32,39 @@ class FeedbackRequest(BaseModel):
     message_id: str
     rating: str  # 'good' or 'bad'
 
-# Initialize components
-llm_client = LLMClient()
-vector_store = VectorStore()
+# Streamed tokens are flushed once this many characters are buffered
+# or this many seconds have passed since the last frame
+STREAM_FLUSH_CHARS = 64
+STREAM_FLUSH_INTERVAL = 0.02
+
+# Retrieval results and suggestions for recently seen queries
+_chunk_cache = TTLCache(maxsize=1024, ttl=300)
+_suggestion_cache = TTLCache(maxsize=1024, ttl=300)
+
+def _query_cache_key(query: str) -> tuple:
+    """Cache key for a query, scoped to the current vector index contents"""
+    digest = hashlib.blake2b(query.strip().lower().encode(), digest_size=16).digest()
+    return get_index_generation(), digest
+
+def _persist_query(**fields):
+    """Store a chat query record using its own database session"""
+    db = SessionLocal()
+    try:
+        db.add(Query(**fields))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"❌ Failed to store query {fields.get('id')}: {e}")
+    finally:
+        db.close()
 
 @router.post("/chat")
-async def chat_stream(request: ChatRequest, db: SessionLocal = Depends(get_db)):
+async def chat_stream(
+    request: ChatRequest,
+    background_tasks: BackgroundTasks,
+    llm_client: LLMClient = Depends(get_llm_client),
+    vector_store: VectorStore = Depends(get_vector_store)
+):
     """
     Stream chat response using Server-Sent Events
     """
@@ -39,13 +72,18 @@ async def chat_stream(request: ChatRequest, db: SessionLocal = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Query cannot be empty")
     
     # Generate unique message ID
-    message_id = f"bot-{int(datetime.now().timestamp() * 1000)}"
-    start_time = datetime.now()
+    start_ns = time.time_ns()
+    start_ms = start_ns // 1_000_000
+    message_id = f"bot-{start_ms}"
     
     async def generate():
         try:
             # Retrieve relevant chunks from vector store
-            chunks = await vector_store.search(request.query, limit=5)
+            cache_key = _query_cache_key(request.query)
+            chunks = _chunk_cache.get(cache_key)
+            if chunks is None:
+                chunks = await vector_store.search(request.query, limit=5)
+                _chunk_cache[cache_key] = chunks
             
             # Build context for LLM
             context = ""
@@ -65,48 +103,60 @@ async def chat_stream(request: ChatRequest, db: SessionLocal = Depends(get_db)):
                     "page": chunk['page']
                 })
             
-            # Stream content generation
-            full_response = ""
+            # Stream content generation, coalescing tokens into larger frames
+            loop = asyncio.get_running_loop()
+            parts = []
+            buffer = []
+            buffered_chars = 0
+            last_flush = loop.time()
             async for token in llm_client.generate_stream(request.query, context):
-                full_response += token
-                yield f"data: {json.dumps({'type': 'content', 'content': token})}\\n\\n"
-                await asyncio.sleep(0.01)  # Small delay for smooth streaming
+                parts.append(token)
+                buffer.append(token)
+                buffered_chars += len(token)
+                if buffered_chars >= STREAM_FLUSH_CHARS or loop.time() - last_flush >= STREAM_FLUSH_INTERVAL:
+                    yield format_sse_data("content", {"content": "".join(buffer)})
+                    buffer.clear()
+                    buffered_chars = 0
+                    last_flush = loop.time()
+            if buffer:
+                yield format_sse_data("content", {"content": "".join(buffer)})
+            full_response = "".join(parts)
             
             # Generate suggestions
-            suggestions = await generate_suggestions(request.query, chunks)
+            suggestions = _suggestion_cache.get(cache_key)
+            if suggestions is None:
+                suggestions = await generate_suggestions(request.query, chunks, llm_client)
+                _suggestion_cache[cache_key] = suggestions
             
             # Send metadata
-            yield f"data: {json.dumps({'type': 'sources', 'sources': sources})}\\n\\n"
-            yield f"data: {json.dumps({'type': 'images', 'images': list(set(images))})}\\n\\n"
-            yield f"data: {json.dumps({'type': 'suggestions', 'suggestions': suggestions})}\\n\\n"
-            yield f"data: {json.dumps({'type': 'done'})}\\n\\n"
+            yield format_sse_data("sources", {"sources": sources})
+            yield format_sse_data("images", {"images": list(set(images))})
+            yield format_sse_data("suggestions", {"suggestions": suggestions})
+            yield format_sse_data("done", {})
             
-            # Store in database
-            response_time = (datetime.now() - start_time).total_seconds() * 1000
-            query_record = Query(
+            # Store in database after the response has been sent
+            background_tasks.add_task(
+                _persist_query,
                 id=message_id,
-                timestamp=int(datetime.now().timestamp() * 1000),
+                timestamp=start_ms,
                 query=request.query,
                 response_content=full_response,
-                response_sources=json.dumps(sources),
-                response_images=json.dumps(list(set(images))),
-                response_suggestions=json.dumps(suggestions),
-                response_time_ms=int(response_time),
+                response_sources=orjson.dumps(sources).decode(),
+                response_images=orjson.dumps(list(set(images))).decode(),
+                response_suggestions=orjson.dumps(suggestions).decode(),
+                response_time_ms=(time.time_ns() - start_ns) // 1_000_000,
                 chunks_retrieved=len(chunks)
             )
-            db.add(query_record)
-            db.commit()
             
         except Exception as e:
-            yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\\n\\n"
+            yield format_sse_data("error", {"error": str(e)})
     
     return StreamingResponse(
         generate(),
-        media_type="text/plain",
+        media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "Content-Type": "text/event-stream"
+            "Connection": "keep-alive"
         }
     )
 
@@ -0,0 +1,24 @@
+"""
+Shared component dependencies for API endpoints
+
+The heavy clients (vector store, LLM, PDF processor) are created once in the
+application lifespan and stored on app.state; endpoints receive them through
+these FastAPI dependencies.
+"""
+from fastapi import Request
+
+from backend.core.llm_client import LLMClient
+from backend.core.pdf_processor import PDFProcessor
+from backend.core.vector_store import VectorStore
+
+def get_vector_store(request: Request) -> VectorStore:
+    """Dependency function to get the shared vector store"""
+    return request.app.state.vector_store
+
+def get_llm_client(request: Request) -> LLMClient:
+    """Dependency function to get the shared LLM client"""
+    return request.app.state.llm_client
+
+def get_pdf_processor(request: Request) -> PDFProcessor:
+    """Dependency function to get the shared PDF processor"""
+    return request.app.state.pdf_processor
@@ -3,13 +3,17 @@ FastAPI main application entry point for RAG Demo
 """
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 import logging
 import os
 
-from backend.core.config import get_settings
+from backend.core.config import get_settings, ensure_directories
 from backend.models.database import init_db
+from backend.core.llm_client import LLMClient
+from backend.core.pdf_processor import PDFProcessor
+from backend.core.vector_store import VectorStore
 from backend.api import auth, chat, admin, metrics, analysis
 
 # Configure logging
@@ -22,29 +26,38 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("🚀 Starting RAG Demo backend...")
     settings = get_settings()
+    ensure_directories()
     
     # Initialize database
     init_db()
     logger.info("✅ Database initialized")
     
-    # Initialize vector store
-    # Vector store initialization will be handled by core modules
+    # Initialize shared components (injected via backend.api.dependencies)
+    app.state.vector_store = VectorStore()
     logger.info("✅ Vector store ready")
     
-    # Initialize LLM
-    # LLM initialization will be handled by llm_client module
-    logger.info("✅ LLM ready")
+    app.state.llm_client = LLMClient()
+    logger.info("✅ LLM client ready (model loads on first request)")
+    
+    app.state.pdf_processor = PDFProcessor()
+    
+    # Prime CPU sampling for the metrics endpoints
+    metrics.prime_system_stats()
     
     yield
     
     # Shutdown
     logger.info("🛑 Shutting down RAG Demo backend...")
+    del app.state.vector_store
+    del app.state.llm_client
+    del app.state.pdf_processor
 
 # Create FastAPI app with lifespan management
 app = FastAPI(
     title="RAG Demo API",
     description="Retrieval-Augmented Generation chatbot backend",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -57,11 +70,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class ImmutableStaticFiles(StaticFiles):
+    """Static files served with long-lived cache headers
+    
+    Extracted image filenames embed a hash of the image bytes, so a given URL
+    never changes content. Browsers and CDNs may cache them indefinitely and
+    revalidate via the ETag/Last-Modified headers Starlette already sets.
+    """
+    
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
 # Mount static files for images
 if not os.path.exists("./data/images"):
     os.makedirs("./data/images", exist_ok=True)
     
-app.mount("/images", StaticFiles(directory="./data/images"), name="images")
+app.mount("/images", ImmutableStaticFiles(directory="./data/images"), name="images")
 
 # Include API routers
 app.include_router(chat.router, prefix="/api", tags=["chat"])
@@ -2,21 +2,52 @@
 Metrics API endpoints for performance monitoring
 """
 from fastapi import APIRouter, Depends
-from sqlalchemy import func
+from sqlalchemy import func, case
 from datetime import datetime, timedelta
 import time
 import psutil
 import os
+import re
 
-from backend.models.database import get_db, Query, Document
+from backend.models.database import get_db, Query, Document, load_json_list
 from backend.core.vector_store import VectorStore
+from backend.api.dependencies import get_vector_store
 from backend.utils.auth import admin_required
 from backend.models.database import SessionLocal
 
 router = APIRouter()
 
-# Initialize vector store for stats
-vector_store = VectorStore()
+# Keywords used to group today's queries on the metrics dashboard
+COMMON_QUERY_KEYWORDS = ('password', 'vpn', 'printer', 'email', 'network', 'software')
+COMMON_QUERY_PATTERN = re.compile('|'.join(map(re.escape, COMMON_QUERY_KEYWORDS)), re.IGNORECASE)
+
+# psutil readings are shared between requests for a few seconds
+SYSTEM_STATS_TTL_SECONDS = 3
+_system_stats_cache = (0.0, None)
+
+def prime_system_stats():
+    """Start psutil's CPU sampling so later non-blocking reads are meaningful"""
+    psutil.cpu_percent(interval=None)
+
+def _get_system_stats() -> dict:
+    """Get cached CPU, memory and disk readings"""
+    global _system_stats_cache
+    
+    now = time.monotonic()
+    cached_at, stats = _system_stats_cache
+    if stats is not None and now - cached_at < SYSTEM_STATS_TTL_SECONDS:
+        return stats
+    
+    stats = {
+        # Non-blocking: usage since the previous call
+        "cpu_percent": psutil.cpu_percent(interval=None),
+        "memory": psutil.virtual_memory(),
+        "disk": psutil.disk_usage('/'),
+        "process_rss": psutil.Process(os.getpid()).memory_info().rss
+    }
+    _system_stats_cache = (now, stats)
+    return stats
+
 
 @router.get("/metrics")
 async def get_metrics(
@@ -30,16 +61,21 @@ async def get_metrics(
     today_start = datetime.combine(now.date(), datetime.min.time())
     today_timestamp = int(today_start.timestamp() * 1000)
     
-    # Get queries from today
-    today_queries = db.query(Query).filter(Query.timestamp >= today_timestamp).all()
+    # Aggregate today's queries in a single SQL pass; AVG skips the NULLs the
+    # CASE yields for queries without a recorded (non-zero) response time
+    today_filter = Query.timestamp >= today_timestamp
+    total_queries, avg_response_time, good_ratings, bad_ratings = db.query(
+        func.count(Query.id),
+        func.avg(case((Query.response_time_ms > 0, Query.response_time_ms))),
+        func.sum(case((Query.rating == 'good', 1), else_=0)),
+        func.sum(case((Query.rating == 'bad', 1), else_=0))
+    ).filter(today_filter).one()
     
-    # Calculate average response time
-    response_times = [q.response_time_ms for q in today_queries if q.response_time_ms]
-    avg_response_time = sum(response_times) / len(response_times) if response_times else 0
+    avg_response_time = avg_response_time or 0
+    good_ratings = good_ratings or 0
+    bad_ratings = bad_ratings or 0
     
     # Calculate search accuracy (placeholder - would need more sophisticated metrics)
-    good_ratings = len([q for q in today_queries if q.rating == 'good'])
-    bad_ratings = len([q for q in today_queries if q.rating == 'bad'])
     total_ratings = good_ratings + bad_ratings
     search_accuracy = (good_ratings / total_ratings * 100) if total_ratings > 0 else 0
     
@@ -47,8 +83,7 @@ async def get_metrics(
     system_uptime = 99.9  # Would calculate actual uptime in production
     
     # Memory usage
-    process = psutil.Process(os.getpid())
-    memory_usage = process.memory_info().rss / (1024 * 1024 * 1024)  # GB
+    memory_usage = _get_system_stats()["process_rss"] / (1024 * 1024 * 1024)  # GB
     
     # Technical metrics
     technical_metrics = [
@@ -78,29 +113,26 @@ async def get_metrics(
         }
     ]
     
-    # User engagement metrics
-    satisfaction_scores = [5 if q.rating == 'good' else 1 if q.rating == 'bad' else 3 for q in today_queries]
-    avg_satisfaction = sum(satisfaction_scores) / len(satisfaction_scores) if satisfaction_scores else 0
-    fallback_rate = (bad_ratings / len(today_queries) * 100) if today_queries else 0
+    # User engagement metrics (good = 5, bad = 1, unrated = 3)
+    unrated = total_queries - total_ratings
+    avg_satisfaction = (good_ratings * 5 + bad_ratings + unrated * 3) / total_queries if total_queries else 0
+    fallback_rate = (bad_ratings / total_queries * 100) if total_queries else 0
     
     user_metrics = {
-        "questionsToday": len(today_queries),
+        "questionsToday": total_queries,
         "satisfaction": round(avg_satisfaction, 1),
         "fallbackRate": f"{fallback_rate:.0f}%"
     }
     
-    # Common queries analysis
+    # Common queries analysis, one regex scan per query
     query_counts = {}
-    for query in today_queries:
-        query_lower = query.query.lower()
-        # Simple keyword extraction
-        for word in ['password', 'vpn', 'printer', 'email', 'network', 'software']:
-            if word in query_lower:
-                query_counts[word] = query_counts.get(word, 0) + 1
+    for (query_text,) in db.query(Query.query).filter(today_filter):
+        for word in {match.lower() for match in COMMON_QUERY_PATTERN.findall(query_text)}:
+            query_counts[word] = query_counts.get(word, 0) + 1
     
     # Add "other" category
     accounted_queries = sum(query_counts.values())
-    other_queries = max(0, len(today_queries) - accounted_queries)
+    other_queries = max(0, total_queries - accounted_queries)
     if other_queries > 0:
         query_counts['other'] = other_queries
     
@@ -128,31 +160,15 @@ async def get_query_history(
     
     history = []
     for query in queries:
-        # Parse JSON fields safely
-        try:
-            sources = eval(query.response_sources) if query.response_sources else []
-        except:
-            sources = []
-            
-        try:
-            images = eval(query.response_images) if query.response_images else []
-        except:
-            images = []
-            
-        try:
-            suggestions = eval(query.response_suggestions) if query.response_suggestions else []
-        except:
-            suggestions = []
-        
         history.append({
             "id": query.id,
             "timestamp": query.timestamp,
             "query": query.query,
             "response": {
                 "content": query.response_content,
-                "sources": sources,
-                "images": images,
-                "suggestions": suggestions
+                "sources": load_json_list(query.response_sources),
+                "images": load_json_list(query.response_images),
+                "suggestions": load_json_list(query.response_suggestions)
             },
             "rating": query.rating
         })
@@ -160,7 +176,7 @@ async def get_query_history(
     return history
 
 @router.get("/system-status")
-async def get_system_status():
+async def get_system_status(vector_store: VectorStore = Depends(get_vector_store)):
     """Get current system status"""
     
     try:
@@ -168,9 +184,10 @@ async def get_system_status():
         vector_stats = vector_store.get_collection_stats()
         
         # System resources
-        cpu_percent = psutil.cpu_percent(interval=1)
-        memory = psutil.virtual_memory()
-        disk = psutil.disk_usage('/')
+        system_stats = _get_system_stats()
+        cpu_percent = system_stats["cpu_percent"]
+        memory = system_stats["memory"]
+        disk = system_stats["disk"]
         
         return {
             "status": "healthy",
@@ -0,0 +1,409 @@
+"""
+Continuous batching for llama.cpp inference
+Multiplexes concurrent generations into shared llama_decode calls using sequence ids
+"""
+import asyncio
+import codecs
+import ctypes
+import logging
+import queue
+import threading
+import time
+from typing import AsyncGenerator, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+try:
+    import llama_cpp
+    LLAMA_CPP_AVAILABLE = True
+except ImportError:
+    LLAMA_CPP_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Context budget per sequence, same as the single-stream n_ctx
+SEQ_CTX = 4096
+
+# Number of trailing tokens the repeat penalty looks at (llama.cpp default)
+REPEAT_LAST_N = 64
+
+# Sampling defaults of Llama.create_completion, so batched and single-stream
+# generation sample the same way when a caller leaves them unset
+SAMPLING_DEFAULTS = {
+    'temperature': 0.8,
+    'top_p': 0.95,
+    'top_k': 40,
+    'min_p': 0.05,
+    'repeat_penalty': 1.0
+}
+
+# How long an idle engine waits for more requests before prefilling, so that
+# near-simultaneous prompts are packed into the same decode calls
+PREFILL_COALESCE_SECONDS = 0.01
+
+_END = object()
+
+class _Sequence:
+    """One in-flight generation request"""
+    
+    def __init__(self, prompt: str, prefix: str, params: Dict, emit):
+        self.prompt = prompt
+        self.prefix = prefix
+        self.params = params
+        self.emit = emit
+        self.cancelled = False
+        self.seq_id = -1
+        self.n_past = 0
+        self.tokens: List[int] = []
+        self.n_generated = 0
+        self.max_tokens = params['max_tokens']
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        self.pending = ""
+
+class _Candidates:
+    """Reusable llama_token_data_array over the whole vocabulary"""
+    
+    def __init__(self, n_vocab: int):
+        self.n_vocab = n_vocab
+        self.data = np.recarray(
+            (n_vocab,), dtype=np.dtype([("id", np.intc), ("logit", np.single), ("p", np.single)], align=True)
+        )
+        self.ids = np.arange(n_vocab, dtype=np.intc)
+        self.array = llama_cpp.llama_token_data_array(
+            data=self.data.ctypes.data_as(llama_cpp.llama_token_data_p), size=n_vocab, sorted=False
+        )
+    
+    def load(self, logits: np.ndarray):
+        """
+        Reset the candidates to every token with the given logits
+        
+        Args:
+            logits: Logits row for one batch position
+        
+        Returns:
+            Pointer to the array for the llama_sample_* functions
+        """
+        self.data.id[:] = self.ids
+        self.data.logit[:] = logits
+        self.data.p[:] = 0
+        self.array.size = self.n_vocab
+        self.array.sorted = False
+        return ctypes.byref(self.array)
+
+class BatchedInferenceEngine:
+    """
+    Runs every generation for a model on one thread, decoding one token for
+    each active sequence per llama_decode call
+    
+    Each request gets its own llama.cpp sequence id in a shared context, so
+    N concurrent streams cost one pass over the weights per step instead of N.
+    A constant prompt prefix is evaluated once into a reserved sequence and
+    its KV cells are shared with every request that starts with it.
+    """
+    
+    def __init__(self, llama, max_parallel_seqs: int, runtime: Dict,
+                 tokenize: Optional[Callable[[str], List[int]]] = None):
+        """
+        Args:
+            llama: Loaded llama_cpp.Llama instance (provides weights and tokenizer)
+            max_parallel_seqs: Maximum number of sequences decoded together
+            runtime: Thread and batch sizing (see llama_runtime_kwargs)
+            tokenize: Prompt text -> token ids (defaults to llama.tokenize)
+        """
+        self.llama = llama
+        self._tokenize = tokenize or (
+            lambda text: llama.tokenize(text.encode("utf-8"), add_bos=False, special=True)
+        )
+        self.max_seqs = max(1, max_parallel_seqs)
+        self.n_batch = max(runtime['n_batch'], self.max_seqs)
+        self.n_vocab = llama.n_vocab()
+        
+        params = llama_cpp.llama_context_default_params()
+        params.n_ctx = SEQ_CTX * self.max_seqs
+        params.n_batch = self.n_batch
+        params.n_ubatch = min(runtime['n_ubatch'], self.n_batch)
+        params.n_seq_max = self.max_seqs + 1  # plus the prefix sequence
+        params.n_threads = runtime['n_threads']
+        params.n_threads_batch = runtime['n_threads_batch']
+        
+        self.ctx = llama_cpp.llama_new_context_with_model(llama.model, params)
+        if not self.ctx:
+            raise RuntimeError("Failed to create batched llama.cpp context")
+        self.batch = llama_cpp.llama_batch_init(self.n_batch, 0, 1)
+        
+        self._candidates = _Candidates(self.n_vocab)
+        self._jobs: queue.Queue = queue.Queue()
+        self._free_seq_ids = list(range(self.max_seqs))
+        self._prefix_seq_id = self.max_seqs
+        self._prefix_text: Optional[str] = None
+        self._prefix_tokens: List[int] = []
+        self._active: Dict[int, _Sequence] = {}
+        self._closed = False
+        
+        self._thread = threading.Thread(target=self._run, name="llm-batch", daemon=True)
+        self._thread.start()
+        logger.info(f"✅ Batched inference ready: {self.max_seqs} parallel sequences")
+    
+    async def generate(self, prompt: str, prefix: str = "", **params) -> AsyncGenerator[str, None]:
+        """
+        Stream text for a prompt through the shared batch
+        
+        Args:
+            prompt: Complete prompt text
+            prefix: Leading part of the prompt that is the same across requests
+                (e.g. the system prompt); its KV cache is computed once and reused
+            **params: temperature, top_p, top_k, min_p, repeat_penalty, max_tokens, stop
+        
+        Yields:
+            Text pieces as they are sampled
+        """
+        loop = asyncio.get_running_loop()
+        out: asyncio.Queue = asyncio.Queue()
+        
+        def emit(item):
+            try:
+                loop.call_soon_threadsafe(out.put_nowait, item)
+            except RuntimeError:
+                # Event loop already closed
+                seq.cancelled = True
+        
+        seq = _Sequence(prompt, prefix, {
+            **{name: params.get(name, default) for name, default in SAMPLING_DEFAULTS.items()},
+            'max_tokens': params.get('max_tokens', 1500),
+            'stop': tuple(params.get('stop') or ())
+        }, emit)
+        self._jobs.put(seq)
+        
+        try:
+            while (item := await out.get()) is not _END:
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            seq.cancelled = True
+    
+    def close(self):
+        """Stop the inference thread and free the context"""
+        if self._closed:
+            return
+        self._closed = True
+        self._jobs.put(None)
+        self._thread.join()
+        llama_cpp.llama_batch_free(self.batch)
+        llama_cpp.llama_free(self.ctx)
+    
+    def _run(self):
+        """Inference thread: admit new sequences, then step all active ones"""
+        while not self._closed:
+            try:
+                self._admit(block=not self._active)
+                self._drop_cancelled()
+                if self._active:
+                    self._step()
+            except Exception as e:
+                logger.error(f"❌ Batched decode failed: {e}")
+                for seq in list(self._active.values()):
+                    self._finish(seq, RuntimeError(f"Generation failed: {e}"))
+        
+        for seq in list(self._active.values()):
+            self._finish(seq, RuntimeError("Inference engine closed"))
+    
+    def _admit(self, block: bool):
+        """Take queued requests while sequence slots are free and prefill them together"""
+        new_seqs = []
+        deadline = None
+        while len(new_seqs) < len(self._free_seq_ids) and not self._closed:
+            try:
+                if block:
+                    seq = self._jobs.get()
+                elif deadline is not None:
+                    seq = self._jobs.get(timeout=max(0.0, deadline - time.monotonic()))
+                else:
+                    seq = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            if seq is None:
+                self._closed = True
+                break
+            if block:
+                # The engine was idle: give near-simultaneous requests a moment to arrive
+                block = False
+                deadline = time.monotonic() + PREFILL_COALESCE_SECONDS
+            if not seq.cancelled:
+                new_seqs.append(seq)
+        
+        if self._closed:
+            for seq in new_seqs:
+                self._finish(seq, RuntimeError("Inference engine closed"))
+        elif new_seqs:
+            self._prefill(new_seqs)
+    
+    def _prefill(self, seqs: List[_Sequence]):
+        """
+        Prefill new sequences with their prompts packed into shared batches
+        
+        Each prompt keeps its own sequence id and positions starting at 0, so
+        llama.cpp's KV masking keeps the prompts independent while one
+        llama_decode call processes several of them.
+        """
+        ready = []
+        for seq in seqs:
+            try:
+                seq.tokens = list(self._tokenize(seq.prompt))
+                if len(seq.tokens) >= SEQ_CTX:
+                    raise ValueError(f"Prompt is {len(seq.tokens)} tokens, exceeding the {SEQ_CTX} token context")
+            except Exception as e:
+                self._finish(seq, e)
+                continue
+            seq.max_tokens = min(seq.max_tokens, SEQ_CTX - len(seq.tokens))
+            seq.seq_id = self._free_seq_ids.pop()
+            self._active[seq.seq_id] = seq
+            ready.append(seq)
+        
+        # Start from the cached prefix KV where the prompt begins with it
+        starts = {}
+        for seq in ready:
+            if seq.prefix and seq.prefix != self._prefix_text:
+                self._cache_prefix(seq.prefix)
+            cached = len(self._prefix_tokens)
+            if seq.prefix == self._prefix_text and cached < len(seq.tokens) and seq.tokens[:cached] == self._prefix_tokens:
+                llama_cpp.llama_kv_cache_seq_cp(self.ctx, self._prefix_seq_id, seq.seq_id, -1, -1)
+                starts[seq.seq_id] = cached
+        
+        # Only each prompt's final token needs logits
+        entries = [
+            (seq.tokens[pos], pos, seq.seq_id, pos == len(seq.tokens) - 1)
+            for seq in ready
+            for pos in range(starts.get(seq.seq_id, 0), len(seq.tokens))
+        ]
+        for start in range(0, len(entries), self.n_batch):
+            piece = entries[start:start + self.n_batch]
+            self._decode(piece)
+            
+            # Logits are only valid until the next decode, so sample right away
+            for i, (_, _, seq_id, want_logits) in enumerate(piece):
+                if want_logits:
+                    seq = self._active[seq_id]
+                    seq.n_past = len(seq.tokens)
+                    self._accept(seq, self._sample(seq, i))
+    
+    def _cache_prefix(self, prefix: str):
+        """Evaluate a new shared prefix into the reserved prefix sequence"""
+        tokens = list(self._tokenize(prefix))
+        
+        # Cells still used by running sequences stay; only the prefix's claim is dropped
+        llama_cpp.llama_kv_cache_seq_rm(self.ctx, self._prefix_seq_id, -1, -1)
+        self._prefix_text = None
+        self._prefix_tokens = []
+        
+        for start in range(0, len(tokens), self.n_batch):
+            piece = tokens[start:start + self.n_batch]
+            self._decode([(token, start + i, self._prefix_seq_id, False) for i, token in enumerate(piece)])
+        
+        self._prefix_text = prefix
+        self._prefix_tokens = tokens
+    
+    def _step(self):
+        """Decode the latest token of every active sequence in one call"""
+        seqs = list(self._active.values())
+        self._decode([(seq.tokens[-1], seq.n_past, seq.seq_id, True) for seq in seqs])
+        
+        for i, seq in enumerate(seqs):
+            seq.n_past += 1
+            self._accept(seq, self._sample(seq, i))
+    
+    def _decode(self, entries: Sequence[tuple]):
+        """Fill the batch with (token, pos, seq_id, want_logits) and decode it"""
+        batch = self.batch
+        for i, (token, pos, seq_id, want_logits) in enumerate(entries):
+            batch.token[i] = token
+            batch.pos[i] = pos
+            batch.n_seq_id[i] = 1
+            batch.seq_id[i][0] = seq_id
+            batch.logits[i] = want_logits
+        batch.n_tokens = len(entries)
+        
+        result = llama_cpp.llama_decode(self.ctx, batch)
+        if result != 0:
+            raise RuntimeError(f"llama_decode returned {result}")
+    
+    def _sample(self, seq: _Sequence, batch_index: int) -> int:
+        """
+        Sample the next token with llama.cpp's samplers, in the order
+        Llama.sample applies them (repeat penalty, top-k, top-p, min-p, temperature)
+        """
+        params = seq.params
+        logits = np.ctypeslib.as_array(
+            llama_cpp.llama_get_logits_ith(self.ctx, batch_index), shape=(self.n_vocab,)
+        )
+        candidates = self._candidates.load(logits)
+        
+        penalty = params['repeat_penalty']
+        if penalty != 1.0:
+            recent = seq.tokens[-REPEAT_LAST_N:]
+            llama_cpp.llama_sample_repetition_penalties(
+                self.ctx, candidates, (llama_cpp.llama_token * len(recent))(*recent),
+                len(recent), penalty, 0.0, 0.0
+            )
+        
+        if params['temperature'] <= 0:
+            return llama_cpp.llama_sample_token_greedy(self.ctx, candidates)
+        
+        llama_cpp.llama_sample_top_k(self.ctx, candidates, params['top_k'], 1)
+        llama_cpp.llama_sample_top_p(self.ctx, candidates, params['top_p'], 1)
+        llama_cpp.llama_sample_min_p(self.ctx, candidates, params['min_p'], 1)
+        llama_cpp.llama_sample_temp(self.ctx, candidates, params['temperature'])
+        return llama_cpp.llama_sample_token(self.ctx, candidates)
+    
+    def _accept(self, seq: _Sequence, token: int):
+        """Append a sampled token, emit its text and finish the sequence if done"""
+        if llama_cpp.llama_token_is_eog(self.llama.model, token):
+            self._finish(seq)
+            return
+        
+        seq.tokens.append(token)
+        seq.n_generated += 1
+        seq.pending += seq.decoder.decode(self.llama.detokenize([token]))
+        
+        stopped = False
+        for stop in seq.params['stop']:
+            index = seq.pending.find(stop)
+            if index != -1:
+                seq.pending = seq.pending[:index]
+                stopped = True
+        
+        if stopped or seq.n_generated >= seq.max_tokens:
+            self._finish(seq)
+            return
+        
+        # Hold back a tail that could still grow into a stop sequence
+        hold = 0
+        for stop in seq.params['stop']:
+            for size in range(min(len(stop) - 1, len(seq.pending)), hold, -1):
+                if seq.pending.endswith(stop[:size]):
+                    hold = size
+                    break
+        
+        ready = seq.pending[:len(seq.pending) - hold]
+        if ready:
+            seq.emit(ready)
+            seq.pending = seq.pending[len(ready):]
+    
+    def _drop_cancelled(self):
+        """Release sequences whose consumers went away"""
+        for seq in list(self._active.values()):
+            if seq.cancelled:
+                self._finish(seq)
+    
+    def _finish(self, seq: _Sequence, error: Optional[BaseException] = None):
+        """Flush remaining text, signal the consumer and free the sequence slot"""
+        if error is not None:
+            seq.emit(error)
+        elif seq.pending:
+            seq.emit(seq.pending)
+        seq.pending = ""
+        seq.emit(_END)
+        
+        if self._active.pop(seq.seq_id, None) is not None:
+            llama_cpp.llama_kv_cache_seq_rm(self.ctx, seq.seq_id, -1, -1)
+            self._free_seq_ids.append(seq.seq_id)
@@ -7,6 +7,10 @@ from pydantic import Field
 from functools import lru_cache
 from typing import Optional
 import os
+import re
+
+# Quantization tag in GGUF file names, e.g. "mistral-7b-instruct-v0.2.Q4_K_M.gguf"
+GGUF_QUANT_PATTERN = re.compile(r"\.(I?Q\d_[A-Z0-9_]+|F16|F32)\.gguf$", re.IGNORECASE)
 
 class Settings(BaseSettings):
     """Application settings with environment variable support"""
@@ -17,8 +21,27 @@ class Settings(BaseSettings):
     
     # LLM Configuration
     model_path: str = Field(default="./models/mistral-7b-instruct-v0.2.Q4_K_M.gguf", env="MODEL_PATH")
+    quantization: str = Field(default="Q4_K_M", env="QUANTIZATION")  # e.g. Q4_0, Q5_K_S, IQ4_XS
     default_temperature: float = Field(default=0.7, env="DEFAULT_TEMPERATURE")
     default_top_p: float = Field(default=1.0, env="DEFAULT_TOP_P")
+    max_response_tokens: int = Field(default=512, env="MAX_RESPONSE_TOKENS")
+    llm_n_threads: int = Field(default=0, env="LLM_N_THREADS")  # 0 = all CPUs available to the process
+    llm_n_batch: int = Field(default=2048, env="LLM_N_BATCH")
+    llm_n_ubatch: int = Field(default=512, env="LLM_N_UBATCH")
+    llm_max_parallel_seqs: int = Field(default=1, env="LLM_MAX_PARALLEL_SEQS")  # 1 = no batching
+    llm_thread_pool_size: int = Field(default=0, env="LLM_THREAD_POOL_SIZE")  # 0 = one thread per CPU
+    
+    # Embedding Configuration
+    embedding_precision: str = Field(default="int8", env="EMBEDDING_PRECISION")  # fp32, fp16 (GPU) or int8 (CPU; fp16 on GPU)
+    embedding_onnx: bool = Field(default=True, env="EMBEDDING_ONNX")  # INT8 ONNX Runtime when available
+    embedding_onnx_dir: str = Field(default="./models/bge-base-en-v1.5-onnx-int8", env="EMBEDDING_ONNX_DIR")
+    embedding_threads: int = Field(default=0, env="EMBEDDING_THREADS")  # 0 = all CPUs available to the process
+    embedding_bf16: bool = Field(default=True, env="EMBEDDING_BF16")  # PyTorch fallback, CPUs with native BF16 only
+    embedding_cache_path: str = Field(default="./data/embedding_cache.db", env="EMBEDDING_CACHE_PATH")  # "" = memory only
+    hnsw_m: int = Field(default=16, env="HNSW_M")
+    hnsw_ef_construction: int = Field(default=128, env="HNSW_EF_CONSTRUCTION")
+    hnsw_ef_search: int = Field(default=64, env="HNSW_EF_SEARCH")
+    in_memory_search_max_chunks: int = Field(default=50000, env="IN_MEMORY_SEARCH_MAX_CHUNKS")  # 0 = always query Chroma
     
     # Authentication
     jwt_secret: str = Field(default="your-secret-key-here-generate-with-openssl-rand-hex-32", env="JWT_SECRET")
@@ -44,11 +67,27 @@ class Settings(BaseSettings):
     
     # Performance
     max_concurrent_requests: int = Field(default=10, env="MAX_CONCURRENT_REQUESTS")
+    reindex_workers: int = Field(default=4, env="REINDEX_WORKERS")
+    pdf_workers: int = Field(default=0, env="PDF_WORKERS")  # 0 = one process per CPU
     cache_ttl_seconds: int = Field(default=3600, env="CACHE_TTL_SECONDS")
     
     class Config:
         env_file = ".env"
         case_sensitive = False
+    
+    def resolved_model_path(self) -> str:
+        """
+        Model file for the configured quantization
+        
+        Swaps the quantization tag in model_path for the one in QUANTIZATION,
+        so the same model family can be switched between GGUF variants that
+        sit side by side in ./models. Paths without a recognizable tag are
+        returned unchanged.
+        
+        Returns:
+            Path to the GGUF file to load
+        """
+        return GGUF_QUANT_PATTERN.sub(f".{self.quantization}.gguf", self.model_path)
 
 @lru_cache()
 def get_settings() -> Settings:
@@ -69,7 +108,4 @@ def ensure_directories():
     ]
     
     for directory in directories:
-        os.makedirs(directory, exist_ok=True)
-
-# Initialize directories on import
-ensure_directories()
\ No newline at end of file
+        os.makedirs(directory, exist_ok=True)
\ No newline at end of file
@@ -0,0 +1,87 @@
+"""
+SQLite-backed embedding cache that survives restarts
+Stores the same INT8 codes and scales the in-memory cache holds
+"""
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Keys per SELECT, below SQLite's bound-parameter limit on older builds
+LOOKUP_BATCH_SIZE = 500
+
+def _key_bytes(key: int) -> bytes:
+    """128-bit integer digest as a BLOB (SQLite integers are 64-bit)"""
+    return key.to_bytes(16, "little")
+
+class PersistentEmbeddingCache:
+    """Embeddings keyed by text digest, partitioned by the model that produced them"""
+    
+    def __init__(self, path: str, model_id: str):
+        """
+        Open (or create) the cache database
+        
+        Args:
+            path: SQLite file path
+            model_id: Identifies the embedder; entries from other models are never returned
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self.model_id = model_id
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, key BLOB NOT NULL, codes BLOB NOT NULL, scale REAL NOT NULL, "
+            "PRIMARY KEY (model, key)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+    
+    def get_many(self, keys: List[int]) -> Dict[int, Tuple[bytes, float]]:
+        """
+        Look up cached embeddings
+        
+        Args:
+            keys: Text digests
+        
+        Returns:
+            Mapping of found keys to (INT8 codes, scale)
+        """
+        by_bytes = {_key_bytes(key): key for key in keys}
+        blobs = list(by_bytes)
+        found = {}
+        with self._lock:
+            for start in range(0, len(blobs), LOOKUP_BATCH_SIZE):
+                batch = blobs[start:start + LOOKUP_BATCH_SIZE]
+                rows = self._conn.execute(
+                    f"SELECT key, codes, scale FROM embeddings WHERE model = ? AND key IN ({','.join('?' * len(batch))})",
+                    [self.model_id, *batch]
+                )
+                for key, codes, scale in rows:
+                    found[by_bytes[key]] = (codes, scale)
+        return found
+    
+    def put_many(self, entries: Iterable[Tuple[int, bytes, float]]):
+        """
+        Store embeddings in one transaction
+        
+        Args:
+            entries: (text digest, INT8 codes, scale) tuples
+        """
+        rows = [(self.model_id, _key_bytes(key), codes, scale) for key, codes, scale in entries]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+    
+    def clear(self):
+        """Drop this model's entries"""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings WHERE model = ?", (self.model_id,))
+            self._conn.commit()
@@ -3,16 +3,22 @@ LLM client for Mistral 7B with streaming support
 Uses llama-cpp-python for CPU-optimized inference with fallback support
 """
 import asyncio
-from typing import AsyncGenerator, Optional
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from typing import AsyncGenerator, Callable, Iterable, List, Optional
+from cachetools import LRUCache
 import logging
 import os
+import threading
+import xxhash
 
 from backend.core.config import get_settings
-from backend.models.database import get_config_value, SessionLocal
+from backend.core.batched_inference import SEQ_CTX, BatchedInferenceEngine
+from backend.models.database import get_config_values, invalidate_config_cache
 
 # Try to import llama-cpp-python, fallback to mock if not available
 try:
-    from llama_cpp import Llama
+    from llama_cpp import Llama, StoppingCriteriaList
     LLAMA_CPP_AVAILABLE = True
 except ImportError:
     LLAMA_CPP_AVAILABLE = False
@@ -20,13 +26,230 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# Fallback responses are streamed in slices with no artificial delay
+FALLBACK_STREAM_CHUNK_CHARS = 16
+
+# Number of tokenized prompts kept per model
+TOKENIZE_CACHE_SIZE = 256
+
+# Context of the Llama object while the batching engine runs generation in its
+# own context; it is then only used for tokenizing, so keep its KV cache small
+ENGINE_HOST_CTX = 512
+
+# Mistral instruct stop sequences; llama.cpp needs a list here, not a tuple
+STOP_SEQUENCES = ["</s>", "[/INST]"]
+
+DEFAULT_SYSTEM_PROMPT = "You are an IT support assistant. Answer using only the provided documentation."
+
+def get_generation_config() -> dict:
+    """
+    Get the generation parameters and system prompt in one cached lookup
+    
+    Returns:
+        Dictionary with temperature, top_p and system_prompt
+    """
+    values = get_config_values(None, ("temperature", "top_p", "system_prompt"))
+    return {
+        'temperature': float(values.get("temperature", "0.7")),
+        'top_p': float(values.get("top_p", "1.0")),
+        'system_prompt': values.get("system_prompt", DEFAULT_SYSTEM_PROMPT)
+    }
+
+def available_cpu_count() -> int:
+    """Number of CPUs this process may run on (honours affinity masks)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+@lru_cache()
+def cpu_flags() -> frozenset:
+    """Instruction set flags the CPU advertises (empty where /proc/cpuinfo is unavailable)"""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return frozenset(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return frozenset()
+
+def llama_runtime_kwargs(settings) -> dict:
+    """
+    Thread and batch sizing for Llama(), derived from settings and the CPU
+    
+    Args:
+        settings: Application settings
+        
+    Returns:
+        Keyword arguments for the Llama constructor
+    """
+    n_threads = settings.llm_n_threads or available_cpu_count()
+    return {
+        'n_threads': n_threads,
+        'n_threads_batch': n_threads,
+        'n_batch': settings.llm_n_batch,
+        'n_ubatch': settings.llm_n_ubatch
+    }
+
+class CachedTokenizer:
+    """Memoizes prompt tokenization, keyed by an xxh3 hash of the prompt bytes"""
+    
+    def __init__(self, model, maxsize: int = TOKENIZE_CACHE_SIZE):
+        self.model = model
+        self._cache = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+    
+    def tokens_for(self, prompt: str) -> List[int]:
+        """
+        Token ids for a prompt, tokenizing only on a cache miss
+        
+        Args:
+            prompt: Prompt text (special tokens such as <s> are parsed)
+            
+        Returns:
+            New list of token ids, safe for the caller to modify
+        """
+        data = prompt.encode("utf-8")
+        key = xxhash.xxh3_64_intdigest(data)
+        
+        with self._lock:
+            tokens = self._cache.get(key)
+        if tokens is None:
+            tokens = tuple(self.model.tokenize(data, add_bos=False, special=True))
+            with self._lock:
+                self._cache[key] = tokens
+        
+        return list(tokens)
+
+@lru_cache()
+def get_llm_pool() -> ThreadPoolExecutor:
+    """
+    Shared pool for LLM-side CPU work that does not drive the model itself,
+    such as prompt tokenization, kept apart from the default asyncio executor
+    """
+    settings = get_settings()
+    return ThreadPoolExecutor(
+        max_workers=settings.llm_thread_pool_size or available_cpu_count(),
+        thread_name_prefix="llm"
+    )
+
+def start_batched_engine(model, settings, tokenizer: Optional[CachedTokenizer] = None) -> Optional[BatchedInferenceEngine]:
+    """
+    Start continuous batching for a loaded model when enabled in settings
+    
+    Args:
+        model: Loaded Llama instance
+        settings: Application settings
+        tokenizer: Shared prompt tokenization cache for the model
+        
+    Returns:
+        Running engine, or None to use single-stream generation
+    """
+    if settings.llm_max_parallel_seqs <= 1:
+        return None
+    try:
+        return BatchedInferenceEngine(
+            model,
+            settings.llm_max_parallel_seqs,
+            llama_runtime_kwargs(settings),
+            tokenize=tokenizer.tokens_for if tokenizer else None
+        )
+    except Exception as e:
+        logger.warning(f"🔄 Batched inference unavailable ({e}), using single-stream generation")
+        return None
+
+def stop_when(event: threading.Event) -> "StoppingCriteriaList":
+    """Stopping criteria that end a llama.cpp generation once the event is set"""
+    return StoppingCriteriaList([lambda input_ids, logits: event.is_set()])
+
+def stream_token_texts(token_generator) -> Iterable[str]:
+    """Extract the non-empty text pieces from a llama.cpp streaming generator"""
+    for token_data in token_generator:
+        if 'choices' in token_data and len(token_data['choices']) > 0:
+            token = token_data['choices'][0]['text']
+            if token:
+                yield token
+
+_STREAM_END = object()
+
+class _StreamError:
+    """Wraps an exception raised by the producer thread"""
+    def __init__(self, error: BaseException):
+        self.error = error
+
+async def iterate_in_thread(make_iterator: Callable[[], Iterable], executor=None) -> AsyncGenerator:
+    """
+    Consume a blocking iterator on a worker thread and yield its items
+    
+    The worker pushes items into an asyncio.Queue with call_soon_threadsafe,
+    so the event loop only ever awaits the queue and never runs next() on
+    the iterator itself. Closing the async generator stops the worker at
+    its next item.
+    
+    Args:
+        make_iterator: Called on the worker thread to create the iterator
+        executor: Executor to run the worker on (default loop executor if None)
+        
+    Yields:
+        Items produced by the iterator
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+    
+    def put(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            # Event loop already closed
+            stop.set()
+    
+    def produce():
+        try:
+            for item in make_iterator():
+                if stop.is_set():
+                    break
+                put(item)
+        except Exception as e:
+            put(_StreamError(e))
+        finally:
+            put(_STREAM_END)
+    
+    loop.run_in_executor(executor, produce)
+    
+    try:
+        while (item := await queue.get()) is not _STREAM_END:
+            if isinstance(item, _StreamError):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+
 class LLMClient:
     """Mistral 7B LLM client with streaming capabilities"""
     
     def __init__(self):
         self.settings = get_settings()
         self.model = None
-        self._load_model()
+        self.engine = None
+        self.tokenizer = None
+        # llama.cpp models are not reentrant; one thread runs every generation
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-inference")
+        # The model is loaded on first use, not at construction
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+        self._sampler_key = None
+        self._sampler = None
+    
+    async def _ensure_loaded(self):
+        """Load the model on the inference thread the first time it is needed"""
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if not self._loaded:
+                await asyncio.get_running_loop().run_in_executor(self.executor, self._load_model)
+                self._loaded = True
     
     def _load_model(self):
         """Load the Mistral model with CPU optimization or use fallback"""
@@ -35,46 +258,72 @@ class LLMClient:
             self.model = None
             return
             
-        if not os.path.exists(self.settings.model_path):
-            logger.warning(f"🔄 Model file not found at {self.settings.model_path}, using fallback")
+        model_path = self.settings.resolved_model_path()
+        if not os.path.exists(model_path):
+            logger.warning(f"🔄 Model file not found at {model_path}, using fallback")
             self.model = None
             return
             
         try:
-            logger.info(f"Loading model from: {self.settings.model_path}")
+            logger.info(f"Loading model from: {model_path}")
             
-            self.model = Llama(
-                model_path=self.settings.model_path,
-                n_ctx=4096,  # Context window
-                n_threads=4,  # CPU threads
-                n_gpu_layers=0,  # CPU only
-                verbose=False
-            )
+            # Only one context holds the full KV cache: the engine's when batching, else the model's
+            batching = self.settings.llm_max_parallel_seqs > 1
+            self.model = self._create_model(model_path, ENGINE_HOST_CTX if batching else SEQ_CTX)
             
             logger.info("✅ Mistral model loaded successfully")
             
+            self.tokenizer = CachedTokenizer(self.model)
+            self.engine = start_batched_engine(self.model, self.settings, self.tokenizer)
+            
+            if batching and not self.engine:
+                # Single-stream generation needs the full context after all
+                self.model = self._create_model(model_path, SEQ_CTX)
+                self.tokenizer = CachedTokenizer(self.model)
+            
         except Exception as e:
             logger.error(f"❌ Failed to load model: {e}, using fallback")
             self.model = None
     
-    def _build_prompt(self, query: str, context: str) -> str:
-        """Build the complete prompt with system instructions and context"""
-        
-        # Get current system prompt from database
-        db = SessionLocal()
-        try:
-            system_prompt = get_config_value(
-                db, 
-                "system_prompt", 
-                "You are an IT support assistant. Answer using only the provided documentation."
+    def _create_model(self, model_path: str, n_ctx: int) -> "Llama":
+        """Load the GGUF model with the given context window"""
+        return Llama(
+            model_path=model_path,
+            n_ctx=n_ctx,  # Context window
+            n_gpu_layers=0,  # CPU only
+            verbose=False,
+            **llama_runtime_kwargs(self.settings)  # CPU threads and batch sizes
+        )
+    
+    def _bound_model(self, temperature: float, top_p: float) -> partial:
+        """self.model with the fixed sampling arguments bound, reused while they are unchanged"""
+        key = (self.model, temperature, top_p)
+        if key != self._sampler_key:
+            self._sampler = partial(
+                self.model,
+                max_tokens=self.settings.max_response_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                echo=False,
+                stop=STOP_SEQUENCES
             )
-        finally:
-            db.close()
-        
-        prompt = f"""<s>[INST] {system_prompt}
+            self._sampler_key = key
+        return self._sampler
+    
+    def _prompt_prefix(self, system_prompt: str) -> str:
+        """Leading part of the prompt that only changes with the system prompt"""
+        return f"""<s>[INST] {system_prompt}
 
 Context:
-{context}
+"""
+    
+    def _build_prompt(self, query: str, context: str, system_prompt: Optional[str] = None) -> str:
+        """Build the complete prompt with system instructions and context"""
+        
+        if system_prompt is None:
+            system_prompt = get_generation_config()['system_prompt']
+        
+        prompt = self._prompt_prefix(system_prompt) + f"""{context}
 
 User Query: {query}
 
@@ -85,78 +334,90 @@ Your Response: [/INST]"""
     async def generate_stream(self, query: str, context: str) -> AsyncGenerator[str, None]:
         """Generate streaming response from the LLM"""
         
+        await self._ensure_loaded()
+        
         if not self.model:
             # Fallback response when model is not available
             fallback_response = self._generate_fallback_response(query, context)
-            for char in fallback_response:
-                yield char
-                await asyncio.sleep(0.05)  # Simulate streaming
+            for i in range(0, len(fallback_response), FALLBACK_STREAM_CHUNK_CHARS):
+                yield fallback_response[i:i + FALLBACK_STREAM_CHUNK_CHARS]
+                await asyncio.sleep(0)  # Let other requests run between chunks
             return
         
-        # Get current model parameters
-        db = SessionLocal()
-        try:
-            temperature = float(get_config_value(db, "temperature", "0.7"))
-            top_p = float(get_config_value(db, "top_p", "1.0"))
-        finally:
-            db.close()
+        # Get current model parameters (cached in-process)
+        config = get_generation_config()
+        temperature = config['temperature']
+        top_p = config['top_p']
         
-        prompt = self._build_prompt(query, context)
+        prompt = self._build_prompt(query, context, config['system_prompt'])
         
-        # Generate tokens in a separate thread to avoid blocking
-        def generate_tokens():
-            return self.model(
+        if self.engine:
+            # Share decode steps with other in-flight requests
+            async for token in self.engine.generate(
                 prompt,
-                max_tokens=1500,
+                prefix=self._prompt_prefix(config['system_prompt']),
+                max_tokens=self.settings.max_response_tokens,
                 temperature=temperature,
                 top_p=top_p,
-                echo=False,
-                stream=True,
-                stop=["</s>", "[/INST]"]
-            )
+                stop=STOP_SEQUENCES
+            ):
+                yield token
+            return
         
-        # Run generation in thread pool
-        loop = asyncio.get_event_loop()
-        token_generator = await loop.run_in_executor(None, generate_tokens)
+        # Generate tokens on a worker thread; the loop only awaits the queue
+        cancel = threading.Event()
+        model = self._bound_model(temperature, top_p)
         
-        # Stream tokens
-        for token_data in token_generator:
-            if 'choices' in token_data and len(token_data['choices']) > 0:
-                token = token_data['choices'][0]['text']
-                if token:
-                    yield token
-                    # Small delay for smooth streaming
-                    await asyncio.sleep(0.01)
+        def generate_tokens():
+            return stream_token_texts(model(
+                self.tokenizer.tokens_for(prompt), stream=True, stopping_criteria=stop_when(cancel)
+            ))
+        
+        try:
+            async for token in iterate_in_thread(generate_tokens, self.executor):
+                yield token
+        finally:
+            # Client gone or stream closed: stop decoding at the next token
+            cancel.set()
     
     async def generate(self, query: str, context: str) -> str:
         """Generate complete response (non-streaming)"""
         
+        await self._ensure_loaded()
+        
         if not self.model:
             return self._generate_fallback_response(query, context)
         
-        db = SessionLocal()
-        try:
-            temperature = float(get_config_value(db, "temperature", "0.7"))
-            top_p = float(get_config_value(db, "top_p", "1.0"))
-        finally:
-            db.close()
+        config = get_generation_config()
+        temperature = config['temperature']
+        top_p = config['top_p']
         
-        prompt = self._build_prompt(query, context)
+        prompt = self._build_prompt(query, context, config['system_prompt'])
         
-        # Generate complete response
-        loop = asyncio.get_event_loop()
-        
-        def generate_complete():
-            return self.model(
+        if self.engine:
+            tokens = [token async for token in self.engine.generate(
                 prompt,
-                max_tokens=1500,
+                prefix=self._prompt_prefix(config['system_prompt']),
+                max_tokens=self.settings.max_response_tokens,
                 temperature=temperature,
                 top_p=top_p,
-                echo=False,
-                stream=False
-            )
+                stop=STOP_SEQUENCES
+            )]
+            return "".join(tokens).strip() or "I apologize, but I couldn't generate a response. Please try again."
+        
+        # Generate complete response
+        loop = asyncio.get_running_loop()
+        cancel = threading.Event()
+        model = self._bound_model(temperature, top_p)
+        
+        def generate_complete():
+            return model(self.tokenizer.tokens_for(prompt), stream=False, stopping_criteria=stop_when(cancel))
         
-        result = await loop.run_in_executor(None, generate_complete)
+        try:
+            result = await loop.run_in_executor(self.executor, generate_complete)
+        finally:
+            # Stop decoding if the request was cancelled while waiting
+            cancel.set()
         
         if 'choices' in result and len(result['choices']) > 0:
             return result['choices'][0]['text'].strip()
@@ -189,14 +450,19 @@ For immediate assistance, please contact your IT support team."""
     
     def update_parameters(self, temperature: float, top_p: float):
         """Update model generation parameters"""
-        # Parameters are retrieved from database on each generation
-        # This method exists for compatibility but parameters are stored in DB
+        # Parameters are stored in the DB; drop the cached copies so the
+        # next generation re-reads them
+        invalidate_config_cache("temperature", "top_p")
         logger.info(f"Model parameters will be updated: temperature={temperature}, top_p={top_p}")
     
     def reload_model(self):
         """Reload the model (for configuration changes)"""
         try:
+            if self.engine:
+                self.engine.close()
+                self.engine = None
             self._load_model()
+            self._loaded = True
         except Exception as e:
             logger.error(f"Failed to reload model: {e}")
             raise
\ No newline at end of file
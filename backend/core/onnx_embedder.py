@@ -0,0 +1,119 @@
+"""
+INT8-quantized ONNX Runtime sentence embeddings
+Drop-in replacement for SentenceTransformer.encode on CPU
+"""
+import logging
+import os
+from typing import List, Union
+
+import numpy as np
+
+from backend.core.llm_client import available_cpu_count, cpu_flags
+
+# Try to import ONNX Runtime and Optimum, fallback to SentenceTransformer if not available
+try:
+    import onnxruntime as ort
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# File written by ORTQuantizer next to the exported model
+QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+
+# Longest input the BGE encoders accept
+MAX_SEQ_LENGTH = 512
+
+def export_quantized_model(model_name: str, output_dir: str):
+    """
+    Export a Hugging Face encoder to ONNX and quantize its weights to INT8
+    
+    Args:
+        model_name: Hugging Face model id
+        output_dir: Directory to write the quantized model and tokenizer to
+    """
+    export_dir = os.path.join(output_dir, "fp32")
+    ORTModelForFeatureExtraction.from_pretrained(model_name, export=True).save_pretrained(export_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(output_dir)
+    
+    # Dynamic quantization: INT8 weights, activations quantized per batch at run time
+    if "avx512_vnni" in cpu_flags():
+        qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+    else:
+        qconfig = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+    ORTQuantizer.from_pretrained(export_dir).quantize(save_dir=output_dir, quantization_config=qconfig)
+
+class OnnxEmbedder:
+    """BGE embeddings from an INT8 ONNX export, matching SentenceTransformer output"""
+    
+    def __init__(self, model_name: str, model_dir: str, num_threads: int = 0):
+        """
+        Load the quantized model, exporting it first if it is not on disk yet
+        
+        Args:
+            model_name: Hugging Face model id
+            model_dir: Directory holding (or receiving) the quantized export
+            num_threads: Intra-op threads for ONNX Runtime (0 = all available CPUs)
+        """
+        model_path = os.path.join(model_dir, QUANTIZED_MODEL_FILE)
+        if not os.path.exists(model_path):
+            logger.info(f"🔄 Exporting {model_name} to INT8 ONNX in {model_dir} (one-time)...")
+            export_quantized_model(model_name, model_dir)
+        
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads or available_cpu_count()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self._input_names = [i.name for i in self.session.get_inputs()]
+    
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, **kwargs) -> np.ndarray:
+        """
+        Embed text with CLS pooling and L2 normalization, as the BGE
+        SentenceTransformer pipeline does, so vectors stay comparable
+        
+        Args:
+            sentences: A string or list of strings
+            batch_size: Texts per ONNX Runtime call
+            **kwargs: Accepted for SentenceTransformer compatibility and ignored
+        
+        Returns:
+            float32 array of shape (dim,) for a string, (n, dim) for a list
+        """
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        
+        # Tokenize once without padding, then batch texts of similar token
+        # counts so each batch is only padded to its own longest input
+        encoded = self.tokenizer(texts, truncation=True, max_length=MAX_SEQ_LENGTH)
+        lengths = [len(ids) for ids in encoded["input_ids"]]
+        order = np.argsort([-n for n in lengths], kind="stable")
+        pad_values = {"input_ids": self.tokenizer.pad_token_id or 0}
+        
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            rows = order[start:start + batch_size]
+            width = lengths[rows[0]]  # Longest first
+            feed = {}
+            for name in self._input_names:
+                if name not in encoded:
+                    continue
+                padded = np.full((len(rows), width), pad_values.get(name, 0), dtype=np.int64)
+                for row, i in enumerate(rows):
+                    padded[row, :lengths[i]] = encoded[name][i]
+                feed[name] = padded
+            hidden = self.session.run(["last_hidden_state"], feed)[0]
+            cls = hidden[:, 0].astype(np.float32)
+            batches.append(cls / np.linalg.norm(cls, axis=1, keepdims=True))
+        
+        if not batches:
+            return np.empty((0, 0), dtype=np.float32)
+        
+        embeddings = np.empty((len(texts), batches[0].shape[1]), dtype=np.float32)
+        embeddings[order] = np.vstack(batches)
+        return embeddings[0] if single else embeddings
@@ -3,129 +3,258 @@ Optimized LLM client with async processing, connection pooling, and caching
 Performance improvements for Mistral 7B inference
 """
 import asyncio
-import threading
+from functools import partial
 from typing import AsyncGenerator, Optional, Dict, Any
 import logging
+import os
+import threading
 import time
 from concurrent.futures import ThreadPoolExecutor
-import hashlib
-import json
-from contextlib import asynccontextmanager
+from cachetools import TTLCache
+import psutil
+import struct
+import xxhash
 
-from llama_cpp import Llama
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
 
 from backend.core.config import get_settings
-from backend.models.database import get_config_value, SessionLocal
+from backend.core.batched_inference import SEQ_CTX
+from backend.models.database import invalidate_config_cache
+from backend.core.llm_client import (
+    ENGINE_HOST_CTX, LLAMA_CPP_AVAILABLE, STOP_SEQUENCES, CachedTokenizer, get_generation_config, get_llm_pool, iterate_in_thread, llama_runtime_kwargs,
+    start_batched_engine, stop_when, stream_token_texts
+)
 from backend.core.performance_optimizer import performance_optimizer, timed
 
 logger = logging.getLogger(__name__)
 
+# Bounded cache of complete responses, replayed in slices on a hit
+RESPONSE_CACHE_SIZE = 512
+RESPONSE_CACHE_TTL_SECONDS = 3600
+CACHED_STREAM_CHUNK_CHARS = 16
+
+# Lock model pages in RAM only when this many model-sizes of memory are free
+MLOCK_MEMORY_FACTOR = 2
+
+# Tokens reserved for the "... [truncated]" marker
+TRUNCATION_MARKER_TOKENS = 8
+
+# Sampling settings shared by every generation path (max_tokens comes from settings)
+SAMPLING_PARAMS = {
+    'stop': STOP_SEQUENCES + ["User:", "Query:"],
+    'repeat_penalty': 1.1,  # Prevent repetition
+    'top_k': 40,  # Limit vocabulary
+}
+
 class OptimizedLLMClient:
     """High-performance LLM client with optimizations and caching"""
     
     def __init__(self):
         self.settings = get_settings()
         self.model = None
-        self.model_lock = threading.Lock()
-        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="llm-worker")
-        self.response_cache = {}
-        self.config_cache = {}
+        self.engine = None
+        self.tokenizer = None
+        # The Llama object is not reentrant: a single long-lived thread owns it
+        # and runs loads, warm-up and generations in submission order
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-inference")
+        self._response_cache = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL_SECONDS)
+        # Load completion: a thread-safe flag plus an asyncio.Event created by
+        # the first waiter, since no event loop may exist yet at this point
+        self._load_done = threading.Event()
+        self._ready_lock = threading.Lock()
+        self._ready_event = None
         self.is_loading = False
+        self._sampler_key = None
+        self._sampler = None
         self._preload_model()
     
     def _preload_model(self):
-        """Preload model in background thread"""
+        """Preload model on the inference thread"""
+        self._load_done.clear()
+        with self._ready_lock:
+            self._ready_event = None
+        
         def load_model():
             try:
-                logger.info(f"🔥 Preloading optimized model from: {self.settings.model_path}")
+                model_path = self.settings.resolved_model_path()
+                if not LLAMA_CPP_AVAILABLE:
+                    logger.warning("🔄 llama-cpp-python not installed, optimized model disabled")
+                    return
+                if not os.path.exists(model_path):
+                    logger.warning(f"🔄 Model file not found at {model_path}, optimized model disabled")
+                    return
+                
+                logger.info(f"🔥 Preloading optimized model from: {model_path}")
                 
-                with self.model_lock:
-                    self.model = Llama(
-                        model_path=self.settings.model_path,
-                        n_ctx=4096,  # Context window
-                        n_threads=6,  # Optimized thread count
+                from llama_cpp import Llama
+                
+                def create_model(n_ctx):
+                    return Llama(
+                        model_path=model_path,
+                        n_ctx=n_ctx,  # Context window
                         n_gpu_layers=0,  # CPU only for consistency
                         verbose=False,
                         use_mmap=True,  # Memory mapping for faster loading
-                        use_mlock=True,  # Lock memory to prevent swapping
-                        n_batch=512,  # Batch size for processing
+                        use_mlock=self._can_mlock(),  # Lock memory to prevent swapping when it is safe
                         rope_freq_base=10000.0,  # RoPE frequency base
                         rope_freq_scale=1.0,  # RoPE frequency scaling
+                        **llama_runtime_kwargs(self.settings)  # CPU threads and batch sizes
                     )
                 
-                # Warm up model with a test generation
-                test_prompt = "[INST] Hello [/INST]"
-                _ = self.model(test_prompt, max_tokens=5, temperature=0.1)
+                # Only one context holds the full KV cache: the engine's when batching, else the model's
+                batching = self.settings.llm_max_parallel_seqs > 1
+                model = create_model(ENGINE_HOST_CTX if batching else SEQ_CTX)
+                
+                self.tokenizer = CachedTokenizer(model)
+                self.engine = start_batched_engine(model, self.settings, self.tokenizer)
                 
-                logger.info("✅ Optimized Mistral model loaded and warmed up")
+                if batching and not self.engine:
+                    # Single-stream generation needs the full context after all
+                    model = create_model(SEQ_CTX)
+                    self.tokenizer = CachedTokenizer(model)
+                
+                # Publish the model last so waiters see a fully set up client
+                self.model = model
+                logger.info("✅ Optimized Mistral model loaded")
                 
             except Exception as e:
                 logger.error(f"❌ Failed to preload model: {e}")
                 self.model = None
+            
+            finally:
+                self._signal_load_done()
+        
+        def warm_up():
+            # Page in the weights with a single forward pass; no sampling
+            if self.model is None:
+                return
+            try:
+                self.model.eval(self.model.tokenize(b"[INST] Hello [/INST]"))
+                self.model.reset()
+                logger.info("✅ Optimized Mistral model warmed up")
+            except Exception as e:
+                logger.warning(f"Model warm-up failed: {e}")
         
-        # Start loading in background
-        load_thread = threading.Thread(target=load_model, daemon=True)
-        load_thread.start()
+        # Queue loading ahead of any generation requests; warm-up follows as a
+        # separate job so requests do not wait for it
+        self.executor.submit(load_model)
+        self.executor.submit(warm_up)
     
-    def _get_cache_key(self, query: str, context: str, params: Dict) -> str:
-        """Generate cache key for responses"""
-        content = f"{query}:{context}:{json.dumps(params, sort_keys=True)}"
-        return hashlib.md5(content.encode()).hexdigest()
+    def _signal_load_done(self):
+        """Wake coroutines waiting in _wait_for_model (runs on the inference thread)"""
+        self._load_done.set()
+        with self._ready_lock:
+            waiter = self._ready_event
+        if waiter:
+            loop, event = waiter
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Event loop already closed
+                pass
     
-    @asynccontextmanager
-    async def _get_model_config(self):
-        """Get model configuration with caching"""
-        # Check cache first
-        cache_key = "model_config"
-        cached_config = performance_optimizer.get_cached_result(cache_key)
+    def _can_mlock(self) -> bool:
+        """Whether locking the model in RAM is affordable and permitted"""
+        try:
+            model_size = os.path.getsize(self.settings.resolved_model_path())
+        except OSError:
+            return False
         
-        if cached_config:
-            yield cached_config
-            return
+        available = psutil.virtual_memory().available
+        if available < MLOCK_MEMORY_FACTOR * model_size:
+            logger.info("Not locking model in RAM: not enough free memory")
+            return False
         
-        # Get from database
-        db = SessionLocal()
-        try:
-            config = {
-                'temperature': float(get_config_value(db, "temperature", "0.7")),
-                'top_p': float(get_config_value(db, "top_p", "1.0")),
-                'system_prompt': get_config_value(
-                    db, 
-                    "system_prompt", 
-                    "You are an IT support assistant. Answer using only the provided documentation."
-                )
-            }
-            
-            # Cache for 5 minutes
-            performance_optimizer.cache_result(cache_key, config, ttl_seconds=300)
-            yield config
-            
-        finally:
-            db.close()
-    
-    def _build_optimized_prompt(self, query: str, context: str, system_prompt: str) -> str:
-        """Build optimized prompt with better formatting"""
-        # Truncate context if too long to prevent memory issues
-        max_context_length = 3000
-        if len(context) > max_context_length:
-            context = context[:max_context_length] + "... [truncated]"
+        if resource is not None:
+            soft_limit, _ = resource.getrlimit(resource.RLIMIT_MEMLOCK)
+            if soft_limit != resource.RLIM_INFINITY and soft_limit < model_size:
+                logger.info("Not locking model in RAM: RLIMIT_MEMLOCK is below the model size")
+                return False
         
-        prompt = f"""<s>[INST] {system_prompt}
+        return True
+    
+    def _unload_model(self):
+        """Drop the current model (runs on the inference thread)"""
+        if self.engine:
+            self.engine.close()
+            self.engine = None
+        self.model = None
+    
+    def _bound_model(self, temperature: float, top_p: float) -> partial:
+        """self.model with the fixed sampling arguments bound, reused while they are unchanged"""
+        key = (self.model, temperature, top_p)
+        if key != self._sampler_key:
+            self._sampler = partial(
+                self.model,
+                max_tokens=self.settings.max_response_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                echo=False,
+                **SAMPLING_PARAMS
+            )
+            self._sampler_key = key
+        return self._sampler
+    
+    def _get_cache_key(self, query: str, context: str, params: Dict) -> str:
+        """Generate cache key for responses"""
+        h = xxhash.xxh3_64()
+        h.update(query.encode())
+        h.update(b"\0")
+        h.update(context.encode())
+        h.update(struct.pack("<dd", params['temperature'], params['top_p']))
+        return h.hexdigest()
+    
+    def _prompt_prefix(self, system_prompt: str) -> str:
+        """Leading part of the prompt that only changes with the system prompt"""
+        return f"""<s>[INST] {system_prompt}
 
 Context:
-{context}
+"""
+    
+    def _build_optimized_prompt(self, query: str, context: str, system_prompt: str) -> str:
+        """Build optimized prompt with better formatting"""
+        prefix = self._prompt_prefix(system_prompt)
+        suffix = f"""
 
 User Query: {query}
 
 Provide a helpful and accurate response based on the context provided. [/INST]"""
         
-        return prompt
+        # Truncate context to the tokens left after the prompt frame and the
+        # response reserve, so the prompt never overflows the context window
+        budget = SEQ_CTX - self.settings.max_response_tokens - len(self.tokenizer.tokens_for(prefix + suffix))
+        data = context.encode("utf-8")
+        if len(data) >= budget:  # Cheap check: a token never covers less than one byte
+            tokens = self.model.tokenize(data, add_bos=False, special=False)
+            if len(tokens) > budget:
+                kept = self.model.detokenize(tokens[:max(0, budget - TRUNCATION_MARKER_TOKENS)])
+                context = kept.decode("utf-8", errors="ignore") + "... [truncated]"
+        
+        return prefix + context + suffix
     
     async def _wait_for_model(self, timeout: float = 30.0) -> bool:
         """Wait for model to be loaded"""
-        start_time = time.time()
-        while self.model is None and (time.time() - start_time) < timeout:
-            await asyncio.sleep(0.1)
+        if self.model is not None:
+            return True
+        
+        if not self._load_done.is_set():
+            with self._ready_lock:
+                if self._ready_event is None:
+                    self._ready_event = (asyncio.get_running_loop(), asyncio.Event())
+                _, event = self._ready_event
+            
+            # Loading may have finished before the event was registered
+            if self._load_done.is_set():
+                event.set()
+            
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        
         return self.model is not None
     
     @timed("llm_generation")
@@ -136,75 +265,73 @@ Provide a helpful and accurate response based on the context provided. [/INST]""
         if not await self._wait_for_model():
             raise RuntimeError("Model not loaded within timeout")
         
-        # Get configuration
-        async with self._get_model_config() as config:
-            temperature = config['temperature']
-            top_p = config['top_p']
-            system_prompt = config['system_prompt']
+        # Get configuration (cached in-process)
+        config = get_generation_config()
+        temperature = config['temperature']
+        top_p = config['top_p']
+        system_prompt = config['system_prompt']
         
         # Check cache for identical requests
-        cache_key = self._get_cache_key(query, context[:500], {  # Use truncated context for cache
+        cache_key = self._get_cache_key(query, context, {
             'temperature': temperature,
             'top_p': top_p
         })
         
-        cached_response = performance_optimizer.get_cached_result(cache_key)
+        cached_response = self._response_cache.get(cache_key)
         if cached_response:
             logger.debug(f"Cache hit for query: {query[:50]}...")
             # Stream cached response
-            for token in cached_response['tokens']:
-                yield token
-                await asyncio.sleep(0.01)  # Simulate streaming
+            for i in range(0, len(cached_response), CACHED_STREAM_CHUNK_CHARS):
+                yield cached_response[i:i + CACHED_STREAM_CHUNK_CHARS]
             return
         
-        prompt = self._build_optimized_prompt(query, context, system_prompt)
+        prompt = await asyncio.get_running_loop().run_in_executor(
+            get_llm_pool(), self._build_optimized_prompt, query, context, system_prompt
+        )
+        
+        # Generate tokens on the inference thread; the event loop only awaits
+        # the token queue
+        cancel = threading.Event()
+        model = self._bound_model(temperature, top_p)
         
-        # Generate tokens in executor to avoid blocking
         def generate_tokens():
-            with self.model_lock:
-                return self.model(
+            return stream_token_texts(model(
+                self.tokenizer.tokens_for(prompt), stream=True, stopping_criteria=stop_when(cancel)
+            ))
+        
+        try:
+            # Stream tokens and collect for caching
+            parts = []
+            
+            if self.engine:
+                # Share decode steps with other in-flight requests
+                token_stream = self.engine.generate(
                     prompt,
-                    max_tokens=1500,
+                    prefix=self._prompt_prefix(system_prompt),
+                    max_tokens=self.settings.max_response_tokens,
                     temperature=temperature,
                     top_p=top_p,
-                    echo=False,
-                    stream=True,
-                    stop=["</s>", "[/INST]", "User:", "Query:"],
-                    repeat_penalty=1.1,  # Prevent repetition
-                    top_k=40,  # Limit vocabulary
+                    **SAMPLING_PARAMS
                 )
-        
-        # Run generation in thread pool
-        loop = asyncio.get_event_loop()
-        
-        try:
-            token_generator = await loop.run_in_executor(self.executor, generate_tokens)
-            
-            # Stream tokens and collect for caching
-            full_response = ""
-            cached_tokens = []
+            else:
+                token_stream = iterate_in_thread(generate_tokens, self.executor)
             
-            for token_data in token_generator:
-                if 'choices' in token_data and len(token_data['choices']) > 0:
-                    token = token_data['choices'][0]['text']
-                    if token:
-                        full_response += token
-                        cached_tokens.append(token)
-                        yield token
-                        # Adaptive delay based on token length
-                        await asyncio.sleep(0.005 if len(token) < 5 else 0.01)
+            async for token in token_stream:
+                parts.append(token)
+                yield token
             
             # Cache successful responses
-            if full_response.strip() and len(cached_tokens) > 3:
-                performance_optimizer.cache_result(
-                    cache_key,
-                    {'tokens': cached_tokens, 'full_response': full_response},
-                    ttl_seconds=3600  # Cache for 1 hour
-                )
+            full_response = "".join(parts)
+            if full_response.strip() and len(parts) > 3:
+                self._response_cache[cache_key] = full_response
                 
         except Exception as e:
             logger.error(f"Error in stream generation: {e}")
             yield f"I apologize, but I encountered an error generating the response: {str(e)}"
+        
+        finally:
+            # Client gone or stream closed: stop decoding at the next token
+            cancel.set()
     
     @timed("llm_generation_complete")
     async def generate(self, query: str, context: str) -> str:
@@ -214,55 +341,60 @@ Provide a helpful and accurate response based on the context provided. [/INST]""
         if not await self._wait_for_model():
             raise RuntimeError("Model not loaded within timeout")
         
-        # Get configuration
-        async with self._get_model_config() as config:
-            temperature = config['temperature']
-            top_p = config['top_p']
-            system_prompt = config['system_prompt']
+        # Get configuration (cached in-process)
+        config = get_generation_config()
+        temperature = config['temperature']
+        top_p = config['top_p']
+        system_prompt = config['system_prompt']
         
         # Check cache
-        cache_key = self._get_cache_key(query, context[:500], {
+        cache_key = self._get_cache_key(query, context, {
             'temperature': temperature,
             'top_p': top_p
         })
         
-        cached_response = performance_optimizer.get_cached_result(cache_key)
+        cached_response = self._response_cache.get(cache_key)
         if cached_response:
             logger.debug(f"Cache hit for complete generation: {query[:50]}...")
-            return cached_response['full_response']
+            return cached_response.strip()
         
-        prompt = self._build_optimized_prompt(query, context, system_prompt)
+        prompt = await asyncio.get_running_loop().run_in_executor(
+            get_llm_pool(), self._build_optimized_prompt, query, context, system_prompt
+        )
         
         # Generate complete response
-        loop = asyncio.get_event_loop()
+        loop = asyncio.get_running_loop()
+        
+        cancel = threading.Event()
+        model = self._bound_model(temperature, top_p)
         
         def generate_complete():
-            with self.model_lock:
-                return self.model(
+            return model(self.tokenizer.tokens_for(prompt), stream=False, stopping_criteria=stop_when(cancel))
+        
+        try:
+            if self.engine:
+                tokens = [token async for token in self.engine.generate(
                     prompt,
-                    max_tokens=1500,
+                    prefix=self._prompt_prefix(system_prompt),
+                    max_tokens=self.settings.max_response_tokens,
                     temperature=temperature,
                     top_p=top_p,
-                    echo=False,
-                    stream=False,
-                    stop=["</s>", "[/INST]", "User:", "Query:"],
-                    repeat_penalty=1.1,
-                    top_k=40,
-                )
-        
-        try:
-            result = await loop.run_in_executor(self.executor, generate_complete)
+                    **SAMPLING_PARAMS
+                )]
+                result = {'choices': [{'text': "".join(tokens)}]}
+            else:
+                try:
+                    result = await loop.run_in_executor(self.executor, generate_complete)
+                finally:
+                    # Stop decoding if the request was cancelled while waiting
+                    cancel.set()
             
             if 'choices' in result and len(result['choices']) > 0:
                 response = result['choices'][0]['text'].strip()
                 
                 # Cache successful responses
                 if response and len(response) > 10:
-                    performance_optimizer.cache_result(
-                        cache_key,
-                        {'full_response': response},
-                        ttl_seconds=3600
-                    )
+                    self._response_cache[cache_key] = response
                 
                 return response
             
@@ -274,10 +406,7 @@ Provide a helpful and accurate response based on the context provided. [/INST]""
     def update_parameters(self, temperature: float, top_p: float):
         """Update model generation parameters and clear cache"""
         # Clear config cache to force reload
-        cache_key = "model_config"
-        if cache_key in performance_optimizer.cache:
-            del performance_optimizer.cache[cache_key]
-            del performance_optimizer.cache_ttl[cache_key]
+        invalidate_config_cache("temperature", "top_p")
         
         logger.info(f"Model parameters updated: temperature={temperature}, top_p={top_p}")
     
@@ -286,16 +415,9 @@ Provide a helpful and accurate response based on the context provided. [/INST]""
         try:
             logger.info("🔄 Reloading optimized model...")
             
-            # Stop current operations
-            with self.model_lock:
-                old_model = self.model
-                self.model = None
-            
-            # Clean up old model
-            if old_model:
-                del old_model
-            
-            # Reload in background
+            # Unload after in-flight generations finish, then queue the reload
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.executor, self._unload_model)
             self._preload_model()
             
             # Wait for new model to load
@@ -312,8 +434,8 @@ Provide a helpful and accurate response based on the context provided. [/INST]""
         """Get model performance statistics"""
         return {
             'model_loaded': self.model is not None,
-            'model_path': self.settings.model_path,
-            'cache_size': len(performance_optimizer.cache),
+            'model_path': self.settings.resolved_model_path(),
+            'cache_size': len(self._response_cache),
             'executor_threads': self.executor._max_workers,
             'memory_usage_mb': performance_optimizer.performance_metrics['memory_usage']
         }
@@ -326,10 +448,7 @@ Provide a helpful and accurate response based on the context provided. [/INST]""
         for i in range(iterations):
             # Clear cache for fair benchmarking (except first iteration)
             if i > 0:
-                cache_key = self._get_cache_key(query, context[:500], {'temperature': 0.7, 'top_p': 1.0})
-                if cache_key in performance_optimizer.cache:
-                    del performance_optimizer.cache[cache_key]
-                    del performance_optimizer.cache_ttl[cache_key]
+                self._response_cache.clear()
             
             start_time = time.time()
             response = await self.generate(query, context)
@@ -356,12 +475,10 @@ Provide a helpful and accurate response based on the context provided. [/INST]""
         """Clean up resources"""
         try:
             if self.executor:
+                self.executor.submit(self._unload_model)
                 self.executor.shutdown(wait=True)
             
-            with self.model_lock:
-                if self.model:
-                    del self.model
-                    self.model = None
+            self.model = None
             
             logger.info("✅ LLM client cleanup completed")
             
@@ -5,20 +5,76 @@ Performance improvements for large document processing
 import chromadb
 from chromadb.config import Settings
 from sentence_transformers import SentenceTransformer
-import json
+import torch
 import logging
 import asyncio
 import numpy as np
+from cachetools import LRUCache
+from collections import Counter
 from typing import List, Dict, Optional, Tuple
-import uuid
+import threading
 from concurrent.futures import ThreadPoolExecutor
-import hashlib
+import struct
+import xxhash
 
 from backend.core.config import get_settings
-from backend.core.performance_optimizer import performance_optimizer, timed
+from backend.core.llm_client import available_cpu_count, cpu_flags
+from backend.core.onnx_embedder import ONNX_AVAILABLE, OnnxEmbedder
+from backend.core.embedding_cache import PersistentEmbeddingCache
+from backend.core.vector_store import (
+    chunk_id, collection_metadata, decode_images, encode_images, log_stale_collection_metadata
+)
+from backend.core.performance_optimizer import COST_SEARCH, performance_optimizer, timed
 
 logger = logging.getLogger(__name__)
 
+EMBEDDING_MODEL_NAME = 'BAAI/bge-base-en-v1.5'
+EMBEDDING_DIMENSIONS = 768
+
+# CPU flags for native BF16 matmuls; without them autocast is emulated and slower
+BF16_CPU_FLAGS = {"avx512_bf16", "amx_bf16"}
+
+# Embeddings kept for texts seen recently, least recently used evicted first
+EMBEDDING_CACHE_SIZE = 1000
+
+# Chunks written per collection.add call; bounds the embedding list copies
+ADD_BATCH_SIZE = 1024
+
+# Rows dequantized per step when scoring the INT8 search matrix
+SCORE_BLOCK_ROWS = 4096
+
+# INT8 candidates per requested result, re-ranked with the exact float32 vectors
+RERANK_CANDIDATES_FACTOR = 4
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Scale rows to unit length so cosine similarity is a plain dot product"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+def _quantize_rows(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Symmetric per-row INT8 quantization
+    
+    Args:
+        matrix: float array of shape (n, dim)
+        
+    Returns:
+        (int8 codes of shape (n, dim), float32 scales of shape (n,)) with row ~= codes * scale
+    """
+    scales = np.abs(matrix).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    codes = np.round(matrix / scales[:, None]).astype(np.int8)
+    return np.ascontiguousarray(codes), scales.astype(np.float32)
+
+def _score_rows(codes: np.ndarray, scales: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Dot products of INT8 rows with a float32 query, dequantizing one block at a time"""
+    scores = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+        block = codes[start:start + SCORE_BLOCK_ROWS]
+        scores[start:start + len(block)] = block.astype(np.float32) @ query
+    return scores * scales
+
 class OptimizedVectorStore:
     """High-performance ChromaDB vector store with optimizations"""
     
@@ -27,8 +83,17 @@ class OptimizedVectorStore:
         self.client = None
         self.collection = None
         self.embedding_model = None
-        self.executor = ThreadPoolExecutor(max_workers=4)
-        self._embedding_cache = {}
+        self._bf16_autocast = False
+        self.executor = ThreadPoolExecutor(max_workers=min(8, available_cpu_count()))
+        self._embedding_cache = LRUCache(maxsize=EMBEDDING_CACHE_SIZE)
+        self._embedding_cache_lock = threading.Lock()
+        # Second tier behind the LRU, shared across restarts (None when disabled)
+        self._disk_cache: Optional[PersistentEmbeddingCache] = None
+        # In-memory search index: (chunk ids, INT8 codes of the unit-length
+        # embeddings, per-row scales), loaded from Chroma on first search and
+        # replaced as a whole
+        self._search_index: Optional[Tuple[List[str], np.ndarray, np.ndarray]] = None
+        self._search_index_lock = threading.Lock()
         self._initialize()
     
     def _initialize(self):
@@ -44,30 +109,23 @@ class OptimizedVectorStore:
             )
             
             # Load embedding model with optimizations
-            logger.info("Loading optimized BAAI/bge-base-en-v1.5 embedding model...")
-            self.embedding_model = SentenceTransformer(
-                'BAAI/bge-base-en-v1.5',
-                device='cpu'  # Explicit CPU usage for consistency
-            )
-            
-            # Enable model optimizations
-            self.embedding_model.eval()  # Set to evaluation mode for inference
+            logger.info(f"Loading optimized {EMBEDDING_MODEL_NAME} embedding model...")
+            self.embedding_model = self._load_embedding_model()
             logger.info("✅ Optimized embedding model loaded")
             
+            if self.settings.embedding_cache_path:
+                self._disk_cache = self._open_disk_cache()
+            
             # Get or create collection with optimized metadata
             try:
                 self.collection = self.client.get_collection("ragdemo_documents")
                 logger.info("✅ Connected to existing ChromaDB collection")
+                log_stale_collection_metadata(self.collection, self.settings)
             except ValueError:
                 # Collection doesn't exist, create with optimizations
                 self.collection = self.client.create_collection(
                     name="ragdemo_documents",
-                    metadata={
-                        "hnsw:space": "cosine",
-                        "hnsw:construction_ef": 200,  # Higher for better quality
-                        "hnsw:M": 16,  # Optimal connections per node
-                        "hnsw:ef_search": 100,  # Search parameter
-                    }
+                    metadata=collection_metadata(self.settings)
                 )
                 logger.info("✅ Created optimized ChromaDB collection")
                 
@@ -75,65 +133,238 @@ class OptimizedVectorStore:
             logger.error(f"❌ Failed to initialize optimized vector store: {e}")
             raise RuntimeError(f"Vector store initialization failed: {e}")
     
-    def _get_embedding_cache_key(self, text: str) -> str:
-        """Generate cache key for embeddings"""
-        return hashlib.md5(text.encode()).hexdigest()
+    def _load_embedding_model(self):
+        """INT8 ONNX Runtime embedder when available, otherwise SentenceTransformer"""
+        if ONNX_AVAILABLE and self.settings.embedding_onnx:
+            try:
+                return OnnxEmbedder(
+                    EMBEDDING_MODEL_NAME,
+                    self.settings.embedding_onnx_dir,
+                    self.settings.embedding_threads
+                )
+            except Exception as e:
+                logger.warning(f"🔄 ONNX embeddings unavailable ({e}), using SentenceTransformer")
+        
+        # Size PyTorch's pool explicitly; one inter-op thread avoids oversubscription
+        torch.set_num_threads(self.settings.embedding_threads or available_cpu_count())
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass  # Already fixed once parallel work has run in this process
+        
+        model = SentenceTransformer(
+            EMBEDDING_MODEL_NAME,
+            device='cpu'  # Explicit CPU usage for consistency
+        )
+        model.eval()  # Set to evaluation mode for inference
+        self._bf16_autocast = self.settings.embedding_bf16 and bool(BF16_CPU_FLAGS & cpu_flags())
+        return model
     
-    def _cache_embedding(self, text: str, embedding: np.ndarray):
-        """Cache embedding for reuse"""
-        cache_key = self._get_embedding_cache_key(text)
-        self._embedding_cache[cache_key] = embedding.tolist()
+    def _open_disk_cache(self) -> Optional[PersistentEmbeddingCache]:
+        """Open the persistent embedding cache; entries are kept apart per embedder"""
+        if isinstance(self.embedding_model, OnnxEmbedder):
+            model_id = f"{EMBEDDING_MODEL_NAME}:onnx-int8"
+        else:
+            model_id = f"{EMBEDDING_MODEL_NAME}:torch-{'bf16' if self._bf16_autocast else 'fp32'}"
         
-        # Limit cache size
-        if len(self._embedding_cache) > 1000:
-            # Remove oldest entries (simple LRU)
-            keys_to_remove = list(self._embedding_cache.keys())[:100]
-            for key in keys_to_remove:
-                del self._embedding_cache[key]
+        try:
+            return PersistentEmbeddingCache(self.settings.embedding_cache_path, model_id)
+        except Exception as e:
+            logger.warning(f"🔄 Persistent embedding cache unavailable ({e}), using memory only")
+            return None
     
-    def _get_cached_embedding(self, text: str) -> Optional[List[float]]:
-        """Get cached embedding if available"""
-        cache_key = self._get_embedding_cache_key(text)
-        return self._embedding_cache.get(cache_key)
+    def _encode(self, sentences, **kwargs) -> np.ndarray:
+        """
+        Run the embedding model, under BF16 autocast on CPUs that support it natively
+        
+        Embeddings come back L2-normalized to match the collection's inner-product space.
+        
+        Args:
+            sentences: A string or list of strings
+            **kwargs: Passed to encode()
+            
+        Returns:
+            float32 embeddings
+        """
+        kwargs.setdefault('normalize_embeddings', True)
+        if not self._bf16_autocast:
+            return self.embedding_model.encode(sentences, **kwargs)
+        
+        # Ask for tensors: BF16 tensors cannot be converted with .numpy()
+        kwargs['convert_to_tensor'] = True
+        with torch.inference_mode(), torch.autocast("cpu", dtype=torch.bfloat16):
+            embeddings = self.embedding_model.encode(sentences, **kwargs)
+        return embeddings.float().numpy()
     
-    def _generate_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
-        """Generate embeddings in batch for better performance"""
-        # Check cache first
-        embeddings = []
-        texts_to_process = []
-        cache_indices = []
+    def _get_embedding_cache_key(self, text: str) -> int:
+        """Generate cache key for embeddings (the integer digest, no hex formatting)"""
+        return xxhash.xxh3_128_intdigest(text.encode())
+    
+    def _generate_embeddings_batch(self, texts: List[str]) -> np.ndarray:
+        """Generate embeddings in batch for better performance, as one float32 (n, dim) array"""
+        # Hash each text once; the keys serve both the lookup and the insert
+        keys = [self._get_embedding_cache_key(text) for text in texts]
+        with self._embedding_cache_lock:
+            cached = [self._embedding_cache.get(key) for key in keys]
+        
+        # Fall back to the on-disk cache for texts evicted or embedded before a restart
+        if self._disk_cache is not None:
+            absent = [key for key, entry in zip(keys, cached) if entry is None]
+            if absent:
+                stored = self._disk_cache.get_many(absent)
+                if stored:
+                    cached = [entry or stored.get(key) for key, entry in zip(keys, cached)]
+                    with self._embedding_cache_lock:
+                        self._embedding_cache.update(stored)
         
-        for i, text in enumerate(texts):
-            cached = self._get_cached_embedding(text)
-            if cached:
-                embeddings.append(cached)
-                cache_indices.append(i)
+        embeddings = np.empty((len(texts), EMBEDDING_DIMENSIONS), dtype=np.float32)
+        missing = []
+        for i, entry in enumerate(cached):
+            if entry is None:
+                missing.append(i)
             else:
-                texts_to_process.append(text)
-                embeddings.append(None)  # Placeholder
+                codes, scale = entry
+                embeddings[i] = np.frombuffer(codes, dtype=np.int8) * scale
         
         # Process uncached texts in batch
-        if texts_to_process:
-            logger.info(f"Generating {len(texts_to_process)} new embeddings (cached: {len(cache_indices)})")
+        if missing:
+            logger.info(f"Generating {len(missing)} new embeddings (cached: {len(texts) - len(missing)})")
             
             # Batch encode for efficiency
-            new_embeddings = self.embedding_model.encode(
-                texts_to_process,
+            new_embeddings = self._encode(
+                [texts[i] for i in missing],
                 batch_size=32,  # Optimal batch size for CPU
-                show_progress_bar=len(texts_to_process) > 10,
+                show_progress_bar=len(missing) > 10,
                 convert_to_tensor=False
             )
+            embeddings[missing] = new_embeddings
             
-            # Cache new embeddings and fill placeholders
-            j = 0
-            for i, embedding in enumerate(embeddings):
-                if embedding is None:  # Was a placeholder
-                    embeddings[i] = new_embeddings[j].tolist()
-                    self._cache_embedding(texts[i], new_embeddings[j])
-                    j += 1
+            # Cache as INT8 codes plus a scale per vector
+            codes, scales = _quantize_rows(embeddings[missing])
+            entries = [(keys[i], row_codes.tobytes(), float(scale)) for i, row_codes, scale in zip(missing, codes, scales)]
+            with self._embedding_cache_lock:
+                for key, row_codes, scale in entries:
+                    self._embedding_cache[key] = (row_codes, scale)
+            if self._disk_cache is not None:
+                try:
+                    self._disk_cache.put_many(entries)
+                except Exception as e:
+                    logger.warning(f"Failed to persist {len(entries)} embeddings: {e}")
         
         return embeddings
     
+    def _get_search_index(self) -> Optional[Tuple[List[str], np.ndarray, np.ndarray]]:
+        """
+        INT8 embedding matrix for in-process search, loaded from Chroma on first use
+        
+        Returns:
+            (chunk ids, codes, scales) or None when the collection is too large to hold in memory
+        """
+        index = self._search_index
+        if index is not None:
+            return index
+        
+        with self._search_index_lock:
+            if self._search_index is None:
+                count = self.collection.count()
+                if count > self.settings.in_memory_search_max_chunks:
+                    return None
+                
+                data = self.collection.get(include=['embeddings'])
+                if data['ids']:
+                    codes, scales = _quantize_rows(_normalize_rows(np.asarray(data['embeddings'], dtype=np.float32)))
+                else:
+                    codes, scales = np.empty((0, EMBEDDING_DIMENSIONS), dtype=np.int8), np.empty(0, dtype=np.float32)
+                self._search_index = (list(data['ids']), codes, scales)
+                logger.info(f"✅ Loaded {len(data['ids'])} embeddings for in-memory search")
+            
+            return self._search_index
+    
+    def _update_search_index(self, remove_ids: List[str] = (), add_ids: List[str] = (), add_embeddings: Optional[np.ndarray] = None):
+        """Apply added and deleted chunks to the loaded search index, if any"""
+        with self._search_index_lock:
+            if self._search_index is None:
+                return  # Loaded with current contents on the next search
+            
+            ids, codes, scales = self._search_index
+            drop = set(remove_ids) | set(add_ids)
+            if drop:
+                keep = [i for i, id_ in enumerate(ids) if id_ not in drop]
+                ids = [ids[i] for i in keep]
+                codes, scales = codes[keep], scales[keep]
+            if add_ids:
+                new_codes, new_scales = _quantize_rows(_normalize_rows(np.asarray(add_embeddings, dtype=np.float32)))
+                ids = ids + list(add_ids)
+                codes = np.vstack([codes, new_codes])
+                scales = np.concatenate([scales, new_scales])
+            
+            if len(ids) > self.settings.in_memory_search_max_chunks:
+                self._search_index = None
+            else:
+                self._search_index = (ids, codes, scales)
+    
+    def _search_in_memory(self, query_embedding: np.ndarray, limit: int) -> Optional[Dict]:
+        """
+        Cosine top-k over the in-memory INT8 matrix, re-ranked exactly with the
+        float32 vectors Chroma returns alongside the winners' text and metadata
+        
+        Args:
+            query_embedding: Query vector
+            limit: Maximum number of results
+            
+        Returns:
+            Results shaped like collection.query() output, or None to query Chroma instead
+        """
+        index = self._get_search_index()
+        if index is None:
+            return None
+        
+        ids, codes, scales = index
+        if not ids or limit <= 0:
+            return {'documents': [[]], 'metadatas': [[]], 'distances': [[]]}
+        
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = _score_rows(codes, scales, query)
+        
+        k = min(limit * RERANK_CANDIDATES_FACTOR, len(ids))
+        candidates = [ids[i] for i in np.argpartition(scores, len(ids) - k)[len(ids) - k:]]
+        
+        found = self.collection.get(ids=candidates, include=['embeddings', 'documents', 'metadatas'])
+        if not found['ids']:
+            return {'documents': [[]], 'metadatas': [[]], 'distances': [[]]}
+        exact = _normalize_rows(np.asarray(found['embeddings'], dtype=np.float32)) @ query
+        order = np.argsort(exact)[::-1][:limit]
+        
+        return {
+            'documents': [[found['documents'][i] for i in order]],
+            'metadatas': [[found['metadatas'][i] for i in order]],
+            'distances': [[1 - float(exact[i]) for i in order]]
+        }
+    
+    def _query(self, query: str, limit: int) -> Dict:
+        """
+        Embed a query and retrieve its nearest chunks (blocking)
+        
+        Args:
+            query: Search query string
+            limit: Maximum number of results
+            
+        Returns:
+            ChromaDB query()-shaped results
+        """
+        query_embedding = self._encode(query)
+        
+        # Score against the in-memory matrix; large collections go through ChromaDB
+        results = self._search_in_memory(query_embedding, limit)
+        if results is None:
+            results = self.collection.query(
+                query_embeddings=[query_embedding.tolist()],
+                n_results=limit,
+                include=['documents', 'metadatas', 'distances']
+            )
+        return results
+    
     @timed("add_document_chunks")
     def add_document_chunks(self, chunks: List[Dict]) -> int:
         """
@@ -152,46 +383,38 @@ class OptimizedVectorStore:
             logger.info(f"Processing {len(chunks)} chunks with batch optimization...")
             
             # Prepare data for ChromaDB
-            ids = []
-            texts = []
-            metadatas = []
-            
-            for chunk in chunks:
-                chunk_id = chunk.get('id', str(uuid.uuid4()))
-                text = chunk['text']
-                
-                ids.append(chunk_id)
-                texts.append(text)
-                metadatas.append({
+            texts = [chunk['text'] for chunk in chunks]
+            ids = [
+                chunk.get('id') or chunk_id(chunk.get('document', 'unknown'), i, text)
+                for i, (chunk, text) in enumerate(zip(chunks, texts))
+            ]
+            metadatas = [
+                {
                     "document": chunk.get('document', 'unknown'),
                     "page": chunk.get('page', 0),
-                    "images": json.dumps(chunk.get('images', [])),
-                    "word_count": chunk.get('word_count', len(text.split()))
-                })
+                    "images": encode_images(chunk.get('images', [])),
+                    "word_count": chunk.get('word_count') or len(text.split())
+                }
+                for chunk, text in zip(chunks, texts)
+            ]
             
             # Generate embeddings in batch
             embeddings = self._generate_embeddings_batch(texts)
             
-            # Add to collection in batches for memory efficiency
-            batch_size = 100
+            # A few large writes; each call is one SQLite transaction in Chroma
             total_added = 0
             
-            for i in range(0, len(chunks), batch_size):
-                end_idx = min(i + batch_size, len(chunks))
-                batch_ids = ids[i:end_idx]
-                batch_texts = texts[i:end_idx]
-                batch_embeddings = embeddings[i:end_idx]
-                batch_metadatas = metadatas[i:end_idx]
-                
+            for i in range(0, len(chunks), ADD_BATCH_SIZE):
+                end_idx = min(i + ADD_BATCH_SIZE, len(chunks))
                 self.collection.add(
-                    ids=batch_ids,
-                    documents=batch_texts,
-                    embeddings=batch_embeddings,
-                    metadatas=batch_metadatas
+                    ids=ids[i:end_idx],
+                    documents=texts[i:end_idx],
+                    embeddings=embeddings[i:end_idx].tolist(),  # Chroma 0.4 validates a list
+                    metadatas=metadatas[i:end_idx]
                 )
-                
-                total_added += len(batch_ids)
-                logger.debug(f"Added batch {i//batch_size + 1}: {len(batch_ids)} chunks")
+                total_added += end_idx - i
+            
+            self._update_search_index(add_ids=ids, add_embeddings=embeddings)
             
             logger.info(f"✅ Added {total_added} chunks to optimized vector store")
             return total_added
@@ -214,28 +437,15 @@ class OptimizedVectorStore:
         """
         try:
             # Check cache first
-            cache_key = f"search:{hashlib.md5(f'{query}:{limit}'.encode()).hexdigest()}"
+            cache_key = f"search:{xxhash.xxh3_128_hexdigest(query.encode() + struct.pack('<q', limit))}"
             cached_result = performance_optimizer.get_cached_result(cache_key)
             if cached_result:
                 logger.debug(f"Cache hit for query: {query[:50]}...")
                 return cached_result
             
-            # Generate query embedding
-            loop = asyncio.get_event_loop()
-            query_embedding = await loop.run_in_executor(
-                self.executor,
-                lambda: self.embedding_model.encode(query).tolist()
-            )
-            
-            # Search in ChromaDB with optimized parameters
-            results = await loop.run_in_executor(
-                self.executor,
-                lambda: self.collection.query(
-                    query_embeddings=[query_embedding],
-                    n_results=limit,
-                    include=['documents', 'metadatas', 'distances']
-                )
-            )
+            # Embed and retrieve in one hop to the executor
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(self.executor, self._query, query, limit)
             
             # Format results
             chunks = []
@@ -250,7 +460,7 @@ class OptimizedVectorStore:
                         'text': doc,
                         'document': metadata.get('document', 'unknown'),
                         'page': metadata.get('page', 0),
-                        'images': json.loads(metadata.get('images', '[]')),
+                        'images': decode_images(metadata.get('images', '')),
                         'similarity': 1 - distance,  # Convert distance to similarity
                         'word_count': metadata.get('word_count', 0)
                     }
@@ -260,7 +470,11 @@ class OptimizedVectorStore:
                 chunks.sort(key=lambda x: x['similarity'], reverse=True)
             
             # Cache results for future queries
-            performance_optimizer.cache_result(cache_key, chunks, ttl_seconds=1800)  # 30 minutes
+            performance_optimizer.cache_result(
+                cache_key, chunks, ttl_seconds=1800,  # 30 minutes
+                tags={chunk['document'] for chunk in chunks},
+                cost=COST_SEARCH
+            )
             
             logger.info(f"Found {len(chunks)} relevant chunks for query: {query[:50]}...")
             return chunks
@@ -298,6 +512,7 @@ class OptimizedVectorStore:
                     total_deleted += len(batch_ids)
                 
                 # Clear related cache entries
+                self._update_search_index(remove_ids=results['ids'])
                 self._clear_document_cache(document_name)
                 
                 logger.info(f"✅ Deleted {total_deleted} chunks for document: {document_name}")
@@ -311,16 +526,8 @@ class OptimizedVectorStore:
     
     def _clear_document_cache(self, document_name: str):
         """Clear cache entries related to a document"""
-        # Clear embedding cache entries for this document
-        # This is a simple implementation - could be more sophisticated
-        cache_keys_to_remove = []
-        for key in performance_optimizer.cache.keys():
-            if key.startswith('search:') and document_name in str(performance_optimizer.cache[key]):
-                cache_keys_to_remove.append(key)
-        
-        for key in cache_keys_to_remove:
-            del performance_optimizer.cache[key]
-            del performance_optimizer.cache_ttl[key]
+        # Drop cached searches that returned chunks of this document
+        performance_optimizer.invalidate_tag(document_name)
     
     def get_collection_stats(self) -> Dict:
         """Get detailed statistics about the collection"""
@@ -334,30 +541,19 @@ class OptimizedVectorStore:
             )
             
             # Analyze document distribution
-            doc_distribution = {}
-            total_word_count = 0
-            
-            if sample_results['metadatas']:
-                for metadata in sample_results['metadatas']:
-                    doc_name = metadata.get('document', 'unknown')
-                    word_count = metadata.get('word_count', 0)
-                    
-                    if doc_name in doc_distribution:
-                        doc_distribution[doc_name] += 1
-                    else:
-                        doc_distribution[doc_name] = 1
-                    
-                    total_word_count += word_count
+            metadatas = sample_results['metadatas'] or []
+            doc_distribution = Counter(m.get('document', 'unknown') for m in metadatas)
+            total_word_count = sum(m.get('word_count', 0) for m in metadatas)
             
             return {
                 "total_chunks": count,
                 "collection_name": "ragdemo_documents",
-                "embedding_model": "BAAI/bge-base-en-v1.5",
-                "embedding_dimensions": 768,
+                "embedding_model": EMBEDDING_MODEL_NAME,
+                "embedding_dimensions": EMBEDDING_DIMENSIONS,
                 "documents_count": len(doc_distribution),
-                "avg_word_count": round(total_word_count / len(sample_results['metadatas']) if sample_results['metadatas'] else 0),
+                "avg_word_count": round(total_word_count / len(metadatas) if metadatas else 0),
                 "cache_entries": len(self._embedding_cache),
-                "top_documents": sorted(doc_distribution.items(), key=lambda x: x[1], reverse=True)[:5]
+                "top_documents": doc_distribution.most_common(5)  # heapq.nlargest, not a full sort
             }
         except Exception as e:
             logger.error(f"❌ Failed to get collection stats: {e}")
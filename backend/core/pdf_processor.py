@@ -5,9 +5,15 @@ Uses PyMuPDF for reliable PDF parsing with image support
 import fitz  # PyMuPDF
 import os
 import json
-import hashlib
+import multiprocessing
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
 from typing import List, Dict, Tuple
 import logging
+import xxhash
 from PIL import Image
 import io
 
@@ -15,6 +21,110 @@ from backend.core.config import get_settings
 
 logger = logging.getLogger(__name__)
 
+# PDFs with at least this many pages are split across worker processes
+PARALLEL_MIN_PAGES = 32
+
+# Pages extracted per worker task
+PAGES_PER_TASK = 16
+
+# PyMuPDF does not support concurrent use from several threads of one process:
+# in-process document access is serialized, parallel extraction uses get_pdf_pool
+_FITZ_LOCK = threading.Lock()
+
+def _read_pages(pdf_document: fitz.Document, start: int, stop: int) -> List[Dict]:
+    """
+    Extract text and raw image data from a range of pages of an open PDF
+    
+    Args:
+        pdf_document: Open PyMuPDF document
+        start: First page index (0-based)
+        stop: Page index to stop before
+        
+    Returns:
+        One dict per page with 'page' (1-based), 'text', 'images' as
+        (bytes, extension) tuples and 'errors' for images that failed
+    """
+    pages = []
+    # Images shared by several pages (logos, headers) are decoded once per xref
+    extracted = {}
+    for page_num in range(start, stop):
+        page = pdf_document[page_num]
+        images = []
+        errors = []
+        for img_index, img in enumerate(page.get_images()):
+            xref = img[0]
+            try:
+                if xref not in extracted:
+                    base_image = pdf_document.extract_image(xref)
+                    extracted[xref] = (base_image["image"], base_image["ext"])
+                images.append(extracted[xref])
+            except Exception as e:
+                errors.append(f"Failed to extract image {img_index} from page {page_num + 1}: {e}")
+        
+        pages.append({
+            'page': page_num + 1,
+            'text': page.get_text(),
+            'images': images,
+            'errors': errors
+        })
+    return pages
+
+def _extract_pages(pdf_path: str, start: int, stop: int) -> List[Dict]:
+    """
+    Extract a range of pages in a worker process
+    
+    Opens the PDF itself (fitz documents cannot be pickled) and leaves
+    writing images to the caller.
+    
+    Args:
+        pdf_path: Path to the PDF file
+        start: First page index (0-based)
+        stop: Page index to stop before
+        
+    Returns:
+        Page dicts as returned by _read_pages
+    """
+    with fitz.open(pdf_path) as pdf_document:
+        return _read_pages(pdf_document, start, stop)
+
+@lru_cache()
+def get_pdf_pool() -> ProcessPoolExecutor:
+    """
+    Worker processes for page extraction, shared by all uploads and reindexing
+    so concurrent PDFs do not each start their own pool
+    """
+    settings = get_settings()
+    # spawn: forking a server process that already runs model threads is unsafe
+    return ProcessPoolExecutor(
+        max_workers=settings.pdf_workers or None,
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
+def _discard_pdf_pool(pool: ProcessPoolExecutor):
+    """Shut down a broken pool so the next get_pdf_pool call starts a new one"""
+    # Another thread may already have replaced it
+    if get_pdf_pool.cache_info().currsize and get_pdf_pool() is pool:
+        get_pdf_pool.cache_clear()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _extract_in_pool(pdf_path: str, page_count: int) -> List[Dict]:
+    """
+    Extract all pages of a PDF in the worker pool, PAGES_PER_TASK at a time
+    
+    Raises:
+        BrokenProcessPool: A worker died (e.g. MuPDF crashed); the pool has been discarded
+    """
+    pool = get_pdf_pool()
+    try:
+        futures = [
+            pool.submit(_extract_pages, pdf_path, start, min(start + PAGES_PER_TASK, page_count))
+            for start in range(0, page_count, PAGES_PER_TASK)
+        ]
+        return [page for future in futures for page in future.result()]
+    except BrokenProcessPool:
+        _discard_pdf_pool(pool)
+        raise
+
 class PDFProcessor:
     """PDF processor for extracting text chunks and images"""
     
@@ -22,14 +132,18 @@ class PDFProcessor:
         self.settings = get_settings()
         self.chunk_size = self.settings.chunk_size
         self.chunk_overlap = self.settings.chunk_overlap
+        os.makedirs(self.settings.image_dir, exist_ok=True)
     
-    def process_pdf(self, pdf_path: str, document_name: str = None) -> Tuple[List[Dict], int]:
+    def process_pdf(self, pdf_path: str, document_name: str = None,
+                    use_pool: bool = False) -> Tuple[List[Dict], int]:
         """
         Process a PDF file and extract text chunks with images
         
         Args:
             pdf_path: Path to the PDF file
             document_name: Name for the document (optional)
+            use_pool: Extract in worker processes even for small PDFs, for
+                callers processing several documents at once
             
         Returns:
             Tuple of (chunks_list, images_count)
@@ -43,54 +157,62 @@ class PDFProcessor:
         logger.info(f"Processing PDF: {document_name}")
         
         try:
-            # Open PDF document
-            pdf_document = fitz.open(pdf_path)
+            # MuPDF reads the file on demand, so opening by path adds no Python-side copy
+            with _FITZ_LOCK, fitz.open(pdf_path) as pdf_document:
+                page_count = pdf_document.page_count
+                in_process = page_count < PARALLEL_MIN_PAGES and not use_pool
+                if in_process:
+                    pages = _read_pages(pdf_document, 0, page_count)
+            
+            # Decode pages in worker processes for large PDFs
+            if not in_process:
+                try:
+                    pages = _extract_in_pool(pdf_path, page_count)
+                except BrokenProcessPool:
+                    logger.warning(f"PDF worker pool broke while processing {document_name}, retrying with a new pool")
+                    try:
+                        pages = _extract_in_pool(pdf_path, page_count)
+                    except BrokenProcessPool:
+                        logger.warning(f"PDF worker pool broke again, extracting {document_name} in process")
+                        with _FITZ_LOCK, fitz.open(pdf_path) as pdf_document:
+                            pages = _read_pages(pdf_document, 0, page_count)
             
             # Extract text and images
-            all_text = ""
             images_extracted = 0
             page_texts = []
+            images_by_page = defaultdict(list)
             
-            for page_num in range(pdf_document.page_count):
-                page = pdf_document[page_num]
-                
-                # Extract text from page
-                page_text = page.get_text()
+            for page in pages:
+                page_num = page['page']
                 page_texts.append({
-                    'page': page_num + 1,
-                    'text': page_text
+                    'page': page_num,
+                    'text': page['text']
                 })
-                all_text += f"\\n\\nPage {page_num + 1}:\\n{page_text}"
                 
-                # Extract images from page
-                image_list = page.get_images()
-                for img_index, img in enumerate(image_list):
+                for error in page['errors']:
+                    logger.warning(error)
+                
+                # Save images from the main process
+                for img_index, (image_bytes, image_ext) in enumerate(page['images']):
                     try:
-                        # Get image data
-                        xref = img[0]
-                        base_image = pdf_document.extract_image(xref)
-                        image_bytes = base_image["image"]
-                        image_ext = base_image["ext"]
-                        
                         # Generate unique filename
-                        image_hash = hashlib.md5(image_bytes).hexdigest()[:8]
-                        image_filename = f"{document_name}_p{page_num+1}_{image_hash}.{image_ext}"
+                        image_hash = xxhash.xxh3_64_hexdigest(image_bytes)[:8]
+                        image_filename = f"{document_name}_p{page_num}_{image_hash}.{image_ext}"
                         image_path = os.path.join(self.settings.image_dir, image_filename)
                         
                         # Save image
                         with open(image_path, "wb") as img_file:
                             img_file.write(image_bytes)
                         
+                        images_by_page[page_num].append(image_filename)
                         images_extracted += 1
                         logger.debug(f"Extracted image: {image_filename}")
                         
                     except Exception as e:
-                        logger.warning(f"Failed to extract image {img_index} from page {page_num + 1}: {e}")
-            
-            pdf_document.close()
+                        logger.warning(f"Failed to extract image {img_index} from page {page_num}: {e}")
             
             # Create text chunks
-            chunks = self._create_chunks(all_text, page_texts, document_name)
+            chunks = self._create_chunks(page_texts, document_name, images_by_page)
             
             logger.info(f"✅ Processed {document_name}: {len(chunks)} chunks, {images_extracted} images")
             
@@ -100,103 +222,75 @@ class PDFProcessor:
             logger.error(f"❌ Failed to process PDF {document_name}: {e}")
             raise RuntimeError(f"PDF processing failed: {e}")
     
-    def _create_chunks(self, full_text: str, page_texts: List[Dict], document_name: str) -> List[Dict]:
+    def _create_chunks(self, page_texts: List[Dict], document_name: str,
+                       images_by_page: Dict[int, List[str]]) -> List[Dict]:
         """
-        Create overlapping text chunks from extracted text
+        Create overlapping text chunks from extracted text, page by page
+        
+        Words stream through a window, so the document is never joined into
+        one string, and each chunk's page is the page of its first word.
         
         Args:
-            full_text: Complete text from PDF
             page_texts: List of page-specific text data
             document_name: Source document name
+            images_by_page: Image filenames extracted from each page (1-based)
             
         Returns:
             List of chunk dictionaries
         """
         chunks = []
+        words = []
+        # (word position, page) where each buffered page's words begin
+        page_starts = deque()
+        base = 0   # Position of words[0] within the document
+        start = 0  # Position of the current window's first word
+        step = max(1, self.chunk_size - self.chunk_overlap)
         
-        # Simple word-based chunking
-        words = full_text.split()
-        
-        if len(words) <= self.chunk_size:
-            # Document is small enough to be a single chunk
-            chunks.append({
-                'id': f"{document_name}_chunk_1",
-                'text': full_text.strip(),
-                'document': document_name,
-                'page': 1,
-                'images': self._get_page_images(document_name, 1),
-                'word_count': len(words)
-            })
-            return chunks
-        
-        # Create overlapping chunks
-        chunk_id = 1
-        start_idx = 0
-        
-        while start_idx < len(words):
-            # Get chunk words
-            end_idx = min(start_idx + self.chunk_size, len(words))
-            chunk_words = words[start_idx:end_idx]
-            chunk_text = ' '.join(chunk_words)
-            
-            # Determine primary page for this chunk
-            chunk_page = self._estimate_page_number(start_idx, len(words), len(page_texts))
-            
-            # Get images associated with this chunk's pages
-            chunk_images = self._get_chunk_images(document_name, chunk_page)
-            
+        def emit():
+            while len(page_starts) > 1 and page_starts[1][0] <= start:
+                page_starts.popleft()
+            chunk_words = words[start - base:start - base + self.chunk_size]
+            chunk_page = page_starts[0][1]
             chunks.append({
-                'id': f"{document_name}_chunk_{chunk_id}",
-                'text': chunk_text.strip(),
+                'id': f"{document_name}_chunk_{len(chunks) + 1}",
+                'text': ' '.join(chunk_words),
                 'document': document_name,
                 'page': chunk_page,
-                'images': chunk_images,
+                'images': self._get_chunk_images(images_by_page, chunk_page),
                 'word_count': len(chunk_words)
             })
+        
+        for page in page_texts:
+            page_words = page['text'].split()
+            if not page_words:
+                continue
+            page_starts.append((base + len(words), page['page']))
+            words.extend(page_words)
             
-            chunk_id += 1
+            # A full window followed by more words: emit it, keep the overlap
+            while base + len(words) - start > self.chunk_size:
+                emit()
+                start += step
             
-            # Move start position (with overlap)
-            if end_idx >= len(words):
-                break
-            start_idx = end_idx - self.chunk_overlap
+            # Drop words no window will reach again
+            del words[:start - base]
+            base = start
         
-        return chunks
-    
-    def _estimate_page_number(self, word_index: int, total_words: int, total_pages: int) -> int:
-        """Estimate which page a word index corresponds to"""
-        if total_words == 0:
-            return 1
-        
-        # Simple linear estimation
-        estimated_page = int((word_index / total_words) * total_pages) + 1
-        return min(max(estimated_page, 1), total_pages)
-    
-    def _get_page_images(self, document_name: str, page_num: int) -> List[str]:
-        """Get list of image filenames for a specific page"""
-        images = []
-        try:
-            # Look for images with this document and page pattern
-            for filename in os.listdir(self.settings.image_dir):
-                if filename.startswith(f"{document_name}_p{page_num}_"):
-                    images.append(filename)
-        except Exception as e:
-            logger.debug(f"Could not scan images directory: {e}")
+        # Final (possibly short) chunk
+        if words:
+            emit()
         
-        return images
+        return chunks
     
-    def _get_chunk_images(self, document_name: str, primary_page: int) -> List[str]:
+    def _get_chunk_images(self, images_by_page: Dict[int, List[str]], primary_page: int) -> List[str]:
         """Get images for a chunk (including adjacent pages for overlap)"""
         images = []
         
         # Get images from primary page and adjacent pages
         for page_offset in [-1, 0, 1]:
-            page_num = primary_page + page_offset
-            if page_num > 0:
-                page_images = self._get_page_images(document_name, page_num)
-                images.extend(page_images)
+            images.extend(images_by_page.get(primary_page + page_offset, []))
         
-        return list(set(images))  # Remove duplicates
+        return list(dict.fromkeys(images))  # Remove duplicates, keep page order
     
     def validate_pdf(self, pdf_path: str) -> bool:
         """
@@ -209,9 +303,8 @@ class PDFProcessor:
             True if valid PDF, False otherwise
         """
         try:
-            pdf_document = fitz.open(pdf_path)
-            page_count = pdf_document.page_count
-            pdf_document.close()
+            with _FITZ_LOCK, fitz.open(pdf_path) as pdf_document:
+                page_count = pdf_document.page_count
             
             return page_count > 0
             
@@ -230,17 +323,13 @@ class PDFProcessor:
             Dictionary with PDF information
         """
         try:
-            pdf_document = fitz.open(pdf_path)
-            
-            info = {
-                "filename": os.path.basename(pdf_path),
-                "page_count": pdf_document.page_count,
-                "file_size": os.path.getsize(pdf_path),
-                "metadata": pdf_document.metadata
-            }
-            
-            pdf_document.close()
-            return info
+            with _FITZ_LOCK, fitz.open(pdf_path) as pdf_document:
+                return {
+                    "filename": os.path.basename(pdf_path),
+                    "page_count": pdf_document.page_count,
+                    "file_size": os.path.getsize(pdf_path),
+                    "metadata": pdf_document.metadata
+                }
             
         except Exception as e:
             logger.error(f"Failed to get PDF info for {pdf_path}: {e}")
@@ -2,19 +2,24 @@
 Follow-up question suggestions generation
 """
 import re
-from typing import List, Dict
+from typing import AbstractSet, List, Dict, Optional
 import logging
 
 from backend.core.llm_client import LLMClient
 
 logger = logging.getLogger(__name__)
 
+# Words compared when filtering out suggestions that repeat the query
+WORD_PATTERN = re.compile(r'\w+')
+
+# List markers stripped from LLM suggestion lines ("1. ", "- ", "• ")
+NUMBERING_PATTERN = re.compile(r'^\d+\.\s*')
+BULLET_PATTERN = re.compile(r'^[-•]\s*')
+
 class SuggestionGenerator:
     """Generate contextual follow-up questions"""
     
     def __init__(self):
-        self.llm_client = LLMClient()
-        
         # Predefined suggestion templates for common IT topics
         self.suggestion_templates = {
             'password': [
@@ -54,14 +59,26 @@ class SuggestionGenerator:
                 "What if software won't start?"
             ]
         }
+        
+        # Word sets of the templates, computed once for the similarity filter
+        self._template_words = {
+            topic: [frozenset(WORD_PATTERN.findall(suggestion.lower())) for suggestion in suggestions]
+            for topic, suggestions in self.suggestion_templates.items()
+        }
+        
+        # All topic keywords in one alternation, so a query is scanned once
+        self._topic_pattern = re.compile("|".join(map(re.escape, self.suggestion_templates)))
     
-    async def generate_suggestions(self, query: str, context_chunks: List[Dict]) -> List[str]:
+    async def generate_suggestions(self, query: str, context_chunks: List[Dict],
+                                   llm_client: Optional[LLMClient] = None) -> List[str]:
         """
         Generate contextual follow-up questions
         
         Args:
             query: User's original query
             context_chunks: Retrieved context chunks
+            llm_client: The application's shared LLM client; without one,
+                queries no template matches get the generic suggestions
             
         Returns:
             List of suggested follow-up questions
@@ -73,8 +90,11 @@ class SuggestionGenerator:
             if template_suggestions:
                 return template_suggestions[:4]
             
+            if llm_client is None:
+                return self._get_fallback_suggestions()
+            
             # Fall back to LLM-generated suggestions
-            return await self._generate_llm_suggestions(query, context_chunks)
+            return await self._generate_llm_suggestions(query, context_chunks, llm_client)
             
         except Exception as e:
             logger.warning(f"Suggestion generation failed: {e}")
@@ -85,27 +105,26 @@ class SuggestionGenerator:
         
         query_lower = query.lower()
         
-        # Check for keywords in query
-        for topic, suggestions in self.suggestion_templates.items():
-            if topic in query_lower:
-                # Filter out suggestions too similar to original query
-                filtered_suggestions = []
-                for suggestion in suggestions:
-                    if not self._is_too_similar(query_lower, suggestion.lower()):
-                        filtered_suggestions.append(suggestion)
-                
-                return filtered_suggestions[:4]
+        # Check for keywords in query; the first topic in template order wins
+        found = set(self._topic_pattern.findall(query_lower))
+        topic = next((topic for topic in self.suggestion_templates if topic in found), None)
+        if topic is None:
+            return []
         
-        return []
-    
-    def _is_too_similar(self, query1: str, query2: str) -> bool:
-        """Check if two queries are too similar"""
+        # Filter out suggestions too similar to original query
+        query_words = set(WORD_PATTERN.findall(query_lower))
+        filtered_suggestions = [
+            suggestion
+            for suggestion, words in zip(self.suggestion_templates[topic], self._template_words[topic])
+            if not self._is_too_similar(query_words, words)
+        ]
         
-        # Simple word overlap check
-        words1 = set(re.findall(r'\\w+', query1))
-        words2 = set(re.findall(r'\\w+', query2))
+        return filtered_suggestions[:4]
+    
+    def _is_too_similar(self, words1: AbstractSet[str], words2: AbstractSet[str]) -> bool:
+        """Check if two queries, given as their lowercase word sets, are too similar"""
         
-        # If more than 70% of words overlap, consider too similar
+        # Simple word overlap check: if more than 70% of words overlap, consider too similar
         if len(words1) == 0 or len(words2) == 0:
             return False
         
@@ -114,7 +133,8 @@ class SuggestionGenerator:
         
         return similarity > 0.7
     
-    async def _generate_llm_suggestions(self, query: str, context_chunks: List[Dict]) -> List[str]:
+    async def _generate_llm_suggestions(self, query: str, context_chunks: List[Dict],
+                                        llm_client: LLMClient) -> List[str]:
         """Generate suggestions using LLM"""
         
         # Summarize context for prompt
@@ -136,19 +156,17 @@ User asked: "{query}"{context_summary}
 Generate 4 specific, actionable follow-up questions. Return only the questions, one per line:"""
         
         try:
-            response = await self.llm_client.generate(prompt, "")
+            response = await llm_client.generate(prompt, "")
             
             # Parse suggestions from response
             suggestions = []
-            for line in response.split('\\n'):
-                line = line.strip()
-                if line and not line.startswith('1.') and not line.startswith('-'):
-                    # Clean up the line
-                    line = re.sub(r'^\\d+\\.\\s*', '', line)  # Remove numbering
-                    line = re.sub(r'^[-•]\\s*', '', line)     # Remove bullets
-                    
-                    if len(line) > 10 and line.endswith('?'):
-                        suggestions.append(line)
+            for line in response.splitlines():
+                # Clean up the line
+                line = NUMBERING_PATTERN.sub('', line.strip())  # Remove numbering
+                line = BULLET_PATTERN.sub('', line)             # Remove bullets
+                
+                if len(line) > 10 and line.endswith('?'):
+                    suggestions.append(line)
             
             return suggestions[:4]
             
@@ -169,6 +187,7 @@ Generate 4 specific, actionable follow-up questions. Return only the questions,
 # Global instance for easy access
 suggestion_generator = SuggestionGenerator()
 
-async def generate_suggestions(query: str, context_chunks: List[Dict]) -> List[str]:
+async def generate_suggestions(query: str, context_chunks: List[Dict],
+                               llm_client: Optional[LLMClient] = None) -> List[str]:
     """Convenience function for generating suggestions"""
-    return await suggestion_generator.generate_suggestions(query, context_chunks)
\ No newline at end of file
+    return await suggestion_generator.generate_suggestions(query, context_chunks, llm_client)
\ No newline at end of file
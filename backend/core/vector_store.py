@@ -1,18 +1,198 @@
 """
 ChromaDB vector store for document embeddings and semantic search
 """
+import asyncio
 import chromadb
 from chromadb.config import Settings
 from sentence_transformers import SentenceTransformer
+import torch
 import json
 import logging
-from typing import List, Dict, Optional
-import uuid
+from cachetools import LRUCache
+from typing import List, Dict, Optional, Tuple
+import threading
+import xxhash
 
 from backend.core.config import get_settings
 
 logger = logging.getLogger(__name__)
 
+# Chunks per embedding model forward pass during ingestion
+EMBED_BATCH_SIZE = 64
+
+# Query embeddings kept for repeated searches, least recently used evicted first
+QUERY_EMBEDDING_CACHE_SIZE = 2048
+
+# Concurrent query encodes are coalesced into one forward pass of up to this
+# many queries, waiting at most this long for the batch to fill
+QUERY_BATCH_SIZE = 16
+QUERY_BATCH_WAIT_SECONDS = 0.005
+
+# Bumped whenever indexed content changes so callers can invalidate
+# anything derived from search results
+_index_generation = 0
+
+def get_index_generation() -> int:
+    """Get the current index generation counter"""
+    return _index_generation
+
+def _bump_index_generation():
+    global _index_generation
+    _index_generation += 1
+
+def chunk_id(document: str, index: int, text: str) -> str:
+    """
+    Deterministic id for a chunk that arrived without one
+    
+    Re-ingesting the same document yields the same ids, so Chroma skips
+    chunks it already holds instead of storing duplicates.
+    
+    Args:
+        document: Source document name
+        index: Position of the chunk in the batch being added
+        text: Chunk text
+        
+    Returns:
+        Chunk id string
+    """
+    return f"{document}-{index}-{xxhash.xxh3_64_hexdigest(text)}"
+
+# Joins image filenames in chunk metadata (ASCII unit separator, never in a filename)
+IMAGE_SEPARATOR = "\x1f"
+
+def encode_images(images: List[str]) -> str:
+    """Pack a chunk's image filenames into one metadata string"""
+    return IMAGE_SEPARATOR.join(images)
+
+def decode_images(value: str) -> List[str]:
+    """
+    Unpack image filenames stored by encode_images
+    
+    Chunks indexed before the separator format hold a JSON list; those are
+    still parsed as JSON until the document is reindexed.
+    
+    Args:
+        value: The 'images' metadata string
+        
+    Returns:
+        List of image filenames
+    """
+    if not value:
+        return []
+    if value == "[]" or value.startswith('["'):
+        return json.loads(value)
+    return value.split(IMAGE_SEPARATOR)
+
+def collection_metadata(settings) -> Dict:
+    """
+    Metadata for creating the document collection, including its HNSW parameters
+    
+    Embeddings are stored L2-normalized, so the inner-product space ranks
+    exactly like cosine while skipping the norm computations per comparison.
+    
+    Chroma fixes these when the collection is created; changing them only
+    affects collections created afterwards (e.g. after clear_all).
+    
+    Args:
+        settings: Application settings
+        
+    Returns:
+        Metadata dictionary for create_collection
+    """
+    return {
+        "hnsw:space": "ip",
+        "hnsw:M": settings.hnsw_m,
+        "hnsw:construction_ef": settings.hnsw_ef_construction,
+        "hnsw:search_ef": settings.hnsw_ef_search,
+    }
+
+def log_stale_collection_metadata(collection, settings):
+    """
+    Log when an existing collection was created with other HNSW settings
+    (e.g. cosine space from before embeddings were normalized); a re-index
+    recreates it with the current ones
+    
+    Args:
+        collection: Connected ChromaDB collection
+        settings: Application settings
+    """
+    current = getattr(collection, "metadata", None) or {}
+    stale = {
+        key: current.get(key)
+        for key, value in collection_metadata(settings).items()
+        if current.get(key) != value
+    }
+    if stale:
+        logger.info(f"🔄 Collection uses {stale}; re-index to apply the configured HNSW settings")
+
+class _EmbedBatcher:
+    """
+    Dynamic batching for query embeddings
+    
+    Searches submit their query and await a future; a background task
+    collects whatever arrives within QUERY_BATCH_WAIT_SECONDS (up to
+    QUERY_BATCH_SIZE queries) and embeds them with a single encode call.
+    """
+    
+    def __init__(self, encode):
+        """
+        Args:
+            encode: Blocking function mapping a list of texts to normalized embeddings
+        """
+        self._encode = encode
+        self._loop = None
+        self._queue = None
+        self._task = None
+    
+    async def submit(self, text: str) -> List[float]:
+        """
+        Embed one query as part of the next batch
+        
+        Args:
+            text: Query text
+            
+        Returns:
+            Query embedding
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+        
+        future = loop.create_future()
+        self._queue.put_nowait((text, future))
+        return await future
+    
+    async def _run(self):
+        """Collect and embed batches for as long as the loop runs"""
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + QUERY_BATCH_WAIT_SECONDS
+            while len(batch) < QUERY_BATCH_SIZE:
+                remaining = deadline - self._loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            
+            # Identical concurrent queries share one row of the batch
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                embeddings = await asyncio.to_thread(self._encode, texts)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            rows = dict(zip(texts, embeddings))
+            for text, future in batch:
+                if not future.done():
+                    future.set_result(rows[text].tolist())
+
 class VectorStore:
     """ChromaDB-based vector store for document chunks"""
     
@@ -21,6 +201,10 @@ class VectorStore:
         self.client = None
         self.collection = None
         self.embedding_model = None
+        self._bulk_buffer = None
+        self._bulk_lock = threading.Lock()
+        self._query_embeddings = LRUCache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)
+        self._query_batcher = _EmbedBatcher(self._encode_queries)
         self._initialize()
     
     def _initialize(self):
@@ -33,19 +217,20 @@ class VectorStore:
             
             # Load embedding model
             logger.info("Loading BAAI/bge-base-en-v1.5 embedding model...")
-            self.embedding_model = SentenceTransformer('BAAI/bge-base-en-v1.5')
-            logger.info("✅ Embedding model loaded")
+            self.embedding_model = self._load_embedding_model()
+            logger.info(f"✅ Embedding model loaded ({self.settings.embedding_precision})")
             
             # Get or create collection
             try:
                 self.collection = self.client.get_collection("ragdemo_documents")
                 logger.info("✅ Connected to existing ChromaDB collection")
+                log_stale_collection_metadata(self.collection, self.settings)
             except (ValueError, Exception):
                 # Collection doesn't exist, create it
                 try:
                     self.collection = self.client.create_collection(
                         name="ragdemo_documents",
-                        metadata={"hnsw:space": "cosine"}
+                        metadata=collection_metadata(self.settings)
                     )
                     logger.info("✅ Created new ChromaDB collection")
                 except Exception as create_error:
@@ -62,6 +247,59 @@ class VectorStore:
             logger.error(f"❌ Failed to initialize vector store: {e}")
             raise RuntimeError(f"Vector store initialization failed: {e}")
     
+    def _load_embedding_model(self) -> SentenceTransformer:
+        """
+        Load the BGE encoder at the configured precision
+        
+        On GPU, fp16 and int8 both run the model in half precision. On CPU,
+        int8 applies dynamic quantization to the Linear layers (INT8 weights,
+        VNNI kernels where available) and fp16 stays at fp32, which CPUs run faster.
+        
+        Returns:
+            SentenceTransformer model ready for encode()
+        """
+        model = SentenceTransformer('BAAI/bge-base-en-v1.5')
+        model.eval()
+        precision = self.settings.embedding_precision
+        
+        if model.device.type == "cuda":
+            if precision != "fp32":
+                model.half()
+        elif precision == "int8":
+            transformer = model._first_module()
+            transformer.auto_model = torch.quantization.quantize_dynamic(
+                transformer.auto_model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        
+        return model
+    
+    def _prepare_chunks(self, chunks: List[Dict]) -> Tuple[List[str], List[str], List[List[float]], List[Dict]]:
+        """Build ChromaDB ids, texts, embeddings and metadatas for chunks"""
+        texts = [chunk['text'] for chunk in chunks]
+        ids = [
+            chunk.get('id') or chunk_id(chunk.get('document', 'unknown'), i, text)
+            for i, (chunk, text) in enumerate(zip(chunks, texts))
+        ]
+        metadatas = [
+            {
+                "document": chunk.get('document', 'unknown'),
+                "page": chunk.get('page', 0),
+                "images": encode_images(chunk.get('images', []))
+            }
+            for chunk in chunks
+        ]
+        
+        # One batched forward pass per EMBED_BATCH_SIZE chunks instead of one per chunk
+        embeddings = self.embedding_model.encode(
+            texts,
+            batch_size=EMBED_BATCH_SIZE,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        ).tolist()
+        
+        return ids, texts, embeddings, metadatas
+    
     def add_document_chunks(self, chunks: List[Dict]) -> int:
         """
         Add document chunks to the vector store
@@ -81,27 +319,7 @@ class VectorStore:
             return 0
         
         try:
-            # Prepare data for ChromaDB
-            ids = []
-            texts = []
-            embeddings = []
-            metadatas = []
-            
-            for chunk in chunks:
-                chunk_id = chunk.get('id', str(uuid.uuid4()))
-                text = chunk['text']
-                
-                # Generate embedding
-                embedding = self.embedding_model.encode(text).tolist()
-                
-                ids.append(chunk_id)
-                texts.append(text)
-                embeddings.append(embedding)
-                metadatas.append({
-                    "document": chunk.get('document', 'unknown'),
-                    "page": chunk.get('page', 0),
-                    "images": json.dumps(chunk.get('images', []))
-                })
+            ids, texts, embeddings, metadatas = self._prepare_chunks(chunks)
             
             # Add to collection
             self.collection.add(
@@ -111,6 +329,7 @@ class VectorStore:
                 metadatas=metadatas
             )
             
+            _bump_index_generation()
             logger.info(f"✅ Added {len(chunks)} chunks to vector store")
             return len(chunks)
             
@@ -118,6 +337,123 @@ class VectorStore:
             logger.error(f"❌ Failed to add chunks to vector store: {e}")
             raise RuntimeError(f"Failed to add document chunks: {e}")
     
+    def replace_document_chunks(self, document_name: str, chunks: List[Dict]) -> int:
+        """
+        Replace a document's chunks, keeping the current ones until the new ones are stored
+        
+        The new chunks are embedded first and upserted over the deterministic
+        chunk ids; only old ids the new version no longer has are deleted
+        afterwards, so a failure leaves the document searchable.
+        
+        Args:
+            document_name: Name of the document being re-ingested
+            chunks: New chunk dictionaries (see add_document_chunks)
+            
+        Returns:
+            Number of chunks stored
+        """
+        try:
+            old_ids = self.collection.get(where={"document": document_name}, include=[])['ids']
+            
+            ids = []
+            if chunks:
+                ids, texts, embeddings, metadatas = self._prepare_chunks(chunks)
+                self.collection.upsert(
+                    ids=ids,
+                    documents=texts,
+                    embeddings=embeddings,
+                    metadatas=metadatas
+                )
+            
+            stale_ids = list(set(old_ids).difference(ids))
+            if stale_ids:
+                self.collection.delete(ids=stale_ids)
+            
+            _bump_index_generation()
+            logger.info(f"✅ Replaced chunks of {document_name}: {len(ids)} stored, {len(stale_ids)} removed")
+            return len(ids)
+            
+        except Exception as e:
+            logger.error(f"❌ Failed to replace document chunks: {e}")
+            raise RuntimeError(f"Failed to replace document chunks: {e}")
+    
+    def begin_bulk(self):
+        """Start buffering chunks for a single bulk insert (see finish_bulk)"""
+        with self._bulk_lock:
+            self._bulk_buffer = ([], [], [], [])
+    
+    def add_document_chunks_bulk(self, chunks: List[Dict]) -> int:
+        """
+        Embed chunks and buffer them for the pending bulk insert
+        
+        Args:
+            chunks: List of chunk dictionaries (see add_document_chunks)
+            
+        Returns:
+            Number of chunks buffered
+        """
+        if not chunks:
+            return 0
+        
+        try:
+            prepared = self._prepare_chunks(chunks)
+        except Exception as e:
+            logger.error(f"❌ Failed to prepare chunks for bulk insert: {e}")
+            raise RuntimeError(f"Failed to add document chunks: {e}")
+        
+        with self._bulk_lock:
+            if self._bulk_buffer is None:
+                raise RuntimeError("No bulk insert in progress, call begin_bulk() first")
+            for buffered, values in zip(self._bulk_buffer, prepared):
+                buffered.extend(values)
+        
+        return len(chunks)
+    
+    def finish_bulk(self) -> int:
+        """
+        Insert all buffered chunks into the collection
+        
+        Returns:
+            Number of chunks added
+        """
+        with self._bulk_lock:
+            buffer, self._bulk_buffer = self._bulk_buffer, None
+        
+        if not buffer or not buffer[0]:
+            return 0
+        
+        ids, texts, embeddings, metadatas = buffer
+        
+        try:
+            # ChromaDB caps the number of records per add call
+            batch_size = getattr(self.client, "max_batch_size", None) or len(ids)
+            for start in range(0, len(ids), batch_size):
+                end = start + batch_size
+                self.collection.add(
+                    ids=ids[start:end],
+                    documents=texts[start:end],
+                    embeddings=embeddings[start:end],
+                    metadatas=metadatas[start:end]
+                )
+            
+            _bump_index_generation()
+            logger.info(f"✅ Bulk added {len(ids)} chunks to vector store")
+            return len(ids)
+            
+        except Exception as e:
+            logger.error(f"❌ Failed to bulk add chunks to vector store: {e}")
+            raise RuntimeError(f"Failed to add document chunks: {e}")
+    
+    def _encode_queries(self, queries: List[str]):
+        """Embed a batch of queries in one forward pass"""
+        return self.embedding_model.encode(
+            queries,
+            batch_size=QUERY_BATCH_SIZE,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+    
     async def search(self, query: str, limit: int = 5) -> List[Dict]:
         """
         Semantic search for relevant document chunks
@@ -130,11 +466,19 @@ class VectorStore:
             List of relevant chunk dictionaries
         """
         try:
-            # Generate query embedding
-            query_embedding = self.embedding_model.encode(query).tolist()
+            # BGE's tokenizer is uncased and splits on whitespace, so these
+            # spellings all embed identically and can share a cache entry
+            key = " ".join(query.lower().split())
+            try:
+                query_embedding = self._query_embeddings[key]
+            except KeyError:
+                # Encoded off the event loop, batched with concurrent searches
+                query_embedding = await self._query_batcher.submit(key)
+                self._query_embeddings[key] = query_embedding
             
-            # Search in ChromaDB
-            results = self.collection.query(
+            # Search in ChromaDB (blocking HNSW query, also off the event loop)
+            results = await asyncio.to_thread(
+                self.collection.query,
                 query_embeddings=[query_embedding],
                 n_results=limit,
                 include=['documents', 'metadatas', 'distances']
@@ -153,7 +497,7 @@ class VectorStore:
                         'text': doc,
                         'document': metadata.get('document', 'unknown'),
                         'page': metadata.get('page', 0),
-                        'images': json.loads(metadata.get('images', '[]')),
+                        'images': decode_images(metadata.get('images', '')),
                         'similarity': 1 - distance  # Convert distance to similarity
                     }
                     chunks.append(chunk)
@@ -175,17 +519,32 @@ class VectorStore:
         Returns:
             Number of chunks deleted
         """
+        return self.delete_documents([document_name])
+    
+    def delete_documents(self, document_names: List[str]) -> int:
+        """
+        Delete all chunks for several documents with a single delete call
+        
+        Args:
+            document_names: Names of the documents to delete
+            
+        Returns:
+            Number of chunks deleted
+        """
+        names = list(dict.fromkeys(document_names))
+        if not names:
+            return 0
+        
+        where = {"document": names[0]} if len(names) == 1 else {"document": {"$in": names}}
+        
         try:
-            # Get all chunks for this document
-            results = self.collection.get(
-                where={"document": document_name},
-                include=['ids']
-            )
+            # Collect matching ids, then delete them in one index write
+            results = self.collection.get(where=where, include=[])
             
             if results['ids']:
-                # Delete the chunks
                 self.collection.delete(ids=results['ids'])
-                logger.info(f"✅ Deleted {len(results['ids'])} chunks for document: {document_name}")
+                _bump_index_generation()
+                logger.info(f"✅ Deleted {len(results['ids'])} chunks for {len(names)} document(s)")
                 return len(results['ids'])
             
             return 0
@@ -201,8 +560,9 @@ class VectorStore:
             self.client.delete_collection("ragdemo_documents")
             self.collection = self.client.create_collection(
                 name="ragdemo_documents",
-                metadata={"hnsw:space": "cosine"}
+                metadata=collection_metadata(self.settings)
             )
+            _bump_index_generation()
             logger.info("✅ Cleared all documents from vector store")
             
         except Exception as e:
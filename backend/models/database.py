@@ -2,24 +2,76 @@
 Database models and initialization for RAG Demo
 Using SQLAlchemy with SQLite for simplicity
 """
-from sqlalchemy import create_engine, Column, Integer, String, Text, Boolean, DateTime, Float, ForeignKey
+from sqlalchemy import create_engine, event, Column, Integer, String, Text, Boolean, DateTime, Float, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.pool import QueuePool, StaticPool
 from datetime import datetime
+from typing import Dict, Iterable, Optional
 import json
+import orjson
 import os
+import threading
+import time
 
 from backend.core.config import get_settings
 
 settings = get_settings()
 
-# Create SQLite engine
+def _engine_options(database_url: str) -> Dict:
+    """
+    Connection and pool settings for the configured database
+    
+    Args:
+        database_url: SQLAlchemy database URL
+        
+    Returns:
+        Keyword arguments for create_engine
+    """
+    url = make_url(database_url)
+    if url.get_backend_name() != "sqlite":
+        return {"pool_pre_ping": True, "pool_recycle": 3600}
+    if url.database in (None, "", ":memory:"):
+        # One shared connection; a pooled in-memory database would be empty per connection
+        return {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}}
+    # Keep a connection per concurrent request open. Overflow connections are
+    # closed on return, so each one pays the file open and pragmas again
+    return {
+        "connect_args": {"check_same_thread": False},
+        "poolclass": QueuePool,
+        "pool_size": settings.max_concurrent_requests,
+        "max_overflow": settings.max_concurrent_requests
+    }
+
+# Create database engine
 engine = create_engine(
     settings.database_url,
-    connect_args={"check_same_thread": False},
-    echo=False
+    echo=False,
+    **_engine_options(settings.database_url)
 )
 
+# SQLite tuning applied to every new connection: WAL lets readers proceed
+# while a write is in progress
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA busy_timeout=5000",
+)
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in SQLITE_PRAGMAS:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -72,6 +124,22 @@ class Query(Base):
     rating = Column(String)  # 'good', 'bad', or NULL
     response_time_ms = Column(Integer)
     chunks_retrieved = Column(Integer)
+    
+    # SQLite and Postgres use the leading columns of a composite index on
+    # their own, so a separate single-column rating index would be redundant
+    __table_args__ = (
+        # Time-window metrics and history ordering
+        Index("ix_query_timestamp", "timestamp"),
+        # Rating filters (gaps, satisfaction) ordered by recency
+        Index("ix_query_rating_ts", "rating", timestamp.desc()),
+    )
+
+def load_json_list(value: str) -> list:
+    """Parse a JSON list stored on a Query record, tolerating bad data"""
+    try:
+        return orjson.loads(value) if value else []
+    except orjson.JSONDecodeError:
+        return []
 
 class Document(Base):
     """Document metadata table"""
@@ -86,6 +154,13 @@ class Document(Base):
     images_count = Column(Integer, default=0)  # Added default
     processed = Column(Boolean, default=False)  # Added processed status
     is_active = Column(Boolean, default=True)
+    
+    __table_args__ = (
+        # Lookups of active documents by filename
+        Index("ix_document_active_filename", "is_active", "filename"),
+        # Paginated active document listings, newest first
+        Index("ix_document_active_upload_date", "is_active", upload_date.desc()),
+    )
 
 class Config(Base):
     """System configuration table"""
@@ -114,6 +189,11 @@ def init_db():
     # Create all tables
     Base.metadata.create_all(bind=engine)
     
+    # create_all skips indexes on tables that already exist
+    for table in (Query.__table__, Document.__table__):
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    
     # Create session for initial data
     session = SessionLocal()
     
@@ -140,15 +220,17 @@ def init_db():
             )
             session.add(admin_user)
         
-        for key, value in default_configs:
-            existing = session.query(Config).filter(Config.key == key).first()
-            if not existing:
-                config_item = Config(
-                    key=key,
-                    value=value,
-                    updated_at=datetime.now().isoformat()
-                )
-                session.add(config_item)
+        # One INSERT for all defaults; keys that already exist keep their values
+        if engine.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        now = datetime.now().isoformat()
+        session.execute(
+            insert(Config)
+            .values([{"key": key, "value": value, "updated_at": now} for key, value in default_configs])
+            .on_conflict_do_nothing(index_elements=["key"])
+        )
         
         session.commit()
         
@@ -166,10 +248,74 @@ def get_db():
     finally:
         db.close()
 
+# In-process cache of config values: key -> (expires_at, value)
+CONFIG_CACHE_TTL_SECONDS = 60
+_config_cache: Dict[str, tuple] = {}
+_config_cache_lock = threading.Lock()
+# Bumped on every invalidation, so a read that started before it can't cache what it read
+_config_generation = 0
+
+def invalidate_config_cache(*keys: str):
+    """Drop cached config values (all of them when no keys are given)"""
+    global _config_generation
+    with _config_cache_lock:
+        _config_generation += 1
+        if not keys:
+            _config_cache.clear()
+        for key in keys:
+            _config_cache.pop(key, None)
+
+def get_config_values(db: Optional[SessionLocal], keys: Iterable[str]) -> Dict[str, str]:
+    """
+    Get several configuration values at once
+    
+    Cached values are served from memory; all misses are fetched with a
+    single SELECT ... WHERE key IN (...) query.
+    
+    Args:
+        db: Database session, or None to open one only on a cache miss
+        keys: Configuration keys to look up
+        
+    Returns:
+        Dictionary of key -> value for the keys that exist
+    """
+    now = time.monotonic()
+    values = {}
+    missing = []
+    
+    with _config_cache_lock:
+        generation = _config_generation
+        for key in keys:
+            cached = _config_cache.get(key)
+            if cached and cached[0] > now:
+                values[key] = cached[1]
+            else:
+                missing.append(key)
+    
+    if missing:
+        if db is None:
+            session = SessionLocal()
+            try:
+                rows = session.query(Config.key, Config.value).filter(Config.key.in_(missing)).all()
+            finally:
+                session.close()
+        else:
+            rows = db.query(Config.key, Config.value).filter(Config.key.in_(missing)).all()
+        expires_at = now + CONFIG_CACHE_TTL_SECONDS
+        with _config_cache_lock:
+            # An update committed during the SELECT may have been missed: return
+            # what was read, but don't cache it over the invalidation
+            store = generation == _config_generation
+            for key, value in rows:
+                if store:
+                    _config_cache[key] = (expires_at, value)
+                values[key] = value
+    
+    return values
+
 def get_config_value(db, key: str, default: str = None):
     """Get configuration value from database"""
-    config_item = db.query(Config).filter(Config.key == key).first()
-    return config_item.value if config_item else default
+    return get_config_values(db, [key]).get(key, default)
 
 def update_config_value(db, key: str, value: str):
     """Update configuration value in database"""
@@ -184,4 +330,5 @@ def update_config_value(db, key: str, value: str):
             updated_at=datetime.now().isoformat()
         )
         db.add(config_item)
-    db.commit()
\ No newline at end of file
+    db.commit()
+    invalidate_config_cache(key)
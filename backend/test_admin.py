@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Admin API Test Suite for RAG Demo
+Tests document upload handling and document listings
+"""
+
+import pytest
+import asyncio
+import io
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Add backend to Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+# The admin router imports the vector store, which needs the embedding stack
+pytest.importorskip("chromadb")
+pytest.importorskip("sentence_transformers")
+
+from fastapi import HTTPException
+
+from backend.api import admin
+from backend.core.config import get_settings
+from backend.models.database import Base, Document
+
+class FakeUpload:
+    """Minimal UploadFile: a name and an async read"""
+    
+    def __init__(self, filename: str, data: bytes):
+        self.filename = filename
+        self._data = io.BytesIO(data)
+    
+    async def read(self, size: int = -1) -> bytes:
+        return self._data.read(size)
+
+class FakeProcessor:
+    """PDF processor returning one chunk, or failing on request"""
+    
+    def __init__(self, fail: bool = False, failing=(), delay: float = 0):
+        self.fail = fail
+        self.failing = set(failing)
+        self.delay = delay
+        self.paths = []
+    
+    def process_pdf(self, pdf_path, document_name=None, use_pool=False):
+        self.paths.append(pdf_path)
+        if self.fail or document_name in self.failing:
+            raise RuntimeError("corrupt PDF")
+        time.sleep(self.delay)
+        text = Path(pdf_path).read_bytes().decode()
+        return [{"text": text, "document": document_name, "page": 1, "images": []}], 0
+
+class FakeVectorStore:
+    """Vector store keeping chunk texts per document, failing writes on request"""
+    
+    def __init__(self):
+        self.chunks = {}
+        self.deleted = []
+        self.fail = False
+    
+    def add_document_chunks(self, chunks):
+        if self.fail:
+            raise RuntimeError("embedding failed")
+        for chunk in chunks:
+            self.chunks.setdefault(chunk["document"], []).append(chunk["text"])
+        return len(chunks)
+    
+    def replace_document_chunks(self, document_name, chunks):
+        if self.fail:
+            raise RuntimeError("embedding failed")
+        self.chunks[document_name] = [chunk["text"] for chunk in chunks]
+        return len(chunks)
+    
+    def delete_document(self, document_name):
+        self.deleted.append(document_name)
+        return len(self.chunks.pop(document_name, []))
+
+class FakeBulkVectorStore:
+    """Vector store recording the chunks of one clear + bulk insert"""
+    
+    def __init__(self):
+        self.inserted = []
+        self._buffer = None
+    
+    def clear_all(self):
+        self.inserted = []
+    
+    def begin_bulk(self):
+        self._buffer = []
+    
+    def add_document_chunks_bulk(self, chunks):
+        if self._buffer is None:
+            raise RuntimeError("No bulk insert in progress, call begin_bulk() first")
+        self._buffer.extend(chunks)
+        return len(chunks)
+    
+    def finish_bulk(self):
+        buffer, self._buffer = self._buffer, None
+        self.inserted.extend(buffer or [])
+        return len(buffer or [])
+
+class TestDocumentUpload:
+    """Test /ingest staging and size limits"""
+    
+    @pytest.fixture
+    def test_db(self, tmp_path, monkeypatch):
+        """Temporary database, working directory and a 1 MB upload limit"""
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(get_settings(), "max_upload_size_mb", 1)
+        
+        engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+        Base.metadata.create_all(engine)
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        
+        yield SessionLocal
+        
+        engine.dispose()
+    
+    def ingest(self, SessionLocal, data, force=False, processor=None, vector_store=None):
+        db = SessionLocal()
+        try:
+            return asyncio.run(admin.ingest_document(
+                FakeUpload("guide.pdf", data),
+                force,
+                {},
+                db,
+                processor or FakeProcessor(),
+                vector_store or FakeVectorStore()
+            ))
+        finally:
+            db.close()
+    
+    def test_upload_is_stored_after_processing(self, test_db):
+        """Test a successful upload lands at its final path with no staging file left"""
+        processor = FakeProcessor()
+        result = self.ingest(test_db, b"%PDF v1", processor=processor)
+        
+        assert result["status"] == "success"
+        assert result["chunks_created"] == 1
+        assert processor.paths[0].endswith(".part")
+        assert os.listdir("data/pdfs") == ["guide.pdf"]
+        assert Path("data/pdfs/guide.pdf").read_bytes() == b"%PDF v1"
+    
+    def test_oversized_upload_rejected(self, test_db):
+        """Test uploads over the limit get 413 and leave nothing on disk"""
+        with pytest.raises(HTTPException) as exc_info:
+            self.ingest(test_db, b"x" * (1024 * 1024 + 1))
+        
+        assert exc_info.value.status_code == 413
+        assert os.listdir("data/pdfs") == []
+    
+    def test_oversized_reupload_keeps_existing_document(self, test_db):
+        """Test a forced re-upload over the limit leaves the current PDF and chunks alone"""
+        vector_store = FakeVectorStore()
+        self.ingest(test_db, b"%PDF v1", vector_store=vector_store)
+        
+        with pytest.raises(HTTPException) as exc_info:
+            self.ingest(test_db, b"x" * (1024 * 1024 + 1), force=True, vector_store=vector_store)
+        
+        assert exc_info.value.status_code == 413
+        assert vector_store.chunks == {"guide.pdf": ["%PDF v1"]}
+        assert vector_store.deleted == []
+        assert os.listdir("data/pdfs") == ["guide.pdf"]
+        assert Path("data/pdfs/guide.pdf").read_bytes() == b"%PDF v1"
+    
+    def test_failed_reprocess_keeps_existing_document(self, test_db):
+        """Test a forced re-upload that fails to process leaves the current PDF in place"""
+        self.ingest(test_db, b"%PDF v1")
+        
+        with pytest.raises(HTTPException) as exc_info:
+            self.ingest(test_db, b"%PDF v2", force=True, processor=FakeProcessor(fail=True))
+        
+        assert exc_info.value.status_code == 500
+        assert os.listdir("data/pdfs") == ["guide.pdf"]
+        assert Path("data/pdfs/guide.pdf").read_bytes() == b"%PDF v1"
+    
+    def test_failed_index_write_keeps_existing_chunks(self, test_db):
+        """Test a forced re-upload whose chunks fail to store keeps the current chunks and PDF"""
+        vector_store = FakeVectorStore()
+        self.ingest(test_db, b"%PDF v1", vector_store=vector_store)
+        vector_store.fail = True
+        
+        with pytest.raises(HTTPException) as exc_info:
+            self.ingest(test_db, b"%PDF v2", force=True, vector_store=vector_store)
+        
+        assert exc_info.value.status_code == 500
+        assert vector_store.chunks == {"guide.pdf": ["%PDF v1"]}
+        assert os.listdir("data/pdfs") == ["guide.pdf"]
+        assert Path("data/pdfs/guide.pdf").read_bytes() == b"%PDF v1"
+        db = test_db()
+        try:
+            assert db.query(Document.chunks_count).scalar() == 1
+        finally:
+            db.close()
+    
+    def test_forced_reupload_replaces_document(self, test_db):
+        """Test a successful forced re-upload replaces the PDF and the old chunks"""
+        vector_store = FakeVectorStore()
+        self.ingest(test_db, b"%PDF v1", vector_store=vector_store)
+        
+        self.ingest(test_db, b"%PDF v2", force=True, vector_store=vector_store)
+        
+        assert vector_store.chunks == {"guide.pdf": ["%PDF v2"]}
+        assert Path("data/pdfs/guide.pdf").read_bytes() == b"%PDF v2"
+        db = test_db()
+        try:
+            assert db.query(Document).count() == 1
+        finally:
+            db.close()
+    
+    def test_duplicate_upload_rejected(self, test_db):
+        """Test re-uploading without force_reprocess gets 409 before touching disk"""
+        self.ingest(test_db, b"%PDF v1")
+        
+        with pytest.raises(HTTPException) as exc_info:
+            self.ingest(test_db, b"%PDF v2")
+        
+        assert exc_info.value.status_code == 409
+        assert Path("data/pdfs/guide.pdf").read_bytes() == b"%PDF v1"
+
+class TestDocumentListing:
+    """Test paginated document listings"""
+    
+    @pytest.fixture
+    def test_db(self, tmp_path):
+        """Temporary database with four active documents and one deleted one"""
+        engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+        Base.metadata.create_all(engine)
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        
+        db = SessionLocal()
+        for day, size in ((1, 512), (2, 2048), (3, 3 * 1024 * 1024), (4, 4096)):
+            db.add(Document(
+                filename=f"doc{day}.pdf", file_path=f"data/pdfs/doc{day}.pdf", file_size=size,
+                upload_date=datetime(2024, 1, day), chunks_count=day, images_count=0
+            ))
+        db.add(Document(
+            filename="deleted.pdf", file_path="data/pdfs/deleted.pdf", file_size=1,
+            upload_date=datetime(2024, 2, 1), chunks_count=1, is_active=False
+        ))
+        db.commit()
+        db.close()
+        
+        yield SessionLocal
+        
+        engine.dispose()
+    
+    def list_documents(self, SessionLocal, limit, offset):
+        db = SessionLocal()
+        try:
+            return asyncio.run(admin.list_documents(limit, offset, {}, db))
+        finally:
+            db.close()
+    
+    def test_pages_are_newest_first(self, test_db):
+        """Test limit/offset pages walk active documents newest first"""
+        first = self.list_documents(test_db, 2, 0)
+        second = self.list_documents(test_db, 2, 2)
+        
+        assert [doc["name"] for doc in first["items"]] == ["doc4.pdf", "doc3.pdf"]
+        assert [doc["name"] for doc in second["items"]] == ["doc2.pdf", "doc1.pdf"]
+        assert self.list_documents(test_db, 2, 4)["items"] == []
+    
+    def test_total_counts_all_active_documents(self, test_db):
+        """Test total covers every active document, not just the page"""
+        page = self.list_documents(test_db, 1, 0)
+        
+        assert len(page["items"]) == 1
+        assert page["total"] == 4
+    
+    def test_items_are_formatted_for_display(self, test_db):
+        """Test sizes and dates are formatted as the admin UI shows them"""
+        items = {doc["name"]: doc for doc in self.list_documents(test_db, 10, 0)["items"]}
+        
+        assert "deleted.pdf" not in items
+        assert items["doc1.pdf"]["size"] == "0.5 KB"
+        assert items["doc3.pdf"]["size"] == "3.0 MB"
+        assert items["doc3.pdf"]["date"] == "2024-01-03"
+        assert items["doc3.pdf"]["chunks"] == 3
+
+class TestReindex:
+    """Test /re-index with a failing document"""
+    
+    @pytest.fixture
+    def test_db(self, tmp_path, monkeypatch):
+        """Temporary database with three documents on disk"""
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(get_settings(), "reindex_workers", 3)
+        
+        engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+        Base.metadata.create_all(engine)
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        
+        db = SessionLocal()
+        for name in ("good1.pdf", "bad.pdf", "good2.pdf"):
+            (tmp_path / name).write_bytes(b"%PDF")
+            db.add(Document(filename=name, file_path=str(tmp_path / name), file_size=4, chunks_count=1))
+        db.commit()
+        db.close()
+        
+        yield SessionLocal
+        
+        engine.dispose()
+    
+    def test_failed_document_does_not_drop_the_others(self, test_db):
+        """Test the other documents are indexed and the failure is reported"""
+        vector_store = FakeBulkVectorStore()
+        processor = FakeProcessor(failing={"bad.pdf"}, delay=0.05)
+        
+        db = test_db()
+        try:
+            result = asyncio.run(admin.reindex_knowledge_base({}, db, processor, vector_store))
+        finally:
+            db.close()
+        
+        assert sorted(chunk["document"] for chunk in vector_store.inserted) == ["good1.pdf", "good2.pdf"]
+        assert result["total_chunks"] == 2
+        assert result["documents_processed"] == 2
+        assert result["documents_failed"] == [{"document": "bad.pdf", "error": "corrupt PDF"}]
+        
+        db = test_db()
+        try:
+            counts = dict(db.query(Document.filename, Document.chunks_count).all())
+        finally:
+            db.close()
+        assert counts == {"good1.pdf": 1, "bad.pdf": 0, "good2.pdf": 1}
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Batched Inference Test Suite for RAG Demo
+Tests sequence bookkeeping of the continuous batching engine against a
+recording stand-in for the llama.cpp C API
+"""
+
+import pytest
+import asyncio
+import ctypes
+import sys
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# Add backend to Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from backend.core import batched_inference
+from backend.core.batched_inference import BatchedInferenceEngine, SAMPLING_DEFAULTS
+
+N_VOCAB = 256
+EOS = 0
+
+class llama_token_data(ctypes.Structure):
+    _fields_ = [("id", ctypes.c_int32), ("logit", ctypes.c_float), ("p", ctypes.c_float)]
+
+class llama_token_data_array(ctypes.Structure):
+    _fields_ = [("data", ctypes.POINTER(llama_token_data)), ("size", ctypes.c_size_t), ("sorted", ctypes.c_bool)]
+
+class RecordingLlamaCpp:
+    """The llama_cpp functions the engine calls, recording decodes and KV operations"""
+    
+    llama_token = ctypes.c_int32
+    llama_token_data_array = llama_token_data_array
+    llama_token_data_p = ctypes.POINTER(llama_token_data)
+    
+    def __init__(self):
+        self.decodes = []
+        self.kv_copies = []
+        self.kv_removals = []
+        self.samplers = []
+        self.logits = (ctypes.c_float * N_VOCAB)()
+    
+    def llama_context_default_params(self):
+        return SimpleNamespace()
+    
+    def llama_new_context_with_model(self, model, params):
+        self.context_params = params
+        return object()
+    
+    def llama_batch_init(self, n_tokens, embd, n_seq_max):
+        return SimpleNamespace(
+            token=[0] * n_tokens, pos=[0] * n_tokens, n_seq_id=[0] * n_tokens,
+            seq_id=[[0] for _ in range(n_tokens)], logits=[False] * n_tokens, n_tokens=0
+        )
+    
+    def llama_batch_free(self, batch):
+        pass
+    
+    def llama_free(self, ctx):
+        pass
+    
+    def llama_decode(self, ctx, batch):
+        self.decodes.append([
+            (batch.token[i], batch.pos[i], batch.seq_id[i][0], bool(batch.logits[i]))
+            for i in range(batch.n_tokens)
+        ])
+        return 0
+    
+    def llama_get_logits_ith(self, ctx, i):
+        return ctypes.cast(self.logits, ctypes.POINTER(ctypes.c_float))
+    
+    def llama_kv_cache_seq_cp(self, ctx, src, dst, p0, p1):
+        self.kv_copies.append((src, dst, p0, p1))
+    
+    def llama_kv_cache_seq_rm(self, ctx, seq_id, p0, p1):
+        self.kv_removals.append((seq_id, p0, p1))
+    
+    def llama_token_is_eog(self, model, token):
+        return token == EOS
+    
+    def llama_sample_repetition_penalties(self, ctx, candidates, last_tokens, n, penalty, freq, present):
+        self.samplers.append(("repetition_penalties", n, penalty))
+    
+    def llama_sample_top_k(self, ctx, candidates, k, min_keep):
+        array = candidates._obj
+        self.candidates = [(array.data[i].id, array.data[i].logit) for i in range(array.size)]
+        self.samplers.append(("top_k", k))
+    
+    def llama_sample_top_p(self, ctx, candidates, p, min_keep):
+        self.samplers.append(("top_p", p))
+    
+    def llama_sample_min_p(self, ctx, candidates, p, min_keep):
+        self.samplers.append(("min_p", p))
+    
+    def llama_sample_temp(self, ctx, candidates, temp):
+        self.samplers.append(("temp", temp))
+    
+    def llama_sample_token(self, ctx, candidates):
+        self.samplers.append(("token",))
+        return 7
+    
+    def llama_sample_token_greedy(self, ctx, candidates):
+        self.samplers.append(("greedy",))
+        return 9
+
+class FakeLlama:
+    """Model handle: one token per character"""
+    
+    model = object()
+    
+    def n_vocab(self):
+        return N_VOCAB
+    
+    def detokenize(self, tokens):
+        return bytes(tokens)
+
+def tokenize(text):
+    return list(text.encode("ascii"))
+
+class ScriptedEngine(BatchedInferenceEngine):
+    """Engine whose sampler replays a fixed reply per prompt, then EOS"""
+    
+    replies = {}
+    
+    def _sample(self, seq, batch_index):
+        reply = self.replies.get(seq.prompt, "")
+        return reply.encode("ascii")[seq.n_generated] if seq.n_generated < len(reply) else EOS
+
+class GatedEngine(ScriptedEngine):
+    """Scripted engine that holds its second sample until the gate opens"""
+    
+    def __init__(self, *args, **kwargs):
+        self.gate = threading.Event()
+        super().__init__(*args, **kwargs)
+    
+    def _sample(self, seq, batch_index):
+        if seq.n_generated >= 1:
+            self.gate.wait(5)
+        return super()._sample(seq, batch_index)
+
+RUNTIME = {'n_batch': 64, 'n_ubatch': 64, 'n_threads': 1, 'n_threads_batch': 1}
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for the inference thread"
+        time.sleep(0.01)
+
+async def collect(engine, prompt, prefix=""):
+    return "".join([piece async for piece in engine.generate(prompt, prefix=prefix, max_tokens=50)])
+
+class TestBatchedInferenceEngine:
+    """Test sequence positions, prefix sharing, cancellation and sampling"""
+    
+    @pytest.fixture
+    def fake(self, monkeypatch):
+        """Recording llama_cpp module"""
+        fake = RecordingLlamaCpp()
+        monkeypatch.setattr(batched_inference, "llama_cpp", fake, raising=False)
+        return fake
+    
+    @pytest.fixture
+    def engine(self, fake):
+        """Running scripted engine with two sequence slots"""
+        engine = ScriptedEngine(FakeLlama(), 2, RUNTIME, tokenize=tokenize)
+        yield engine
+        engine.close()
+    
+    def positions(self, fake, seq_id):
+        return [pos for decode in fake.decodes for _, pos, sid, _ in decode if sid == seq_id]
+    
+    def test_context_sized_per_sequence(self, fake, engine):
+        """Test the context holds one full window per sequence plus the prefix sequence"""
+        assert fake.context_params.n_ctx == batched_inference.SEQ_CTX * 2
+        assert fake.context_params.n_seq_max == 3
+    
+    def test_concurrent_sequences_keep_their_own_positions(self, fake, engine):
+        """Test each sequence is positioned from 0 and advances one step per decode"""
+        engine.replies = {"abc": "xy", "hello": "z"}
+        
+        async def run():
+            return await asyncio.gather(collect(engine, "abc"), collect(engine, "hello"))
+        
+        assert asyncio.run(run()) == ["xy", "z"]
+        
+        seq_ids = {sid for decode in fake.decodes for _, _, sid, _ in decode}
+        assert seq_ids == {0, 1}
+        # Prompt tokens from 0, then one step per sampled token until EOS:
+        # "abc" + "xy" decodes positions 0-4, "hello" + "z" positions 0-5
+        assert sorted((self.positions(fake, sid) for sid in seq_ids), key=len) == [
+            [0, 1, 2, 3, 4],
+            [0, 1, 2, 3, 4, 5]
+        ]
+        
+        # Of the prompt tokens only the last asks for logits; every step does
+        for sid in seq_ids:
+            flags = [want for decode in fake.decodes for _, _, entry_sid, want in decode if entry_sid == sid]
+            prompt_length = 3 if len(flags) == 5 else 5
+            assert flags == [False] * (prompt_length - 1) + [True] * (len(flags) - prompt_length + 1)
+        
+        # Finished sequences release their KV cells and slots
+        wait_until(lambda: len(engine._free_seq_ids) == 2)
+        assert {seq_id for seq_id, _, _ in fake.kv_removals} >= {0, 1}
+    
+    def test_shared_prefix_is_evaluated_once_and_copied(self, fake, engine):
+        """Test the prefix KV is computed into the reserved sequence and copied per request"""
+        engine.replies = {"SYS:one": "a", "SYS:two": "b"}
+        
+        async def run():
+            return await asyncio.gather(
+                collect(engine, "SYS:one", prefix="SYS:"),
+                collect(engine, "SYS:two", prefix="SYS:")
+            )
+        
+        assert asyncio.run(run()) == ["a", "b"]
+        
+        prefix_seq_id = engine._prefix_seq_id
+        assert self.positions(fake, prefix_seq_id) == [0, 1, 2, 3]
+        assert sorted(dst for src, dst, _, _ in fake.kv_copies if src == prefix_seq_id) == [0, 1]
+        
+        # Requests only prefill what follows the prefix, continuing its positions
+        for seq_id in (0, 1):
+            assert self.positions(fake, seq_id)[:3] == [4, 5, 6]
+        
+        # A later request with the same prefix reuses it without re-evaluating
+        decodes_before = len(fake.decodes)
+        engine.replies = {"SYS:three": "c"}
+        assert asyncio.run(collect(engine, "SYS:three", prefix="SYS:")) == "c"
+        later = [entry for decode in fake.decodes[decodes_before:] for entry in decode]
+        assert all(seq_id != prefix_seq_id for _, _, seq_id, _ in later)
+    
+    def test_cancelled_consumer_frees_sequence(self, fake):
+        """Test closing the stream stops decoding and returns the slot"""
+        engine = GatedEngine(FakeLlama(), 2, RUNTIME, tokenize=tokenize)
+        engine.replies = {"go": "x" * 40}
+        try:
+            async def run():
+                stream = engine.generate("go", max_tokens=50)
+                first = await stream.__anext__()
+                await stream.aclose()
+                engine.gate.set()
+                return first
+            
+            assert asyncio.run(run()) == "x"
+            wait_until(lambda: len(engine._free_seq_ids) == 2 and not engine._active)
+            
+            seq_id = fake.decodes[0][0][2]
+            assert (seq_id, -1, -1) in fake.kv_removals
+            # Prefill and one step; the sequence is dropped before decoding further
+            assert self.positions(fake, seq_id) == [0, 1, 2]
+        finally:
+            engine.close()
+    
+    def test_max_tokens_limits_generation(self, fake, engine):
+        """Test generation stops at max_tokens"""
+        engine.replies = {"go": "abcdef"}
+        
+        async def run():
+            return "".join([piece async for piece in engine.generate("go", max_tokens=3)])
+        
+        assert asyncio.run(run()) == "abc"
+    
+    def test_sampling_uses_llama_cpp_samplers(self, fake):
+        """Test sampling runs llama.cpp's samplers in Llama.sample order with its defaults"""
+        engine = BatchedInferenceEngine(FakeLlama(), 1, RUNTIME, tokenize=tokenize)
+        try:
+            seq = batched_inference._Sequence("p", "", {**SAMPLING_DEFAULTS, 'max_tokens': 5, 'stop': ()}, None)
+            seq.tokens = [1, 2, 3]
+            
+            assert engine._sample(seq, 0) == 7
+            assert fake.samplers == [
+                ("top_k", 40), ("top_p", 0.95), ("min_p", 0.05), ("temp", 0.8), ("token",)
+            ]
+            
+            fake.samplers.clear()
+            seq.params = {**seq.params, 'temperature': 0.0, 'repeat_penalty': 1.1}
+            assert engine._sample(seq, 0) == 9
+            assert fake.samplers == [("repetition_penalties", 3, 1.1), ("greedy",)]
+        finally:
+            engine.close()
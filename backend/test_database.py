@@ -16,6 +16,7 @@ from sqlalchemy.orm import sessionmaker
 sys.path.append(str(Path(__file__).parent.parent))
 
 from backend.models.database import Base, User, Config, Document, ChatMessage, init_db
+from backend.models.database import get_config_value, get_config_values, update_config_value
 from backend.utils.auth import get_password_hash
 
 class TestDatabase:
@@ -55,6 +56,22 @@ class TestDatabase:
         finally:
             db.close()
     
+    def test_query_and_document_indexes(self, test_db):
+        """Test indexes used by the metrics, analysis and admin queries"""
+        db = test_db()
+        try:
+            from sqlalchemy import inspect
+            inspector = inspect(db.bind)
+            
+            query_indexes = {index["name"] for index in inspector.get_indexes("queries")}
+            assert {"ix_query_timestamp", "ix_query_rating_ts"} <= query_indexes
+            
+            document_indexes = {index["name"] for index in inspector.get_indexes("documents")}
+            assert {"ix_document_active_filename", "ix_document_active_upload_date"} <= document_indexes
+            
+        finally:
+            db.close()
+    
     def test_user_model(self, test_db):
         """Test User model CRUD operations"""
         db = test_db()
@@ -115,6 +132,56 @@ class TestDatabase:
         finally:
             db.close()
     
+    def test_config_value_cache(self, test_db):
+        """Test cached config lookups and invalidation on update"""
+        db = test_db()
+        try:
+            update_config_value(db, "cache_test_a", "1")
+            update_config_value(db, "cache_test_b", "2")
+            
+            values = get_config_values(db, ["cache_test_a", "cache_test_b", "cache_test_missing"])
+            assert values == {"cache_test_a": "1", "cache_test_b": "2"}
+            
+            # Cache hits need no session
+            assert get_config_values(None, ["cache_test_b"]) == {"cache_test_b": "2"}
+            
+            # Changes made behind the cache's back are not seen until invalidation
+            db.query(Config).filter(Config.key == "cache_test_a").first().value = "stale"
+            db.commit()
+            assert get_config_value(db, "cache_test_a") == "1"
+            
+            update_config_value(db, "cache_test_a", "3")
+            assert get_config_value(db, "cache_test_a") == "3"
+            assert get_config_value(db, "cache_test_missing", "default") == "default"
+            
+        finally:
+            db.close()
+    
+    def test_config_read_racing_an_update_is_not_cached(self, test_db):
+        """Test a read whose SELECT ran before an update's invalidation doesn't cache the old value"""
+        db = test_db()
+        try:
+            update_config_value(db, "race_test", "old")
+            
+            class RacingSession:
+                """Session whose SELECT returns the old row while an update lands"""
+                
+                def query(self, *columns):
+                    return self
+                
+                def filter(self, *criteria):
+                    return self
+                
+                def all(self):
+                    update_config_value(db, "race_test", "new")
+                    return [("race_test", "old")]
+            
+            assert get_config_values(RacingSession(), ["race_test"]) == {"race_test": "old"}
+            assert get_config_value(db, "race_test") == "new"
+            
+        finally:
+            db.close()
+    
     def test_document_model(self, test_db):
         """Test Document model operations"""
         db = test_db()
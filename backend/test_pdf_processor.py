@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+PDF Processor Test Suite for RAG Demo
+Tests page-by-page streaming chunking, page tracking and the worker pool
+"""
+
+import pytest
+import os
+import sys
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+# Add backend to Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+fitz = pytest.importorskip("fitz")
+
+from backend.core import pdf_processor
+from backend.core.config import get_settings
+from backend.core.pdf_processor import PDFProcessor
+
+def reference_windows(words, chunk_size, chunk_overlap):
+    """Start offsets of the windows the whole-document chunker produced"""
+    step = max(1, chunk_size - chunk_overlap)
+    starts = [0]
+    while starts[-1] + chunk_size < len(words):
+        starts.append(starts[-1] + step)
+    return starts
+
+class TestStreamingChunking:
+    """Test _create_chunks against whole-document windowing"""
+    
+    @pytest.fixture
+    def processor(self, tmp_path, monkeypatch):
+        """Processor with small chunks, writing images under a temp directory"""
+        monkeypatch.chdir(tmp_path)
+        processor = PDFProcessor()
+        processor.chunk_size = 5
+        processor.chunk_overlap = 2
+        return processor
+    
+    def pages(self, *word_counts):
+        """Pages of numbered words, e.g. p2w0 for the first word on page 2"""
+        return [
+            {'page': page, 'text': ' '.join(f"p{page}w{i}" for i in range(count))}
+            for page, count in enumerate(word_counts, start=1)
+        ]
+    
+    def test_windows_span_page_boundaries(self, processor):
+        """Test chunks match whole-document windows and take their first word's page"""
+        page_texts = self.pages(4, 7, 3)
+        words = [word for page in page_texts for word in page['text'].split()]
+        word_pages = [page['page'] for page in page_texts for _ in page['text'].split()]
+        
+        chunks = processor._create_chunks(page_texts, "doc.pdf", {})
+        
+        starts = reference_windows(words, 5, 2)
+        assert [chunk['text'] for chunk in chunks] == [' '.join(words[s:s + 5]) for s in starts]
+        assert [chunk['page'] for chunk in chunks] == [word_pages[s] for s in starts]
+        assert [chunk['id'] for chunk in chunks] == [f"doc.pdf_chunk_{i}" for i in range(1, len(starts) + 1)]
+        assert [chunk['word_count'] for chunk in chunks] == [len(words[s:s + 5]) for s in starts]
+    
+    def test_page_longer_than_several_windows(self, processor):
+        """Test a single long page is cut into overlapping windows"""
+        chunks = processor._create_chunks(self.pages(12), "doc.pdf", {})
+        
+        assert [chunk['text'].split()[0] for chunk in chunks] == ["p1w0", "p1w3", "p1w6", "p1w9"]
+        assert chunks[-1]['text'] == "p1w9 p1w10 p1w11"
+        assert {chunk['page'] for chunk in chunks} == {1}
+    
+    def test_short_document_is_one_chunk(self, processor):
+        """Test a document within chunk_size yields a single chunk"""
+        chunks = processor._create_chunks(self.pages(2, 2), "doc.pdf", {})
+        
+        assert len(chunks) == 1
+        assert chunks[0]['text'] == "p1w0 p1w1 p2w0 p2w1"
+        assert chunks[0]['page'] == 1
+    
+    def test_blank_pages_are_skipped(self, processor):
+        """Test pages without words neither produce chunks nor shift page numbers"""
+        page_texts = self.pages(3, 0, 6)
+        page_texts[1]['text'] = "   \n  "
+        
+        chunks = processor._create_chunks(page_texts, "doc.pdf", {})
+        
+        assert [chunk['text'].split()[0] for chunk in chunks] == ["p1w0", "p3w0", "p3w3"]
+        assert [chunk['page'] for chunk in chunks] == [1, 3, 3]
+        assert all("p2" not in chunk['text'] for chunk in chunks)
+        assert processor._create_chunks(self.pages(0, 0), "doc.pdf", {}) == []
+    
+    def test_chunks_carry_images_of_adjacent_pages(self, processor):
+        """Test each chunk lists images from its page and the pages next to it"""
+        images_by_page = {1: ["a.png"], 2: ["b.png"], 4: ["d.png"]}
+        
+        chunks = processor._create_chunks(self.pages(5, 5, 5, 5), "doc.pdf", images_by_page)
+        by_page = {chunk['page']: chunk['images'] for chunk in chunks}
+        
+        assert by_page[1] == ["a.png", "b.png"]
+        assert by_page[3] == ["b.png", "d.png"]
+        assert by_page[4] == ["d.png"]
+    
+    def test_process_pdf_chunks_each_page(self, processor, tmp_path):
+        """Test a real PDF is chunked with the page of each chunk's first word"""
+        pdf_path = tmp_path / "guide.pdf"
+        with fitz.open() as pdf_document:
+            for page_num in range(1, 4):
+                page = pdf_document.new_page()
+                page.insert_text((72, 72), ' '.join(f"p{page_num}w{i}" for i in range(4)))
+            pdf_document.save(pdf_path)
+        
+        chunks, images = processor.process_pdf(str(pdf_path))
+        
+        assert images == 0
+        assert [chunk['text'].split()[0] for chunk in chunks] == ["p1w0", "p1w3", "p2w2", "p3w1"]
+        assert [chunk['page'] for chunk in chunks] == [1, 1, 2, 3]
+        assert all(chunk['document'] == "guide.pdf" for chunk in chunks)
+
+class TestWorkerPool:
+    """Test page extraction survives a dead worker process"""
+    
+    @pytest.fixture
+    def processor(self, tmp_path, monkeypatch):
+        """Processor using a fresh single-worker pool"""
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(get_settings(), "pdf_workers", 1)
+        pdf_processor.get_pdf_pool.cache_clear()
+        yield PDFProcessor()
+        pdf_processor.get_pdf_pool().shutdown(cancel_futures=True)
+        pdf_processor.get_pdf_pool.cache_clear()
+    
+    @pytest.fixture
+    def pdf_path(self, tmp_path):
+        """Two-page PDF"""
+        path = tmp_path / "guide.pdf"
+        with fitz.open() as pdf_document:
+            for page_num in range(1, 3):
+                pdf_document.new_page().insert_text((72, 72), f"page {page_num}")
+            pdf_document.save(path)
+        return str(path)
+    
+    def test_broken_pool_is_replaced(self, processor, pdf_path):
+        """Test a pool whose worker died is discarded and the extraction retried"""
+        broken = pdf_processor.get_pdf_pool()
+        with pytest.raises(BrokenProcessPool):
+            broken.submit(os._exit, 1).result()
+        
+        chunks, _ = processor.process_pdf(pdf_path, use_pool=True)
+        
+        assert chunks[0]['text'] == "page 1 page 2"
+        assert pdf_processor.get_pdf_pool() is not broken
+        # Later calls keep using the new pool
+        assert processor.process_pdf(pdf_path, use_pool=True)[0] == chunks
+    
+    def test_falls_back_to_in_process_extraction(self, processor, pdf_path, monkeypatch):
+        """Test pages are read in process when the pool breaks twice"""
+        attempts = []
+        
+        def broken_pool(path, page_count):
+            attempts.append(path)
+            raise BrokenProcessPool("worker died")
+        
+        monkeypatch.setattr(pdf_processor, "_extract_in_pool", broken_pool)
+        
+        chunks, _ = processor.process_pdf(pdf_path, use_pool=True)
+        
+        assert len(attempts) == 2
+        assert chunks[0]['text'] == "page 1 page 2"
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Performance Optimizer Test Suite for RAG Demo
+Tests result cache eviction, tag invalidation and sharded counters
+"""
+
+import pytest
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Add backend to Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from backend.core import performance_optimizer as po
+from backend.core.performance_optimizer import CacheEntry, PerformanceOptimizer, ShardedCounter, ValueAwareCache
+
+def entry(cost=1, ttl=60, result=None):
+    return CacheEntry(ttl, cost, result)
+
+class TestValueAwareCache:
+    """Test v-LRU eviction and recency tracking"""
+    
+    def test_evicts_least_recently_used_first(self):
+        """Test a full cache with a one-entry window evicts the oldest entry"""
+        cache = ValueAwareCache(maxsize=5)
+        for key in "abcde":
+            cache[key] = entry()
+        
+        cache["f"] = entry()
+        
+        assert sorted(cache.keys()) == ["b", "c", "d", "e", "f"]
+    
+    def test_reads_refresh_recency(self):
+        """Test reading an entry keeps it over entries read less recently"""
+        cache = ValueAwareCache(maxsize=5)
+        for key in "abcde":
+            cache[key] = entry()
+        cache["a"]
+        cache["b"]
+        
+        cache["f"] = entry()
+        
+        assert "c" not in cache
+        assert {"a", "b"} <= set(cache.keys())
+    
+    def test_evicts_lowest_value_in_window(self, monkeypatch):
+        """Test the cheapest entry among the least recently used is evicted"""
+        monkeypatch.setattr(po, "EVICTION_WINDOW", 0.5)
+        cache = ValueAwareCache(maxsize=4)
+        cache["search"] = entry(cost=po.COST_SEARCH)
+        cache["config"] = entry(cost=po.COST_CONFIG)
+        cache["recent1"] = entry()
+        cache["recent2"] = entry()
+        
+        cache["new"] = entry()
+        
+        assert "config" not in cache
+        assert "search" in cache
+    
+    def test_hits_raise_an_entrys_value(self, monkeypatch):
+        """Test an often hit entry outlives an equally cheap one of the same age"""
+        monkeypatch.setattr(po, "EVICTION_WINDOW", 0.5)
+        cache = ValueAwareCache(maxsize=4)
+        popular = entry()
+        cache["popular"] = popular
+        cache["once"] = entry()
+        cache["recent1"] = entry()
+        cache["recent2"] = entry()
+        popular.hits = 5
+        
+        cache["new"] = entry()
+        
+        assert "once" not in cache
+        assert "popular" in cache
+    
+    def test_expired_entries_make_room_first(self):
+        """Test an expired entry is dropped instead of evicting a live one"""
+        cache = ValueAwareCache(maxsize=3)
+        cache["short"] = entry(ttl=0.01)
+        cache["a"] = entry()
+        cache["b"] = entry()
+        time.sleep(0.05)
+        
+        cache["c"] = entry()
+        
+        assert sorted(cache.keys()) == ["a", "b", "c"]
+        
+        # The next eviction skips the expired key's recency record and drops it
+        cache["d"] = entry()
+        assert sorted(cache.keys()) == ["b", "c", "d"]
+        assert list(cache._recency) == ["b", "c", "d"]
+    
+    def test_deleted_and_cleared_entries_leave_recency(self):
+        """Test recency records follow deletes, pops and clear"""
+        cache = ValueAwareCache(maxsize=5)
+        for key in "abc":
+            cache[key] = entry()
+        
+        del cache["a"]
+        cache.pop("b")
+        assert list(cache._recency) == ["c"]
+        
+        cache.clear()
+        assert len(cache) == 0
+        assert not cache._recency
+
+class TestResultCache:
+    """Test cached results, hit counters and tag invalidation"""
+    
+    @pytest.fixture
+    def optimizer(self):
+        return PerformanceOptimizer()
+    
+    def test_cache_hits_and_misses(self, optimizer):
+        """Test lookups return cached results and count hits and misses"""
+        optimizer.cache_result("search:a", ["chunk"])
+        
+        assert optimizer.get_cached_result("search:a") == ["chunk"]
+        assert optimizer.get_cached_result("search:b") is None
+        assert optimizer.cache_hits.value() == 1
+        assert optimizer.cache_misses.value() == 1
+        assert optimizer.cache["search:a"].hits == 1
+    
+    def test_invalidate_tag_drops_only_tagged_results(self, optimizer):
+        """Test invalidating a document drops the searches that returned it"""
+        optimizer.cache_result("search:a", ["a"], tags={"guide.pdf"})
+        optimizer.cache_result("search:b", ["a", "b"], tags={"guide.pdf", "faq.pdf"})
+        optimizer.cache_result("search:c", ["c"], tags={"faq.pdf"})
+        
+        assert optimizer.invalidate_tag("guide.pdf") == 2
+        
+        assert optimizer.get_cached_result("search:a") is None
+        assert optimizer.get_cached_result("search:b") is None
+        assert optimizer.get_cached_result("search:c") == ["c"]
+        assert optimizer.invalidate_tag("guide.pdf") == 0
+    
+    def test_invalidate_tag_skips_evicted_results(self, optimizer):
+        """Test invalidation only counts results still in the cache"""
+        optimizer.cache = ValueAwareCache(maxsize=2)
+        optimizer.cache_result("search:a", ["a"], tags={"guide.pdf"})
+        optimizer.cache_result("search:b", ["b"], tags={"guide.pdf"})
+        optimizer.cache_result("search:c", ["c"])  # Evicts search:a
+        
+        assert optimizer.invalidate_tag("guide.pdf") == 1
+        assert list(optimizer.cache.keys()) == ["search:c"]
+    
+    def test_tag_index_is_pruned(self, optimizer, monkeypatch):
+        """Test index entries of evicted results are swept once the index outgrows the cache"""
+        monkeypatch.setattr(po, "RESULT_CACHE_SIZE", 2)
+        optimizer.cache = ValueAwareCache(maxsize=2)
+        for i in range(6):
+            optimizer.cache_result(f"search:{i}", [i], tags={f"doc{i}.pdf"})
+        
+        assert optimizer._tag_entries <= 2 * po.RESULT_CACHE_SIZE
+        
+        optimizer.clear_expired_cache()
+        assert set(optimizer._tag_index) == {"doc4.pdf", "doc5.pdf"}
+        assert optimizer._tag_entries == 2
+
+class TestShardedCounter:
+    """Test counters updated from many threads"""
+    
+    def test_concurrent_threads_lose_no_updates(self):
+        """Test more live threads than initial slots each get their own slot"""
+        counter = ShardedCounter()
+        threads = po.COUNTER_SHARDS * 2
+        started = threading.Barrier(threads)
+        
+        def work():
+            counter.inc()
+            started.wait()
+            for _ in range(1000):
+                counter.inc()
+        
+        workers = [threading.Thread(target=work) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        
+        assert counter.value() == threads * 1001
+        assert len(counter._slots) >= threads
@@ -10,8 +10,19 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 from backend.core.config import get_settings
 
+settings = get_settings()
+
+# Token lifetime and accepted algorithms, fixed for the process like the settings
+TOKEN_LIFETIME = timedelta(hours=settings.jwt_expiration_hours)
+JWT_ALGORITHMS = [settings.jwt_algorithm]
+
+# bcrypt cost for new hashes (2^rounds iterations). 10 is the OWASP minimum and
+# a quarter of the default 12's CPU per login; existing hashes carry their own
+# cost and still verify
+BCRYPT_ROUNDS = 10
+
 # Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=BCRYPT_ROUNDS, deprecated="auto")
 
 # JWT token scheme
 security = HTTPBearer()
@@ -35,13 +46,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     Returns:
         Encoded JWT token
     """
-    settings = get_settings()
-    
     to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(hours=settings.jwt_expiration_hours)
+    expire = datetime.utcnow() + (expires_delta or TOKEN_LIFETIME)
     
     to_encode.update({"exp": expire})
     
@@ -63,13 +69,11 @@ def verify_token(token: str) -> Optional[dict]:
     Returns:
         Decoded token payload or None if invalid
     """
-    settings = get_settings()
-    
     try:
         payload = jwt.decode(
             token, 
             settings.jwt_secret, 
-            algorithms=[settings.jwt_algorithm]
+            algorithms=JWT_ALGORITHMS
         )
         return payload
     except jwt.PyJWTError:
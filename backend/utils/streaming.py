@@ -1,7 +1,7 @@
 """
 Server-Sent Events streaming utilities
 """
-import json
+import orjson
 import asyncio
 from typing import AsyncGenerator, Dict, Any
 
@@ -41,11 +41,8 @@ async def generate_stream_response(query: str, context: str, llm_client, vector_
         # Stream content generation
         yield format_sse_data("status", {"status": "generating"})
         
-        full_response = ""
         async for token in llm_client.generate_stream(query, context):
-            full_response += token
             yield format_sse_data("content", {"content": token})
-            await asyncio.sleep(0.01)
         
         # Send metadata
         yield format_sse_data("sources", {"sources": sources})
@@ -78,7 +75,7 @@ def format_sse_data(event_type: str, data: Dict[Any, Any]) -> str:
     data["type"] = event_type
     
     # Format as SSE
-    return f"data: {json.dumps(data)}\\n\\n"
+    return f"data: {orjson.dumps(data).decode()}\n\n"
 
 def create_heartbeat_generator(interval: float = 30.0) -> AsyncGenerator[str, None]:
     """
@@ -0,0 +1,34 @@
+#!/usr/bin/env bash
+# Rebuild llama-cpp-python from source for the CPU this host actually has.
+#
+# The prebuilt wheels target a conservative instruction baseline (AVX2), which
+# leaves the int8 dot-product kernels used by Q4/Q5 quantized models on the
+# table on AVX-512 VNNI capable CPUs (Ice Lake+, Zen 4). Run this on the
+# deployment machine itself -- a native build is not portable to older CPUs.
+#
+# Usage:
+#   scripts/build_llama_cpp.sh            # native build
+#   LLAMA_BLAS=1 scripts/build_llama_cpp.sh  # also link OpenBLAS for faster prefill
+set -euo pipefail
+
+LLAMA_CPP_VERSION="${LLAMA_CPP_VERSION:-0.2.90}"
+
+# llama.cpp renamed its build options from LLAMA_* to GGML_* in mid-2024;
+# the pinned version only understands the GGML_* spelling.
+cmake_args="-DGGML_NATIVE=on -DGGML_FMA=on -DGGML_F16C=on"
+
+if grep -q avx512f /proc/cpuinfo 2>/dev/null; then
+    cmake_args="$cmake_args -DGGML_AVX512=on"
+    grep -q avx512_vnni /proc/cpuinfo && cmake_args="$cmake_args -DGGML_AVX512_VNNI=on"
+    grep -q avx512_bf16 /proc/cpuinfo && cmake_args="$cmake_args -DGGML_AVX512_BF16=on"
+fi
+
+if [ "${LLAMA_BLAS:-0}" = "1" ]; then
+    cmake_args="$cmake_args -DGGML_BLAS=on -DGGML_BLAS_VENDOR=OpenBLAS"
+fi
+
+echo "🔄 Building llama-cpp-python ${LLAMA_CPP_VERSION} with: ${cmake_args}"
+CMAKE_ARGS="$cmake_args" FORCE_CMAKE=1 pip install \
+    --force-reinstall --no-cache-dir --no-binary llama-cpp-python \
+    "llama-cpp-python==${LLAMA_CPP_VERSION}"
+echo "✅ llama-cpp-python rebuilt for this CPU"